@@ -11,9 +11,23 @@ from flask import Flask
 import os
 import sys
 
+# مجموعات إعدادات التطبيق المقروءة من config.py - إعدادات Flask العامة
+# فيه (MAX_CONTENT_LENGTH، الجلسة، DEBUG) لا تحمل حتى لا يتغير سلوك الرفع والجلسات
+CONFIG_PREFIXES = ('DB_', 'POS_', 'INVOICE_', 'REPORTS_', 'DASHBOARD_', 'STOCK_',
+                   'EVENTS_', 'JOB_', 'BACKUP_')
+
 def create_app():
     """إنشاء تطبيق Flask"""
     app = Flask(__name__)
+    
+    # تحميل إعدادات التطبيق الافتراضية من config.py إن وجد
+    try:
+        from config import Config
+        app.config.from_mapping({key: getattr(Config, key) for key in dir(Config)
+                                 if key.startswith(CONFIG_PREFIXES)})
+    except ImportError:
+        pass
+    
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
     
     # إعداد مسارات الملفات
@@ -24,14 +38,26 @@ def create_app():
         app.config['DATABASE'] = os.path.join(os.path.dirname(__file__), '..', 'inventory.db')
     
     # تهيئة قاعدة البيانات
-    from .models.database import init_db, close_db
+    from .models.database import init_db, close_db, get_db
+    from .models.jobs import cleanup_jobs
     with app.app_context():
         try:
             init_db()
+            # مهام بقيت جارية من تشغيل سابق لن تكتمل أبداً
+            cleanup_jobs(get_db())
         except Exception as e:
             print(f"Database warning: {e}")
     app.teardown_appcontext(close_db)
     
+    # أوامر سطر الأوامر (flask rebuild-rollups، flask backup، flask restore-backup، flask stock-snapshot)
+    from .models.rollups import rebuild_rollups_command
+    from .models.backups import backup_command, restore_backup_command
+    from .models.stock_ledger import stock_snapshot_command
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(backup_command)
+    app.cli.add_command(restore_backup_command)
+    app.cli.add_command(stock_snapshot_command)
+    
     # تسجيل المعالجات
     from .utils.context_processors import inject_store_settings
     app.context_processor(inject_store_settings)
@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+"""
+النسخ الاحتياطي والاستعادة
+
+النسخة تؤخذ أثناء عمل المتجر عبر sqlite3 backup() على دفعات من الصفحات.
+اتصال المصدر يفتح معاملة قراءة أولاً، فتنسخ كل الدفعات من نفس اللقطة
+(في وضع WAL لا يحجب ذلك عمليات البيع، ولا تعاد النسخة من البداية كلما
+كتب عامل آخر). الملف الناتج يضغط (zstd إن كانت zstandard مثبتة وإلا gzip)
+ويحفظ بجانبه ملف وصف JSON فيه مجموع SHA-256، ويحذف الأقدم بعد BACKUP_KEEP.
+
+الاستعادة تفك النسخة إلى ملف مؤقت وتتحقق من المجموع وسلامة الملف وترقي
+مخططه، ثم تنسخه إلى قاعدة البيانات الحية بـ backup() في معاملة كتابة واحدة:
+إما أن يرى كل الاتصالات المفتوحة (في كل العمليات) البيانات المستعادة كاملة
+أو القديمة كاملة - بدون استبدال الملف تحت الاتصالات المفتوحة وملف WAL.
+
+النسخة التزايدية (mode=incremental) تحفظ فقط الصفوف التي تغيرت منذ آخر
+نسخة حسب change_log، كملف JSON سطري مضغوط يشير إلى النسخة السابقة
+ومجموعها. الاستعادة تتبع السلسلة حتى النسخة الكاملة وتتحقق من كل حلقة
+ثم تعيد تطبيق التغييرات بالترتيب.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+from .barcodes import invalidate_sku_index
+from .change_log import (TRACKED_TABLES, SMALL_TABLES, get_change_seq, get_backup_state,
+                         set_backup_state)
+from .database import get_db
+from .migrations import MIGRATIONS, apply_migrations, get_schema_version
+from .rollups import rebuild_rollups
+from .search import rebuild_search_index
+from .stock_alerts import rebuild_low_stock
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+# امتداد الملف حسب نوع النسخة ونوع الضغط
+EXTENSIONS = {
+    (FULL, 'zstd'): '.db.zst',
+    (FULL, 'gzip'): '.db.gz',
+    (INCREMENTAL, 'zstd'): '.changes.zst',
+    (INCREMENTAL, 'gzip'): '.changes.gz',
+}
+
+# عدد الصفوف المقروءة في كل استعلام عند إنشاء النسخة التزايدية
+CHANGES_BATCH_SIZE = 500
+
+# حجم الأجزاء عند الضغط وفك الضغط وحساب المجموع
+_CHUNK_SIZE = 1024 * 1024
+
+BACKUP_NAME_RE = re.compile(r'^backup_\d{8}_\d{6}(?:_[a-z_]+)?\.(?:db|changes)\.(?:zst|gz)$')
+
+# يمنع تفرع السلسلة إذا بدأت نسختان معاً في نفس العملية
+_backup_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    """تعذر إنشاء النسخة الاحتياطية أو استعادتها"""
+
+
+def backup_dir():
+    """مجلد النسخ الاحتياطية"""
+    directory = current_app.config.get('BACKUP_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(current_app.config['DATABASE'])), 'backups')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _compression():
+    compression = current_app.config.get('BACKUP_COMPRESSION') or ('zstd' if ZSTD_AVAILABLE else 'gzip')
+    if compression == 'zstd' and not ZSTD_AVAILABLE:
+        compression = 'gzip'
+    return compression
+
+
+def _compression_of(name):
+    return 'zstd' if name.endswith('.zst') else 'gzip'
+
+
+def _open_compressed(path, mode, compression):
+    """فتح ملف مضغوط للقراءة ('rb') أو الكتابة ('wb')"""
+    if compression == 'zstd':
+        raw = open(path, mode)
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(raw, closefd=True)
+    return gzip.open(path, mode, compresslevel=6)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(path):
+    return path + '.json'
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=current_app.config.get('DB_BUSY_TIMEOUT', 5000) / 1000)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _read_manifest(path):
+    with open(_manifest_path(path), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest.setdefault('kind', FULL)
+    return manifest
+
+
+def _write_manifest(path, manifest):
+    with open(_manifest_path(path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def _new_name(kind, compression, label=None):
+    created = datetime.now()
+    name = f"backup_{created.strftime('%Y%m%d_%H%M%S')}"
+    if label:
+        name += f'_{label}'
+    name += EXTENSIONS[(kind, compression)]
+    if os.path.exists(os.path.join(backup_dir(), name)):
+        raise BackupError('توجد نسخة احتياطية بنفس الاسم، حاول بعد ثانية')
+    return name, created.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _record_chain(manifest):
+    """تسجيل النسخة كآخر حلقة في السلسلة وحذف سجلات التغيير التي غطتها"""
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        set_backup_state(db, manifest['backup_name'], manifest['change_seq'], manifest['sha256'])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _snapshot_copy(source_path, target_path, progress=None):
+    """نسخ قاعدة البيانات إلى ملف على دفعات من لقطة قراءة واحدة
+
+    يرجع (إصدار المخطط، رقم آخر تغيير) كما كانا في اللقطة.
+    """
+    pages = current_app.config.get('BACKUP_PAGES', 4096)
+    pause = current_app.config.get('BACKUP_STEP_SLEEP', 0.005)
+
+    def step(status, remaining, total):
+        if progress:
+            progress(1 - remaining / total if total else 1)
+        if pause and remaining:
+            time.sleep(pause)
+
+    source = _connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        # معاملة القراءة تثبت اللقطة طوال النسخ
+        source.execute('BEGIN')
+        schema_version = get_schema_version(source)
+        change_seq = get_change_seq(source)
+        source.backup(target, pages=pages, progress=step)
+        source.rollback()
+        # ملف مستقل بدون WAL
+        target.execute('PRAGMA journal_mode = DELETE')
+        return schema_version, change_seq
+    finally:
+        target.close()
+        source.close()
+
+
+def _prune(directory, keep):
+    """حذف أقدم النسخ الكاملة بعد عدد الاحتفاظ، والنسخ التزايدية المبنية عليها"""
+    names = sorted((name for name in os.listdir(directory) if BACKUP_NAME_RE.match(name)), reverse=True)
+    full = [name for name in names if '.db.' in name]
+    kept = set(full[:keep])
+    for name in names:
+        path = os.path.join(directory, name)
+        if name in kept:
+            continue
+        if name not in full:
+            try:
+                if _read_manifest(path).get('base') in kept:
+                    continue
+            except (OSError, ValueError):
+                pass
+        for leftover in (path, _manifest_path(path)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def create_backup(label=None, progress=None):
+    """إنشاء نسخة احتياطية كاملة مضغوطة وإرجاع وصفها (الاسم، الحجم، المجموع...)
+
+    label: لاحقة اختيارية لاسم الملف (مثل pre_restore)
+    progress: دالة اختيارية تستدعى بنسبة النسخ (0-1) بعد كل دفعة
+    """
+    with _backup_lock:
+        directory = backup_dir()
+        compression = _compression()
+        name, created_at = _new_name(FULL, compression, label)
+        path = os.path.join(directory, name)
+
+        fd, snapshot_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        partial_path = path + '.part'
+        try:
+            schema_version, change_seq = _snapshot_copy(current_app.config['DATABASE'], snapshot_path, progress)
+            database_size = os.path.getsize(snapshot_path)
+            with open(snapshot_path, 'rb') as source, _open_compressed(partial_path, 'wb', compression) as target:
+                shutil.copyfileobj(source, target, _CHUNK_SIZE)
+            os.replace(partial_path, path)
+        finally:
+            for leftover in (snapshot_path, partial_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        manifest = {
+            'backup_name': name,
+            'kind': FULL,
+            'created_at': created_at,
+            'size': os.path.getsize(path),
+            'database_size': database_size,
+            'sha256': _sha256(path),
+            'compression': compression,
+            'schema_version': schema_version,
+            'change_seq': change_seq,
+        }
+        _write_manifest(path, manifest)
+        _record_chain(manifest)
+        _prune(directory, current_app.config.get('BACKUP_KEEP', 10))
+        return manifest
+
+
+def _write_changes(source, target, from_seq, to_seq):
+    """كتابة الصفوف المتغيرة (حالتها في اللقطة أو حذفها) والجداول الصغيرة - يرجع عدد الصفوف"""
+    def write(record):
+        target.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    changed = {}
+    for row in source.execute('''
+        SELECT DISTINCT table_name, row_id FROM change_log
+        WHERE seq > ? AND seq <= ?
+        ORDER BY table_name, row_id
+    ''', (from_seq, to_seq)):
+        changed.setdefault(row['table_name'], []).append(row['row_id'])
+
+    count = 0
+    for table in TRACKED_TABLES:
+        row_ids = changed.get(table)
+        if not row_ids:
+            continue
+        columns = [column['name'] for column in source.execute(f'PRAGMA table_info({table})')]
+        write({'op': 'columns', 'table': table, 'columns': columns})
+        for start in range(0, len(row_ids), CHANGES_BATCH_SIZE):
+            batch = row_ids[start:start + CHANGES_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            rows = {row[0]: row for row in source.execute(
+                f'SELECT rowid, {", ".join(columns)} FROM {table} WHERE rowid IN ({placeholders})', batch)}
+            for row_id in batch:
+                row = rows.get(row_id)
+                if row is None:
+                    write({'op': 'delete', 'table': table, 'rowid': row_id})
+                else:
+                    write({'op': 'upsert', 'table': table, 'values': list(row)[1:]})
+        count += len(row_ids)
+
+    for table in SMALL_TABLES:
+        columns = [column['name'] for column in source.execute(f'PRAGMA table_info({table})')]
+        rows = [list(row) for row in source.execute(f'SELECT {", ".join(columns)} FROM {table}')]
+        write({'op': 'replace', 'table': table, 'columns': columns, 'rows': rows})
+    return count
+
+
+def create_incremental_backup():
+    """إنشاء نسخة تزايدية بالصفوف التي تغيرت منذ آخر نسخة وإرجاع وصفها
+
+    إذا لم توجد نسخة سابقة صالحة في السلسلة (أو تغير المخطط بعدها) تنشأ
+    نسخة كاملة بدلاً منها.
+    """
+    with _backup_lock:
+        directory = backup_dir()
+        source = _connect(current_app.config['DATABASE'])
+        try:
+            # كل القراءات من لقطة واحدة: سجل التغييرات والصفوف نفسها
+            source.execute('BEGIN')
+            state = get_backup_state(source)
+            schema_version = get_schema_version(source)
+            parent_path = get_backup_path(state['backup_name']) if state else None
+            parent = _read_manifest(parent_path) if parent_path else None
+            if (parent is None or parent['sha256'] != state['sha256']
+                    or parent.get('schema_version') != schema_version):
+                parent = None
+            else:
+                compression = _compression()
+                name, created_at = _new_name(INCREMENTAL, compression)
+                path = os.path.join(directory, name)
+                partial_path = path + '.part'
+                to_seq = get_change_seq(source)
+                header = {
+                    'op': 'header',
+                    'parent': parent['backup_name'],
+                    'parent_sha256': parent['sha256'],
+                    'from_seq': state['change_seq'],
+                    'to_seq': to_seq,
+                    'schema_version': schema_version,
+                }
+                try:
+                    with io.TextIOWrapper(_open_compressed(partial_path, 'wb', compression),
+                                          encoding='utf-8') as target:
+                        target.write(json.dumps(header) + '\n')
+                        changed_rows = _write_changes(source, target, state['change_seq'], to_seq)
+                    os.replace(partial_path, path)
+                finally:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+            source.rollback()
+        finally:
+            source.close()
+
+    if parent is None:
+        return create_backup()
+
+    manifest = {
+        'backup_name': name,
+        'kind': INCREMENTAL,
+        'created_at': created_at,
+        'size': os.path.getsize(path),
+        'sha256': _sha256(path),
+        'compression': compression,
+        'schema_version': schema_version,
+        'parent': parent['backup_name'],
+        'parent_sha256': parent['sha256'],
+        'base': parent.get('base', parent['backup_name']),
+        'change_seq': to_seq,
+        'changed_rows': changed_rows,
+    }
+    _write_manifest(path, manifest)
+    _record_chain(manifest)
+    return manifest
+
+
+def list_backups():
+    """النسخ الاحتياطية المتوفرة من الأحدث إلى الأقدم"""
+    directory = backup_dir()
+    backups = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not BACKUP_NAME_RE.match(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            manifest = _read_manifest(path)
+        except (OSError, ValueError):
+            # نسخة بدون ملف وصف - تعرض بدون مجموع تحقق
+            manifest = {
+                'backup_name': name,
+                'kind': FULL if '.db.' in name else INCREMENTAL,
+                'created_at': datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S'),
+                'size': os.path.getsize(path),
+                'sha256': None,
+                'compression': _compression_of(name),
+            }
+        backups.append(manifest)
+    return backups
+
+
+def get_backup_path(name):
+    """المسار الكامل لنسخة احتياطية بالاسم، أو None إذا كان الاسم غير صالح أو غير موجود"""
+    if not name or not BACKUP_NAME_RE.match(name):
+        return None
+    path = os.path.join(backup_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def _verified_manifest(path):
+    """وصف النسخة بعد التحقق من مجموعها"""
+    try:
+        manifest = _read_manifest(path)
+    except (OSError, ValueError):
+        raise BackupError('ملف وصف النسخة الاحتياطية مفقود أو تالف')
+    if not manifest.get('sha256') or _sha256(path) != manifest['sha256']:
+        raise BackupError(f'مجموع التحقق غير مطابق - النسخة الاحتياطية تالفة: {manifest["backup_name"]}')
+    return manifest
+
+
+def _backup_chain(name):
+    """سلسلة النسخ من النسخة الكاملة حتى النسخة المطلوبة بعد التحقق من كل حلقة"""
+    chain = []
+    while True:
+        path = get_backup_path(name)
+        if path is None:
+            if chain:
+                raise BackupError(f'حلقة مفقودة في سلسلة النسخ الاحتياطية: {name}')
+            raise BackupError('النسخة الاحتياطية غير موجودة')
+        manifest = _verified_manifest(path)
+        if chain and chain[-1][1]['parent_sha256'] != manifest['sha256']:
+            raise BackupError(f'سلسلة النسخ الاحتياطية غير متطابقة عند {name}')
+        chain.append((path, manifest))
+        if manifest['kind'] == FULL:
+            break
+        if len(chain) > 10000:
+            raise BackupError('سلسلة النسخ الاحتياطية طويلة جداً')
+        name = manifest['parent']
+    chain.reverse()
+    return chain
+
+
+def _replay(staged, path):
+    """إعادة تطبيق نسخة تزايدية على قاعدة بيانات مؤقتة (بدون commit)"""
+    columns = {}
+    with io.TextIOWrapper(_open_compressed(path, 'rb', _compression_of(path)), encoding='utf-8') as source:
+        for line in source:
+            record = json.loads(line)
+            op = record['op']
+            if op == 'header':
+                continue
+            table = record['table']
+            if table not in TRACKED_TABLES and table not in SMALL_TABLES:
+                raise BackupError(f'جدول غير معروف في النسخة التزايدية: {table}')
+            if op == 'columns':
+                columns[table] = record['columns']
+            elif op == 'upsert':
+                names = columns[table]
+                staged.execute(f'INSERT OR REPLACE INTO {table} ({", ".join(names)}) '
+                               f'VALUES ({",".join("?" * len(names))})', record['values'])
+            elif op == 'delete':
+                staged.execute(f'DELETE FROM {table} WHERE rowid = ?', (record['rowid'],))
+            elif op == 'replace':
+                names = record['columns']
+                staged.execute(f'DELETE FROM {table}')
+                staged.executemany(f'INSERT INTO {table} ({", ".join(names)}) '
+                                   f'VALUES ({",".join("?" * len(names))})', record['rows'])
+
+
+def _stage(chain, staged_path):
+    """بناء قاعدة البيانات المستعادة في ملف مؤقت: فك النسخة الكاملة والتحقق منها
+    ثم تطبيق النسخ التزايدية وترقية المخطط"""
+    path = chain[0][0]
+    compression = _compression_of(path)
+    if any(_compression_of(link) == 'zstd' for link, _ in chain) and not ZSTD_AVAILABLE:
+        raise BackupError('مكتبة zstandard غير متوفرة لفك ضغط هذه النسخة')
+    with _open_compressed(path, 'rb', compression) as source, open(staged_path, 'wb') as target:
+        shutil.copyfileobj(source, target, _CHUNK_SIZE)
+
+    staged = _connect(staged_path)
+    try:
+        try:
+            result = staged.execute('PRAGMA quick_check').fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f'ملف النسخة الاحتياطية ليس قاعدة بيانات صالحة: {e}')
+        if result != 'ok':
+            raise BackupError(f'فشل فحص سلامة النسخة الاحتياطية: {result}')
+        if get_schema_version(staged) > MIGRATIONS[-1][0]:
+            raise BackupError('النسخة الاحتياطية من إصدار أحدث من النظام الحالي')
+
+        if len(chain) > 1:
+            staged.execute('BEGIN IMMEDIATE')
+            try:
+                for link, _ in chain[1:]:
+                    _replay(staged, link)
+                rebuild_rollups(staged)
+                # INSERT OR REPLACE لا يشغل trigger الحذف فيبقى فهرس البحث قديماً
+                if staged.execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'").fetchone():
+                    rebuild_search_index(staged)
+                if staged.execute("SELECT 1 FROM sqlite_master WHERE name = 'low_stock_items'").fetchone():
+                    rebuild_low_stock(staged)
+                staged.commit()
+            except Exception:
+                staged.rollback()
+                raise
+        apply_migrations(staged)
+    finally:
+        staged.close()
+
+
+def _finish_restore(live, manifest, catalog_before, settings_before):
+    """بعد الاستعادة: رفع أرقام إصدارات الكتالوج والإعدادات فوق ما رأته العمليات
+    والأجهزة قبلها (حتى تعيد التحميل)، وبدء السلسلة من النسخة المستعادة"""
+    live.execute('BEGIN IMMEDIATE')
+    try:
+        catalog_after = live.execute("SELECT version FROM sync_state WHERE name = 'catalog'").fetchone()
+        catalog_version = max(catalog_before, catalog_after[0] if catalog_after else 0) + 1
+        live.execute("UPDATE sync_state SET version = ? WHERE name = 'catalog'", (catalog_version,))
+        # row_version يتغير فلا تعمل triggers الإصدار
+        live.execute('UPDATE items SET row_version = ?', (catalog_version,))
+        live.execute('UPDATE categories SET row_version = ?', (catalog_version,))
+        live.execute('UPDATE settings_versions SET version = version + ?', (settings_before + 1,))
+        # البيانات الحية الآن مطابقة للنسخة المستعادة
+        live.execute('DELETE FROM change_log')
+        set_backup_state(live, manifest['backup_name'], get_change_seq(live), manifest['sha256'])
+        live.commit()
+    except Exception:
+        live.rollback()
+        raise
+
+
+def restore_backup(name):
+    """استعادة نسخة احتياطية (كاملة أو تزايدية مع سلسلتها) إلى قاعدة البيانات الحية
+
+    تؤخذ نسخة من البيانات الحالية أولاً (pre_restore) وترجع في الوصف.
+    """
+    chain = _backup_chain(name)
+    manifest = chain[-1][1]
+
+    directory = backup_dir()
+    fd, staged_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        _stage(chain, staged_path)
+        safety = create_backup(label='pre_restore')
+
+        live = _connect(current_app.config['DATABASE'])
+        staged = _connect(staged_path)
+        try:
+            catalog_before = live.execute("SELECT version FROM sync_state WHERE name = 'catalog'").fetchone()
+            settings_before = live.execute('SELECT COALESCE(MAX(version), 0) FROM settings_versions').fetchone()[0]
+            # دفعة واحدة = معاملة كتابة واحدة على القاعدة الحية
+            staged.backup(live)
+            _finish_restore(live, manifest, catalog_before[0] if catalog_before else 0, settings_before)
+        finally:
+            staged.close()
+            live.close()
+    finally:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+
+    g.pop('settings_versions', None)
+    invalidate_sku_index()
+    return {'backup_name': name, 'chain_length': len(chain), 'safety_backup': safety['backup_name']}
+
+
+@click.command('backup')
+@click.option('--incremental', is_flag=True, help='نسخة تزايدية بالتغييرات منذ آخر نسخة')
+@with_appcontext
+def backup_command(incremental):
+    """إنشاء نسخة احتياطية (مناسب للجدولة عبر cron)"""
+    backup = create_incremental_backup() if incremental else create_backup()
+    click.echo(f"{backup['backup_name']} ({backup['kind']}, {backup['size']} bytes)")
+
+
+@click.command('restore-backup')
+@click.argument('name')
+@with_appcontext
+def restore_backup_command(name):
+    """استعادة نسخة احتياطية بالاسم (تعيد تطبيق سلسلة النسخ التزايدية)"""
+    try:
+        result = restore_backup(name)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"تمت الاستعادة ({result['chain_length']} نسخة). نسخة البيانات السابقة: {result['safety_backup']}")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+البحث بالباركود و SKU عند نقطة البيع
+
+كل عملية تحتفظ بفهرس في الذاكرة: رمز (SKU أو باركود من item_barcodes) ->
+رقم الصنف، ولقطة مختصرة للصنف تحمل عند أول بحث عنه. الفهرس يبنى مرة
+واحدة ثم يحدث تزايدياً برقم إصدار الكتالوج: الأصناف التي row_version لها
+أكبر من إصدار الفهرس ومحذوفاتها في catalog_tombstones - نفس آلية مزامنة
+أجهزة نقطة البيع. كل مسارات
+الكتابة (الأصناف، الاستيراد، المشتريات، البيع، تعديل المخزون) ترفع الإصدار
+عبر triggers، وتغيير الباركود يختم الصنف نفسه، فيكفي التحقق من رقم الإصدار
+(استعلام واحد بالمفتاح الأساسي) قبل كل بحث.
+"""
+
+import re
+import threading
+
+# أقصى عدد رموز في طلب البحث الجماعي
+MAX_BATCH_CODES = 200
+
+_SNAPSHOT_SQL = '''
+    SELECT i.id, i.name, i.sku,
+           (SELECT group_concat(b.barcode, char(10)) FROM item_barcodes b WHERE b.item_id = i.id) AS barcodes,
+           CASE WHEN i.selling_price > 0 THEN i.selling_price ELSE i.cost_price END AS price,
+           i.quantity, i.reorder_level, i.category_id
+    FROM items i
+'''
+
+_lock = threading.Lock()
+_version = None
+# رمز -> رقم الصنف. رمز حذف أو نقل قد يبقى هنا، لذلك يتحقق البحث من أن
+# الرمز ما زال في لقطة الصنف
+_codes = {}
+# رقم الصنف -> اللقطة (تحمل عند أول بحث عن الصنف)
+_items = {}
+
+
+class BarcodeError(Exception):
+    """باركود غير صالح أو مستخدم لصنف آخر"""
+
+
+def normalize_code(code):
+    """الرمز كما يحفظ ويبحث عنه (بدون مسافات في الطرفين)"""
+    return str(code or '').strip()
+
+
+def parse_barcodes(text):
+    """قائمة الباركودات من نص النموذج (سطر أو فاصلة لكل باركود) بدون تكرار"""
+    barcodes = []
+    for code in re.split(r'[\n,;]+', text or ''):
+        code = normalize_code(code)
+        if code and code not in barcodes:
+            barcodes.append(code)
+    return barcodes
+
+
+def get_item_barcodes(db, item_id):
+    """الباركودات الإضافية لصنف"""
+    return [row['barcode'] for row in db.execute(
+        'SELECT barcode FROM item_barcodes WHERE item_id = ? ORDER BY id', (item_id,))]
+
+
+def set_item_barcodes(db, item_id, barcodes):
+    """استبدال باركودات الصنف (بدون commit)
+
+    الباركود لا يجوز أن يطابق SKU أو باركود صنف آخر - وإلا يرفع BarcodeError.
+    """
+    barcodes = [normalize_code(code) for code in barcodes if normalize_code(code)]
+    if barcodes:
+        placeholders = ','.join('?' * len(barcodes))
+        conflict = db.execute(f'''
+            SELECT barcode AS code, item_id FROM item_barcodes
+            WHERE barcode IN ({placeholders}) AND item_id != ?
+            UNION ALL
+            SELECT sku, id FROM items WHERE sku IN ({placeholders}) AND id != ?
+            LIMIT 1
+        ''', [*barcodes, item_id, *barcodes, item_id]).fetchone()
+        if conflict:
+            raise BarcodeError(f'الباركود {conflict["code"]} مستخدم لصنف آخر')
+
+    current = set(get_item_barcodes(db, item_id))
+    removed = current - set(barcodes)
+    if removed:
+        placeholders = ','.join('?' * len(removed))
+        db.execute(f'DELETE FROM item_barcodes WHERE item_id = ? AND barcode IN ({placeholders})',
+                   [item_id, *removed])
+    db.executemany('INSERT INTO item_barcodes (item_id, barcode) VALUES (?, ?)',
+                   [(item_id, code) for code in barcodes if code not in current])
+
+
+def _catalog_version(db):
+    row = db.execute("SELECT version FROM sync_state WHERE name = 'catalog'").fetchone()
+    return row[0] if row else 0
+
+
+def _code_pairs(db, condition='1=1', params=()):
+    """أزواج (الرمز، رقم الصنف): الباركودات أولاً ثم SKU حتى يغلب SKU عند التعارض"""
+    # صفوف tuple بدلاً من sqlite3.Row - أسرع بكثير عند بناء الفهرس لكل الأصناف
+    cursor = db.cursor()
+    cursor.row_factory = None
+    yield from cursor.execute(f'''
+        SELECT b.barcode, b.item_id FROM item_barcodes b
+        JOIN items i ON i.id = b.item_id
+        WHERE {condition}
+    ''', params)
+    yield from cursor.execute(f'SELECT i.sku, i.id FROM items i WHERE i.sku IS NOT NULL AND {condition}', params)
+
+
+def _rebuild(db):
+    global _codes, _items
+    # استبدال المراجع دفعة واحدة حتى لا يرى البحث فهرساً نصف مبني
+    _codes, _items = dict(_code_pairs(db)), {}
+
+
+def _apply_changes(db, since):
+    changed_count = db.execute('SELECT COUNT(*) FROM items WHERE row_version > ?', (since,)).fetchone()[0]
+    if changed_count > len(_codes) // 2:
+        # تغيير شامل (استيراد كبير أو استعادة نسخة) - البناء من جديد أسرع
+        _rebuild(db)
+        return
+
+    for row in db.execute('SELECT id FROM items WHERE row_version > ?', (since,)):
+        _items.pop(row[0], None)
+    for row in db.execute(
+            "SELECT entity_id FROM catalog_tombstones WHERE entity = 'item' AND version > ?", (since,)):
+        _items.pop(row[0], None)
+    _codes.update(_code_pairs(db, 'i.row_version > ?', (since,)))
+
+
+def _refresh(db):
+    """مزامنة الفهرس مع رقم إصدار الكتالوج في معاملة القراءة الحالية"""
+    global _version
+    version = _catalog_version(db)
+    if _version is None or version < _version:
+        _rebuild(db)
+    elif version != _version:
+        _apply_changes(db, _version)
+    _version = version
+
+
+def _load_snapshots(db, item_ids):
+    for start in range(0, len(item_ids), MAX_BATCH_CODES):
+        batch = item_ids[start:start + MAX_BATCH_CODES]
+        placeholders = ','.join('?' * len(batch))
+        for row in db.execute(_SNAPSHOT_SQL + f' WHERE i.id IN ({placeholders})', batch):
+            snapshot = dict(row)
+            snapshot['barcodes'] = snapshot['barcodes'].split('\n') if snapshot['barcodes'] else []
+            _items[row['id']] = snapshot
+
+
+def _owns(snapshot, code):
+    return snapshot is not None and (snapshot['sku'] == code or code in snapshot['barcodes'])
+
+
+def lookup_codes(db, codes):
+    """لقطات الأصناف لعدة رموز: {الرمز: لقطة الصنف أو None}"""
+    # الإصدار والرموز واللقطات من نفس معاملة القراءة - فلا تحفظ لقطة أقدم من الفهرس
+    started = not db.in_transaction
+    if started:
+        db.execute('BEGIN')
+    try:
+        with _lock:
+            _refresh(db)
+            item_ids = {code: _codes.get(normalize_code(code)) for code in codes}
+            _load_snapshots(db, list({item_id for item_id in item_ids.values()
+                                      if item_id is not None and item_id not in _items}))
+            snapshots = {code: _items.get(item_id) for code, item_id in item_ids.items()}
+    finally:
+        if started:
+            db.rollback()
+    return {code: dict(snapshot) if _owns(snapshot, normalize_code(code)) else None
+            for code, snapshot in snapshots.items()}
+
+
+def lookup_code(db, code):
+    """لقطة الصنف صاحب SKU أو الباركود، أو None"""
+    return lookup_codes(db, [code])[code]
+
+
+def invalidate_sku_index():
+    """إجبار إعادة بناء الفهرس عند البحث التالي"""
+    global _version
+    _version = None
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+مزامنة الكتالوج
+
+كل تعديل على الأصناف أو الفئات يرفع رقم إصدار الكتالوج (عبر triggers)
+ويختم الصف المعدل بهذا الرقم في row_version. المحذوفات تسجل في
+catalog_tombstones. يكفي للجهاز أن يحتفظ بآخر رقم إصدار ويطلب ما تغير بعده.
+"""
+
+
+def get_catalog_version(db):
+    """رقم إصدار الكتالوج الحالي"""
+    row = db.execute("SELECT version FROM sync_state WHERE name = 'catalog'").fetchone()
+    return row['version'] if row else 0
+
+
+def get_catalog_changes(db, since=0):
+    """الأصناف والفئات التي تغيرت أو حذفت بعد الإصدار since
+
+    تقرأ كل البيانات من لقطة واحدة (معاملة قراءة) حتى يتطابق رقم
+    الإصدار المرجع مع الصفوف المرجعة.
+    """
+    started = not db.in_transaction
+    if started:
+        db.execute('BEGIN')
+    try:
+        version = get_catalog_version(db)
+        items = db.execute('''
+            SELECT i.id, i.name, i.sku, i.quantity, i.reorder_level,
+                   i.cost_price, i.selling_price,
+                   CASE WHEN i.selling_price > 0 THEN i.selling_price ELSE i.cost_price END AS price,
+                   i.category_id, c.name AS category_name, i.row_version
+            FROM items i
+            LEFT JOIN categories c ON c.id = i.category_id
+            WHERE i.row_version > ?
+            ORDER BY i.row_version
+        ''', (since,)).fetchall()
+        categories = db.execute('''
+            SELECT id, name, description, row_version
+            FROM categories
+            WHERE row_version > ?
+            ORDER BY row_version
+        ''', (since,)).fetchall()
+        tombstones = db.execute('''
+            SELECT entity, entity_id FROM catalog_tombstones
+            WHERE version > ?
+        ''', (since,)).fetchall()
+    finally:
+        if started:
+            db.rollback()
+
+    return {
+        'version': version,
+        'since': since,
+        'items': [dict(row) for row in items],
+        'categories': [dict(row) for row in categories],
+        'deleted': {
+            'items': [row['entity_id'] for row in tombstones if row['entity'] == 'item'],
+            'categories': [row['entity_id'] for row in tombstones if row['entity'] == 'category'],
+        },
+    }
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+سجل التغييرات للنسخ الاحتياطي التزايدي
+
+triggers على الجداول المتتبعة تسجل في change_log اسم الجدول ورقم الصف
+(rowid) لكل إدراج أو تعديل أو حذف - بدون نسخ البيانات نفسها. النسخة
+التزايدية تقرأ الصفوف المسجلة بعد آخر نسخة وتحفظ حالتها الحالية (أو
+حذفها)، ثم تحذف السجلات التي غطتها. backup_state يحفظ آخر نسخة في
+السلسلة ورقم آخر سجل غطته.
+"""
+
+# الجداول المتتبعة صفاً صفاً
+TRACKED_TABLES = ('items', 'categories', 'invoices', 'sales', 'purchases', 'purchase_items', 'item_barcodes',
+                  'stock_movements')
+
+# جداول صغيرة تحفظ كاملة في كل نسخة تزايدية بدلاً من تتبعها
+SMALL_TABLES = ('users', 'settings', 'settings_versions', 'invoice_sequences', 'invoice_number_blocks')
+
+
+def change_log_triggers(table):
+    """أوامر إنشاء triggers تسجيل التغييرات لجدول (تستخدم في الترقيات)"""
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_change_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO change_log (table_name, row_id) VALUES ('{table}', {ref}.rowid);
+        END'''
+        for event, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ]
+
+
+def get_change_seq(db):
+    """رقم آخر سجل تغيير (لا يعاد استخدامه بعد حذف السجلات)"""
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def get_backup_state(db):
+    """آخر نسخة احتياطية في السلسلة (الاسم، رقم آخر تغيير، المجموع) أو None"""
+    row = db.execute('SELECT backup_name, change_seq, sha256 FROM backup_state WHERE id = 1').fetchone()
+    return dict(row) if row else None
+
+
+def set_backup_state(db, backup_name, change_seq, sha256):
+    """تسجيل آخر نسخة وحذف سجلات التغيير التي غطتها (بدون commit)"""
+    db.execute('''
+        INSERT INTO backup_state (id, backup_name, change_seq, sha256) VALUES (1, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            backup_name = excluded.backup_name,
+            change_seq = excluded.change_seq,
+            sha256 = excluded.sha256
+    ''', (backup_name, change_seq, sha256))
+    db.execute('DELETE FROM change_log WHERE seq <= ?', (change_seq,))
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+محرك إتمام البيع
+
+خدمة واحدة تستخدمها نقطة البيع وشاشة الفواتير: تتحقق من السلة كاملة
+باستعلام واحد، تخصم المخزون بتحديث مشروط (quantity >= الكمية)، تدرج
+بنود البيع دفعة واحدة، وتحفظ مرة واحدة داخل معاملة BEGIN IMMEDIATE.
+عدد الأوامر ثابت مهما كان عدد البنود.
+"""
+
+from flask import current_app, request
+
+from .database import now_str
+from .events import sale_completed
+from .rollups import record_sales
+from .sequences import next_invoice_number
+from .stock_ledger import SALE, record_movements
+
+
+class CheckoutError(Exception):
+    """خطأ في إتمام البيع (سلة فارغة، صنف غير موجود، كمية غير كافية)"""
+
+    def __init__(self, message, problems=None):
+        super().__init__(message)
+        self.message = message
+        self.problems = problems or []
+
+
+_DECREMENT_SQL = '''
+    UPDATE items SET quantity = quantity - ?
+    WHERE id = ? AND quantity >= ?
+'''
+
+# نقطة البيع تعين سعر البيع للأصناف التي ليس لها سعر بعد
+_DECREMENT_FILL_PRICE_SQL = '''
+    UPDATE items SET quantity = quantity - ?,
+        selling_price = CASE WHEN IFNULL(selling_price, 0) = 0 THEN ? ELSE selling_price END
+    WHERE id = ? AND quantity >= ?
+'''
+
+
+def _normalize_lines(lines):
+    """تحويل بنود السلة إلى صيغة موحدة والتحقق من القيم"""
+    normalized = []
+    for line in lines:
+        try:
+            item_id = int(line['item_id'])
+            quantity = line['quantity']
+            # int(1.5) يقطع الكسر دون خطأ - الكمية الكسرية مرفوضة مثل '1.5'
+            if isinstance(quantity, float) and not quantity.is_integer():
+                raise ValueError(quantity)
+            quantity = int(quantity)
+            # بدون سعر: يؤخذ سعر البيع المسجل للصنف داخل checkout
+            unit_price = line.get('unit_price')
+            unit_price = float(unit_price) if unit_price is not None else None
+            total_price = line.get('total_price')
+            total_price = float(total_price) if total_price is not None else None
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise CheckoutError('بيانات السلة غير صحيحة')
+        if quantity <= 0:
+            raise CheckoutError('الكمية يجب أن تكون أكبر من صفر')
+        normalized.append({
+            'item_id': item_id,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total_price': total_price,
+        })
+    return normalized
+
+
+def terminal_options():
+    """معرف الجهاز وحجم كتلة الأرقام للطلب الحالي"""
+    return {
+        'terminal_id': request.headers.get('X-Terminal-Id') or request.values.get('terminal_id'),
+        'block_size': current_app.config.get('INVOICE_BLOCK_SIZE', 0),
+    }
+
+
+def checkout(db, lines, prefix, payment_method='cash', customer_name=None, customer_phone=None,
+             total_amount=None, discount_amount=0, tax_amount=0, final_amount=None,
+             user_id=None, user_name=None, terminal_id=None, block_size=0,
+             fill_selling_price=False):
+    """إتمام عملية بيع كاملة في معاملة واحدة
+
+    lines: قائمة قواميس تحتوي item_id و quantity و unit_price و total_price (اختياريان،
+    البند بدون سعر يباع بسعر البيع المسجل للصنف ويرفض إن لم يكن له سعر)
+    يرجع قاموساً يحتوي invoice_id و invoice_number و final_amount و lines.
+    يرفع CheckoutError إذا كانت السلة غير صالحة أو المخزون غير كافٍ.
+    """
+    lines = _normalize_lines(lines)
+    if not lines:
+        raise CheckoutError('لا توجد أصناف في السلة')
+
+    # الكمية المطلوبة لكل صنف (قد يتكرر الصنف في أكثر من بند)
+    requested = {}
+    for line in lines:
+        requested[line['item_id']] = requested.get(line['item_id'], 0) + line['quantity']
+
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    try:
+        item_ids = list(requested)
+        placeholders = ','.join('?' * len(item_ids))
+        rows = db.execute(f'''
+            SELECT id, name, quantity, category_id, cost_price, selling_price
+            FROM items WHERE id IN ({placeholders})
+        ''', item_ids).fetchall()
+        items = {row['id']: row for row in rows}
+
+        problems = []
+        for item_id, quantity in requested.items():
+            item = items.get(item_id)
+            if item is None:
+                problems.append(f'الصنف غير موجود: {item_id}')
+            elif item['quantity'] < quantity:
+                problems.append(f'الكمية المتاحة من {item["name"]}: {item["quantity"]} فقط')
+        if problems:
+            raise CheckoutError(' - '.join(problems), problems)
+
+        for line in lines:
+            item = items[line['item_id']]
+            if line['unit_price'] is None:
+                if not item['selling_price']:
+                    problems.append(f'لا يوجد سعر بيع للصنف {item["name"]}')
+                line['unit_price'] = item['selling_price'] or 0
+            if line['total_price'] is None:
+                line['total_price'] = line['quantity'] * line['unit_price']
+
+        # تعيين سعر البيع من السلة يحتاج سعراً واحداً للصنف
+        fill_prices = {}
+        if fill_selling_price:
+            for line in lines:
+                if items[line['item_id']]['selling_price']:
+                    continue
+                price = fill_prices.setdefault(line['item_id'], line['unit_price'])
+                if price != line['unit_price']:
+                    problems.append(f'أسعار مختلفة للصنف {items[line["item_id"]]["name"]} في السلة')
+        if problems:
+            raise CheckoutError(' - '.join(dict.fromkeys(problems)), list(dict.fromkeys(problems)))
+
+        if total_amount is None:
+            total_amount = sum(line['total_price'] for line in lines)
+        if final_amount is None:
+            final_amount = total_amount - discount_amount + tax_amount
+
+        created_at = now_str()
+        invoice_number = next_invoice_number(db, prefix, terminal_id, block_size)
+        invoice_id = db.execute('''
+            INSERT INTO invoices (invoice_number, customer_name, customer_phone, total_amount,
+                                  discount_amount, tax_amount, final_amount, payment_method,
+                                  created_at, created_by, created_by_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (invoice_number, customer_name, customer_phone, total_amount, discount_amount,
+              tax_amount, final_amount, payment_method, created_at, user_id, user_name)).lastrowid
+
+        # خصم المخزون - التحديث المشروط يمنع البيع بأكثر من المتاح
+        if fill_selling_price:
+            cursor = db.executemany(_DECREMENT_FILL_PRICE_SQL, [
+                (quantity, fill_prices.get(item_id, 0), item_id, quantity)
+                for item_id, quantity in requested.items()
+            ])
+        else:
+            cursor = db.executemany(_DECREMENT_SQL, [
+                (quantity, item_id, quantity) for item_id, quantity in requested.items()
+            ])
+        if cursor.rowcount != len(requested):
+            raise CheckoutError('تغير المخزون أثناء البيع، يرجى المحاولة مرة أخرى')
+
+        # تكلفة الوحدة تحفظ مع البيع بمتوسط التكلفة الحالي
+        unit_costs = {item_id: item['cost_price'] or 0 for item_id, item in items.items()}
+        db.executemany('''
+            INSERT INTO sales (invoice_id, item_id, quantity, unit_price, total_price,
+                               discount_amount, tax_amount, final_price, unit_cost, created_at)
+            VALUES (?, ?, ?, ?, ?, 0, 0, ?, ?, ?)
+        ''', [
+            (invoice_id, line['item_id'], line['quantity'], line['unit_price'],
+             line['total_price'], line['total_price'], unit_costs[line['item_id']], created_at)
+            for line in lines
+        ])
+
+        record_sales(db, created_at, [
+            {'item_id': line['item_id'], 'quantity': line['quantity'], 'revenue': line['total_price'],
+             'cost': line['quantity'] * unit_costs[line['item_id']]}
+            for line in lines
+        ], items, user_id)
+        record_movements(db, {item_id: -quantity for item_id, quantity in requested.items()}, SALE,
+                         reference_id=invoice_id, user_id=user_id, user_name=user_name, created_at=created_at)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    result = {
+        'invoice_id': invoice_id,
+        'invoice_number': invoice_number,
+        'created_at': created_at,
+        'total_amount': total_amount,
+        'final_amount': final_amount,
+        'lines': lines,
+    }
+    sale_completed(db, result)
+    return result
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+مجمع اتصالات قاعدة البيانات
+
+يحتفظ كل عامل (process) بمجمع من اتصالات SQLite المهيأة مسبقاً
+(WAL، synchronous=NORMAL، ذاكرة مؤقتة، busy_timeout، المفاتيح الأجنبية)
+بدلاً من فتح اتصال جديد مع كل طلب.
+"""
+
+import os
+import sqlite3
+import threading
+
+# إعدادات PRAGMA المطبقة على كل اتصال جديد
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+class ConnectionPool:
+    """مجمع اتصالات SQLite لكل عملية"""
+
+    def __init__(self, database, size=5, read_only=False, busy_timeout=5000,
+                 cache_size=-16000, mmap_size=268435456):
+        self.database = database
+        self.size = size
+        self.read_only = read_only
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            'created': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'overflow_closed': 0,
+            'discarded': 0,
+            'in_use': 0,
+        }
+
+    def _connect(self):
+        """فتح اتصال جديد وتطبيق الإعدادات عليه"""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        if self.read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def _check_fork(self):
+        """تجاهل الاتصالات الموروثة بعد fork (مثل gunicorn --preload)"""
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+            self._stats = self._empty_stats()
+
+    def acquire(self):
+        """استعارة اتصال من المجمع"""
+        with self._lock:
+            self._check_fork()
+            conn = self._idle.pop() if self._idle else None
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            if conn is not None:
+                self._stats['reused'] += 1
+            else:
+                self._stats['created'] += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+        return conn
+
+    def release(self, conn):
+        """إعادة الاتصال إلى المجمع بعد التراجع عن أي معاملة مفتوحة"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._stats['in_use'] -= 1
+                self._stats['discarded'] += 1
+            conn.close()
+            return
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._stats['overflow_closed'] += 1
+        conn.close()
+
+    def close_all(self):
+        """إغلاق جميع الاتصالات الخاملة"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """إحصائيات المجمع للمراقبة"""
+        with self._lock:
+            return {
+                'database': self.database,
+                'read_only': self.read_only,
+                'size': self.size,
+                'idle': len(self._idle),
+                **self._stats,
+            }
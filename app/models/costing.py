@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+تكلفة المخزون بالمتوسط المرجح
+
+items.cost_price هو متوسط تكلفة الكمية الموجودة ويحدث تزايدياً مع كل بند
+شراء: (الكمية الحالية × المتوسط + الكمية المشتراة × تكلفتها) ÷ الكمية
+الجديدة. إذا لم يكن هناك رصيد موجب يصبح المتوسط تكلفة الشراء نفسها.
+البيع يحفظ المتوسط وقت البيع في sales.unit_cost، فتكلفة المبيعات وهامش
+الربح مجاميع مباشرة (جداول التجميع اليومي) لا تعتمد على سعر التكلفة الحالي.
+"""
+
+# تعبيرات SET كلها تقرأ قيم الصف قبل التحديث
+_RECEIVE_SQL = '''
+    UPDATE items SET
+        cost_price = CASE WHEN quantity > 0
+                          THEN (quantity * IFNULL(cost_price, 0) + :quantity * :unit_cost) / (quantity + :quantity)
+                          ELSE :unit_cost END,
+        quantity = quantity + :quantity
+    WHERE id = :item_id
+'''
+
+
+def receive_stock(db, item_id, quantity, unit_cost):
+    """إضافة كمية مشتراة إلى المخزون وتحديث متوسط التكلفة (بدون commit)"""
+    db.execute(_RECEIVE_SQL, {'item_id': item_id, 'quantity': quantity, 'unit_cost': unit_cost})
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+لقطة إحصائيات لوحة التحكم
+
+كل مؤشرات لوحة التحكم تحسب في استعلامين (المؤشرات الرقمية، ثم القوائم
+الحديثة كمصفوفات JSON) وتحفظ في ذاكرة العملية. اللقطة صالحة ما دام اليوم
+وأرقام إصدارات الكتالوج والمبيعات في sync_state لم تتغير (ترفعها triggers
+مع كل بيع أو تعديل كمية). أرقام الإصدارات نفسها لا تقرأ أكثر من مرة كل
+DASHBOARD_CACHE_TTL ثانية، والكتابات في نفس العملية تلغي اللقطة فوراً.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from ..utils.date_ranges import day_range
+
+_snapshot = None
+_snapshot_key = None
+_checked_at = 0
+_lock = threading.Lock()
+
+_KPI_SQL = '''
+    SELECT stock.total_items, stock.total_qty, stock.low_stock,
+           (SELECT IFNULL(SUM(total_price), 0) FROM sales
+            WHERE created_at >= :start AND created_at < :end) AS today_sales,
+           (SELECT COUNT(*) FROM invoices
+            WHERE created_at >= :start AND created_at < :end) AS today_invoices
+    FROM (SELECT COUNT(*) AS total_items,
+                 IFNULL(SUM(quantity), 0) AS total_qty,
+                 (SELECT COUNT(*) FROM low_stock_items) AS low_stock
+          FROM items) AS stock
+'''
+
+_RECENT_SQL = '''
+    SELECT
+        (SELECT json_group_array(json_object(
+                    'id', id, 'name', name, 'quantity', quantity, 'unit_price', unit_price,
+                    'total_price', total_price, 'created_at', created_at))
+         FROM (SELECT s.id, i.name, s.quantity, s.unit_price, s.total_price, s.created_at
+               FROM sales s JOIN items i ON i.id = s.item_id
+               ORDER BY s.created_at DESC LIMIT 10)) AS recent_sales,
+        (SELECT json_group_array(json_object(
+                    'id', id, 'name', name, 'quantity', quantity, 'reorder_level', reorder_level))
+         FROM (SELECT i.id, i.name, i.quantity, i.reorder_level
+               FROM low_stock_items l JOIN items i ON i.id = l.item_id
+               ORDER BY l.quantity ASC LIMIT 5)) AS low_stock_items,
+        (SELECT json_group_array(json_object(
+                    'id', id, 'invoice_number', invoice_number, 'customer_name', customer_name,
+                    'total_amount', total_amount, 'created_at', created_at, 'created_by', created_by))
+         FROM (SELECT i.id, i.invoice_number, i.customer_name, i.total_amount, i.created_at,
+                      u.username AS created_by
+               FROM invoices i
+               LEFT JOIN users u ON u.id = i.created_by
+               ORDER BY i.created_at DESC LIMIT 5)) AS recent_invoices
+'''
+
+
+def _cache_key(db):
+    """اليوم وأرقام إصدارات الكتالوج والمبيعات"""
+    versions = dict(db.execute(
+        "SELECT name, version FROM sync_state WHERE name IN ('catalog', 'sales')").fetchall())
+    return day_range()[0], versions.get('catalog', 0), versions.get('sales', 0)
+
+
+def _compute(db):
+    start, end = day_range()
+    snapshot = dict(db.execute(_KPI_SQL, {'start': start, 'end': end}).fetchone())
+    recent = db.execute(_RECENT_SQL).fetchone()
+    for key in ('recent_sales', 'low_stock_items', 'recent_invoices'):
+        snapshot[key] = json.loads(recent[key])
+    snapshot['generated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return snapshot
+
+
+def get_dashboard_snapshot(db):
+    """إحصائيات لوحة التحكم (من الذاكرة ما لم تتغير البيانات)
+
+    يرجع قاموساً فيه: total_items، total_qty، low_stock، today_sales،
+    today_invoices، recent_sales، low_stock_items، recent_invoices، generated_at.
+    """
+    global _snapshot, _snapshot_key, _checked_at
+
+    now = time.monotonic()
+    ttl = current_app.config.get('DASHBOARD_CACHE_TTL', 10)
+    snapshot = _snapshot
+    if snapshot is not None and now - _checked_at < ttl:
+        return snapshot
+
+    # اللقطة ورقم الإصدار من نفس معاملة القراءة
+    started = not db.in_transaction
+    if started:
+        db.execute('BEGIN')
+    try:
+        key = _cache_key(db)
+        with _lock:
+            if _snapshot is None or key != _snapshot_key:
+                _snapshot = _compute(db)
+                _snapshot_key = key
+            _checked_at = now
+            return _snapshot
+    finally:
+        if started:
+            db.rollback()
+
+
+def invalidate_dashboard():
+    """إلغاء اللقطة في هذه العملية بعد بيع أو تعديل مخزون (العمليات الأخرى تتحقق من الإصدار)"""
+    global _checked_at
+    _checked_at = 0
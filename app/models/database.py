@@ -6,33 +6,91 @@
 التاريخ: 10/9/2025
 """
 
-import sqlite3
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import g
+from .connection_pool import ConnectionPool
+from .migrations import apply_migrations
 
-def get_db():
-    """الحصول على اتصال قاعدة البيانات"""
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(read_only=False):
+    """الحصول على مجمع الاتصالات (قراءة أو كتابة) لقاعدة البيانات الحالية"""
     from flask import current_app
     
+    database_path = current_app.config['DATABASE']
+    key = (database_path, read_only)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                directory = os.path.dirname(database_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                size_key = 'DB_READ_POOL_SIZE' if read_only else 'DB_POOL_SIZE'
+                pool = ConnectionPool(
+                    database_path,
+                    size=current_app.config.get(size_key, 5),
+                    read_only=read_only,
+                    busy_timeout=current_app.config.get('DB_BUSY_TIMEOUT', 5000),
+                    cache_size=current_app.config.get('DB_CACHE_SIZE', -16000),
+                    mmap_size=current_app.config.get('DB_MMAP_SIZE', 268435456),
+                )
+                _pools[key] = pool
+    return pool
+
+def get_db():
+    """الحصول على اتصال قاعدة البيانات (قراءة وكتابة)"""
     if 'db' not in g:
-        database_path = current_app.config['DATABASE']
-        os.makedirs(os.path.dirname(database_path), exist_ok=True)
-        g.db = sqlite3.connect(database_path)
-        g.db.row_factory = sqlite3.Row
+        g.db = _get_pool().acquire()
     return g.db
 
+def get_read_db():
+    """الحصول على اتصال للقراءة فقط - للتقارير ولوحة التحكم
+    
+    في وضع WAL لا يحجب الكاتب القراء، لذلك تستخدم صفحات القراءة
+    اتصالاً منفصلاً لا يتنافس مع عمليات البيع.
+    """
+    if 'read_db' not in g:
+        g.read_db = _get_pool(read_only=True).acquire()
+    return g.read_db
+
+@contextmanager
+def pooled_read_db():
+    """اتصال قراءة يستعار ويعاد فوراً - للبث الطويل (SSE) حتى لا يحجز اتصالاً طوال مدته"""
+    pool = _get_pool(read_only=True)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
 def close_db(exception=None):
-    """إغلاق اتصال قاعدة البيانات"""
+    """إعادة اتصالات قاعدة البيانات إلى المجمع"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        _get_pool().release(db)
+    read_db = g.pop('read_db', None)
+    if read_db is not None:
+        _get_pool(read_only=True).release(read_db)
+
+def get_pool_stats():
+    """إحصائيات مجمعات الاتصالات في هذه العملية"""
+    return {
+        'pid': os.getpid(),
+        'pools': [pool.stats() for pool in _pools.values()]
+    }
 
 def init_db():
     """Initialize the database with schema and default data"""
     db = get_db()
     db.executescript(SCHEMA_SQL)
+    apply_migrations(db)
 
     # ---- Default Users ----
     cur = db.execute('SELECT COUNT(*) as c FROM users')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+ناقل الأحداث الحية (Server-Sent Events)
+
+مسارات البيع والشراء وتعديل المخزون تنشر الأحداث بعد الحفظ، وكل اتصال
+SSE مفتوح له طابور في هذه العملية. الأحداث:
+    sale       فاتورة جديدة (الرقم والمبلغ)
+    low_stock  صنف دخل حد إعادة الطلب أو خرج منه
+    dashboard  لقطة لوحة التحكم بعد أي تغيير
+الأحداث داخل العملية فقط؛ البث يتحقق أيضاً دورياً من لقطة لوحة التحكم
+(أرقام الإصدارات في sync_state) فتصل تغييرات العمليات الأخرى خلال ثوانٍ.
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from .dashboard import get_dashboard_snapshot, invalidate_dashboard
+from .database import pooled_read_db
+from .jobs import submit_job
+from .stock_alerts import LOW, new_stock_alerts
+from .stock_ledger import snapshot_due
+
+SALE = 'sale'
+LOW_STOCK = 'low_stock'
+DASHBOARD = 'dashboard'
+
+# أقصى عدد أحداث تنتظر في طابور اتصال بطيء (الأقدم يهمل)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+_event_ids = itertools.count(1)
+
+
+def subscribe():
+    """طابور أحداث جديد لاتصال SSE"""
+    subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _subscribers_lock:
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    with _subscribers_lock:
+        _subscribers.discard(subscriber)
+
+
+def has_subscribers():
+    return bool(_subscribers)
+
+
+def publish(event_type, data):
+    """إرسال حدث إلى كل الاتصالات المفتوحة في هذه العملية"""
+    event = (next(_event_ids), event_type, data)
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+                subscriber.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+
+
+def publish_stock_alerts(db):
+    """نشر أحداث low_stock لعمليات العبور الجديدة في طابور stock_alerts"""
+    for alert in new_stock_alerts(db):
+        publish(LOW_STOCK, {
+            'item_id': alert['item_id'],
+            'name': alert['name'],
+            'quantity': alert['quantity'],
+            'reorder_level': alert['reorder_level'],
+            'low': alert['kind'] == LOW,
+        })
+
+
+def stock_changed(db):
+    """بعد حفظ تغيير في الكميات: إلغاء لقطة لوحة التحكم ونشر تنبيهات المخزون"""
+    invalidate_dashboard()
+    if snapshot_due(db):
+        submit_job('stock_snapshot')
+    publish_stock_alerts(db)
+
+
+def sale_completed(db, result):
+    """نشر حدث البيع وأحداث المخزون بعد إتمام checkout"""
+    publish(SALE, {
+        'invoice_id': result['invoice_id'],
+        'invoice_number': result['invoice_number'],
+        'final_amount': result['final_amount'],
+        'created_at': result['created_at'],
+    })
+    stock_changed(db)
+
+
+def _format(event_id, event_type, data):
+    event_id = f'id: {event_id}\n' if event_id else ''
+    return f'{event_id}event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+
+
+def _dashboard(alerts=False):
+    with pooled_read_db() as db:
+        if alerts:
+            # تنبيهات سجلتها عمليات أخرى (أو مهام الاستيراد) منذ آخر تحقق
+            publish_stock_alerts(db)
+        return get_dashboard_snapshot(db)
+
+
+def event_stream():
+    """مولد بث SSE: لقطة لوحة التحكم أولاً ثم الأحداث عند حدوثها
+
+    البث ينتهي بعد EVENTS_STREAM_TIMEOUT ثانية ويعيد المتصفح الاتصال
+    تلقائياً، فلا تبقى خيوط الخادم محجوزة إلى الأبد.
+    """
+    heartbeat = current_app.config.get('EVENTS_HEARTBEAT', 15)
+    poll_interval = current_app.config.get('EVENTS_POLL_INTERVAL', 5)
+    deadline = time.monotonic() + current_app.config.get('EVENTS_STREAM_TIMEOUT', 600)
+
+    subscriber = subscribe()
+    try:
+        snapshot = _dashboard()
+        yield f'retry: 3000\n{_format(None, DASHBOARD, snapshot)}'
+        last_check = last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            try:
+                event = subscriber.get(timeout=min(poll_interval, heartbeat))
+            except queue.Empty:
+                event = None
+            if event is not None:
+                yield _format(*event)
+                last_sent = time.monotonic()
+
+            now = time.monotonic()
+            if event is not None or now - last_check >= poll_interval:
+                last_check = now
+                latest = _dashboard(alerts=True)
+                if latest is not snapshot:
+                    snapshot = latest
+                    yield _format(None, DASHBOARD, snapshot)
+                    last_sent = now
+            if now - last_sent >= heartbeat:
+                yield ': ping\n\n'
+                last_sent = now
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+المهام الخلفية
+
+العمليات الطويلة (الاستيراد، التصدير، إعادة بناء التقارير) تسجل في جدول
+jobs وتنفذ في مجموعة خيوط داخل العملية، فيعود الطلب فوراً برقم المهمة
+ويتابع المستخدم التقدم عبر /api/jobs/<id> ثم ينزل الملف الناتج.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .database import get_db, now_str
+
+# حالات المهمة
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# أقل فترة بين تحديثين لنسبة التقدم في قاعدة البيانات (بالثواني)
+PROGRESS_INTERVAL = 0.5
+
+# رسالة المهمة التي توقفت عمليتها قبل اكتمالها
+STALE_MESSAGE = 'توقفت المهمة قبل اكتمالها (أعيد تشغيل الخادم)'
+
+# دوال تنفيذ المهام حسب النوع
+JOB_HANDLERS = {}
+
+# آخر تقدم معروف للمهام الجارية في هذه العملية
+_live_progress = {}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """تسجيل دالة تنفيذ لنوع مهمة: handler(job, params) ترجع نتيجة قابلة للتحويل إلى JSON"""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def _get_executor():
+    """مجموعة الخيوط الخاصة بهذه العملية (تنشأ من جديد بعد fork)"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('JOB_WORKERS', 2),
+                    thread_name_prefix='job'
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def results_dir():
+    """مجلد ملفات نتائج المهام"""
+    directory = current_app.config.get('JOB_RESULTS_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(current_app.config['DATABASE'])), 'job_results')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _progress_path(job_id):
+    """ملف التقدم الجانبي للمهام التي لا تستطيع الكتابة في قاعدة البيانات أثناء التنفيذ"""
+    return os.path.join(results_dir(), f'{job_id}.progress')
+
+
+def _read_progress_file(job_id):
+    """(النسبة، الرسالة، وقت آخر تحديث) من ملف التقدم، أو None"""
+    path = _progress_path(job_id)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            fraction, message = json.load(f)
+        return fraction, message, os.path.getmtime(path)
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class Job:
+    """المهمة أثناء التنفيذ - تستخدمها دالة التنفيذ للإبلاغ عن التقدم وإنشاء ملف النتيجة"""
+
+    def __init__(self, job_id, kind):
+        self.id = job_id
+        self.kind = kind
+        self.result_path = None
+        self.result_name = None
+        self.result_mimetype = None
+        self._last_progress = 0
+
+    def progress(self, fraction=None, message=None, persist=True):
+        """تحديث نسبة التقدم (0-1) ورسالة الحالة
+
+        persist=False يكتب التقدم في ملف جانبي بدلاً من قاعدة البيانات - تستخدمه
+        المهام التي تحمل قفل الكتابة (مثل الاستيراد داخل معاملة واحدة) حتى لا
+        تنتظر نفسها. العمليات الأخرى تقرأ الملف، وتعديله يثبت أن المهمة حية.
+        """
+        _live_progress[self.id] = (fraction, message)
+        now = time.monotonic()
+        if now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        if not persist:
+            with open(_progress_path(self.id), 'w', encoding='utf-8') as f:
+                json.dump([fraction, message], f, ensure_ascii=False)
+            return
+        db = get_db()
+        db.execute('''
+            UPDATE jobs SET progress = COALESCE(?, progress), message = COALESCE(?, message), updated_at = ?
+            WHERE id = ?
+        ''', (fraction, message, now_str(), self.id))
+        db.commit()
+
+    def result_file(self, name, mimetype):
+        """مسار ملف النتيجة (يحذف تلقائياً بعد انتهاء مدة الاحتفاظ)"""
+        self.result_name = name
+        self.result_mimetype = mimetype
+        self.result_path = os.path.join(results_dir(), f'{self.id}_{name}')
+        return self.result_path
+
+
+def _update(db, job_id, **fields):
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    db.execute(f'UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?',
+               [*fields.values(), now_str(), job_id])
+    db.commit()
+
+
+def _run(app, job_id, kind, params):
+    """تنفيذ المهمة داخل سياق التطبيق في خيط العمل"""
+    with app.app_context():
+        db = get_db()
+        job = Job(job_id, kind)
+        started = db.execute('UPDATE jobs SET status = ?, started_at = ?, updated_at = ? WHERE id = ? AND status = ?',
+                             (RUNNING, now_str(), now_str(), job_id, QUEUED)).rowcount
+        db.commit()
+        if not started:
+            # علمت المهمة متوقفة أثناء انتظارها
+            _remove_file(params.get('input_path'))
+            return
+        try:
+            result = JOB_HANDLERS[kind](job, params)
+            _update(db, job_id, status=DONE, progress=1, message=None, finished_at=now_str(),
+                    result=json.dumps(result, ensure_ascii=False, default=str),
+                    result_path=job.result_path, result_name=job.result_name,
+                    result_mimetype=job.result_mimetype)
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            print(f"خطأ في تنفيذ المهمة {job_id} ({kind}): {e}")
+            _update(db, job_id, status=FAILED, message=str(e), finished_at=now_str())
+        finally:
+            _live_progress.pop(job_id, None)
+            _remove_file(_progress_path(job_id))
+            _remove_file(params.get('input_path'))
+
+
+def fail_stale_jobs(db):
+    """تعليم المهام المنتظرة أو الجارية التي لم تتقدم منذ JOB_STALE_AFTER دقيقة كفاشلة
+
+    المهمة تنفذ في خيط داخل العملية، فإذا انتهت العملية (إعادة تشغيل أو
+    توقف) تبقى حالتها queued/running للأبد وينتظرها المستخدم بلا نهاية.
+    آخر تقدم هو updated_at أو تعديل ملف التقدم الجانبي. يحذف الملف المرفوع.
+    """
+    stale_minutes = current_app.config.get('JOB_STALE_AFTER', 60)
+    rows = db.execute('''
+        SELECT id, params FROM jobs
+        WHERE status IN (?, ?) AND updated_at < datetime('now', 'localtime', ?)
+    ''', (QUEUED, RUNNING, f'-{int(stale_minutes)} minutes')).fetchall()
+    stale = []
+    for job in rows:
+        live = _read_progress_file(job['id'])
+        if live and time.time() - live[2] < stale_minutes * 60:
+            continue
+        stale.append(job['id'])
+        params = json.loads(job['params']) if job['params'] else {}
+        _remove_file(params.get('input_path'))
+        _remove_file(_progress_path(job['id']))
+    if stale:
+        db.executemany('''
+            UPDATE jobs SET status = ?, message = ?, finished_at = ?, updated_at = ?
+            WHERE id = ? AND status IN (?, ?)
+        ''', [(FAILED, STALE_MESSAGE, now_str(), now_str(), job_id, QUEUED, RUNNING) for job_id in stale])
+        db.commit()
+
+
+def cleanup_jobs(db):
+    """حذف المهام المنتهية وملفاتها بعد انتهاء مدة الاحتفاظ (JOB_RESULT_TTL بالساعات)"""
+    fail_stale_jobs(db)
+    ttl_hours = current_app.config.get('JOB_RESULT_TTL', 24)
+    expired = db.execute('''
+        SELECT id, result_path FROM jobs
+        WHERE status IN (?, ?) AND finished_at < datetime('now', 'localtime', ?)
+    ''', (DONE, FAILED, f'-{int(ttl_hours)} hours')).fetchall()
+    for job in expired:
+        _remove_file(job['result_path'])
+    if expired:
+        db.executemany('DELETE FROM jobs WHERE id = ?', [(job['id'],) for job in expired])
+        db.commit()
+
+
+def submit_job(kind, params=None, user_id=None):
+    """تسجيل مهمة جديدة وإرسالها للتنفيذ في الخلفية - ترجع رقم المهمة"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'نوع مهمة غير معروف: {kind}')
+    params = params or {}
+    db = get_db()
+    cleanup_jobs(db)
+
+    job_id = uuid.uuid4().hex
+    created_at = now_str()
+    db.execute('''
+        INSERT INTO jobs (id, kind, status, progress, params, created_by, created_at, updated_at)
+        VALUES (?, ?, ?, 0, ?, ?, ?, ?)
+    ''', (job_id, kind, QUEUED, json.dumps(params, ensure_ascii=False), user_id, created_at, created_at))
+    db.commit()
+
+    _get_executor().submit(_run, current_app._get_current_object(), job_id, kind, params)
+    return job_id
+
+
+def get_job(db, job_id):
+    """حالة المهمة كقاموس، أو None إذا لم توجد"""
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['params'].pop('input_path', None)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['has_file'] = bool(job.pop('result_path'))
+    live = _live_progress.get(job_id)
+    if live is None and job['status'] == RUNNING:
+        # مهمة تنفذ في عملية أخرى وتكتب تقدمها في الملف الجانبي
+        live = (_read_progress_file(job_id) or (None, None))[:2]
+    if live and job['status'] == RUNNING:
+        fraction, message = live
+        job['progress'] = fraction if fraction is not None else job['progress']
+        job['message'] = message or job['message']
+    return job
+
+
+def get_job_file(db, job_id):
+    """مسار ملف نتيجة المهمة واسمه ونوعه، أو None"""
+    row = db.execute('''
+        SELECT result_path, result_name, result_mimetype, created_by FROM jobs
+        WHERE id = ? AND status = ?
+    ''', (job_id, DONE)).fetchone()
+    if row is None or not row['result_path'] or not os.path.exists(row['result_path']):
+        return None
+    return row
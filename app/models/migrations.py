@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+ترقيات مخطط قاعدة البيانات
+
+كل ترقية لها رقم إصدار وقائمة خطوات: أمر SQL نصي أو دالة تستقبل الاتصال.
+يُحفظ آخر إصدار مطبق في PRAGMA user_version، وتُطبق كل ترقية
+داخل معاملة واحدة.
+"""
+
+from .rollups import rebuild_rollups
+from .settings_cache import import_settings_files
+from .change_log import change_log_triggers
+from .search import rebuild_search_index
+from .stock_ledger import open_stock_ledger
+from .stock_alerts import rebuild_low_stock
+
+MIGRATIONS = [
+    # 1: فهارس التقارير والبحث حسب التاريخ
+    (1, (
+        'CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sales_invoice_id ON sales(invoice_id)',
+        'CREATE INDEX IF NOT EXISTS idx_sales_item_id ON sales(item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_created_at ON invoices(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_purchases_created_at ON purchases(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_purchase_items_purchase_id ON purchase_items(purchase_id)',
+        'CREATE INDEX IF NOT EXISTS idx_purchase_items_item_id ON purchase_items(item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_items_category_id ON items(category_id)',
+        'CREATE INDEX IF NOT EXISTS idx_items_quantity_reorder ON items(quantity, reorder_level)',
+        'CREATE INDEX IF NOT EXISTS idx_items_name ON items(name)',
+    )),
+    # 2: جداول التجميع اليومي للمبيعات والمشتريات مع تعبئة أولية
+    (2, (
+        '''CREATE TABLE IF NOT EXISTS daily_item_sales (
+            day TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            purchased_quantity INTEGER NOT NULL DEFAULT 0,
+            purchased_cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, item_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS daily_category_sales (
+            day TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            purchased_quantity INTEGER NOT NULL DEFAULT 0,
+            purchased_cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_daily_item_sales_item ON daily_item_sales(item_id, day)',
+        rebuild_rollups,
+    )),
+    # 3: عدادات أرقام الفواتير وكتل الأرقام لكل جهاز
+    (3, (
+        '''CREATE TABLE IF NOT EXISTS invoice_sequences (
+            prefix TEXT PRIMARY KEY,
+            last_value INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS invoice_number_blocks (
+            terminal_id TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            next_value INTEGER NOT NULL,
+            end_value INTEGER NOT NULL,
+            PRIMARY KEY (terminal_id, prefix)
+        )''',
+    )),
+    # 4: رقم إصدار متزايد للكتالوج (الأصناف والفئات) وسجل المحذوفات للمزامنة
+    (4, (
+        '''CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )''',
+        "INSERT OR IGNORE INTO sync_state (name, version) VALUES ('catalog', 1)",
+        'ALTER TABLE items ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE categories ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1',
+        'CREATE INDEX IF NOT EXISTS idx_items_row_version ON items(row_version)',
+        'CREATE INDEX IF NOT EXISTS idx_categories_row_version ON categories(row_version)',
+        '''CREATE TABLE IF NOT EXISTS catalog_tombstones (
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (entity, entity_id)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_version ON catalog_tombstones(version)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_version_insert AFTER INSERT ON items
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            UPDATE items SET row_version = (SELECT version FROM sync_state WHERE name = 'catalog')
+            WHERE id = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_version_update AFTER UPDATE ON items
+        WHEN NEW.row_version = OLD.row_version
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            UPDATE items SET row_version = (SELECT version FROM sync_state WHERE name = 'catalog')
+            WHERE id = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_version_delete AFTER DELETE ON items
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            INSERT OR REPLACE INTO catalog_tombstones (entity, entity_id, version)
+            VALUES ('item', OLD.id, (SELECT version FROM sync_state WHERE name = 'catalog'));
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_categories_version_insert AFTER INSERT ON categories
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            UPDATE categories SET row_version = (SELECT version FROM sync_state WHERE name = 'catalog')
+            WHERE id = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_categories_version_update AFTER UPDATE ON categories
+        WHEN NEW.row_version = OLD.row_version
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            UPDATE categories SET row_version = (SELECT version FROM sync_state WHERE name = 'catalog')
+            WHERE id = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_categories_version_delete AFTER DELETE ON categories
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            INSERT OR REPLACE INTO catalog_tombstones (entity, entity_id, version)
+            VALUES ('category', OLD.id, (SELECT version FROM sync_state WHERE name = 'catalog'));
+        END''',
+    )),
+    # 5: نقل الإعدادات من ملفات JSON إلى قاعدة البيانات
+    (5, (
+        '''CREATE TABLE IF NOT EXISTS settings (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS settings_versions (
+            namespace TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )''',
+        import_settings_files,
+    )),
+    # 6: فهارس البحث في الفواتير (بداية رقم الهاتف واسم العميل)
+    (6, (
+        'CREATE INDEX IF NOT EXISTS idx_invoices_customer_phone ON invoices(customer_phone)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_customer_name ON invoices(customer_name)',
+    )),
+    # 7: المهام الخلفية (استيراد، تصدير، إعادة بناء التقارير)
+    (7, (
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            params TEXT,
+            result TEXT,
+            result_path TEXT,
+            result_name TEXT,
+            result_mimetype TEXT,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            updated_at TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_finished ON jobs(status, finished_at)',
+    )),
+    # 8: سجل التغييرات وحالة سلسلة النسخ الاحتياطية للنسخ التزايدي
+    (8, (
+        '''CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS backup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            backup_name TEXT NOT NULL,
+            change_seq INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        )''',
+        *[sql for table in ('items', 'categories', 'invoices', 'sales', 'purchases', 'purchase_items')
+          for sql in change_log_triggers(table)],
+    )),
+    # 9: رقم إصدار للمبيعات يرفع مع كل فاتورة (لإلغاء لقطة لوحة التحكم)
+    (9, (
+        "INSERT OR IGNORE INTO sync_state (name, version) VALUES ('sales', 1)",
+        *[f'''CREATE TRIGGER IF NOT EXISTS trg_invoices_sales_version_{event.lower()} AFTER {event} ON invoices
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'sales';
+        END''' for event in ('INSERT', 'UPDATE', 'DELETE')],
+    )),
+    # 10: فهرس بحث FTS5 (trigram) للأصناف تحدثه triggers عند تغيير الاسم أو SKU أو الوصف
+    (10, (
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, sku, description,
+            content='items', content_rowid='id', tokenize='trigram'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_fts_insert AFTER INSERT ON items
+        BEGIN
+            INSERT INTO items_fts (rowid, name, sku, description)
+            VALUES (NEW.id, NEW.name, NEW.sku, NEW.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_fts_delete AFTER DELETE ON items
+        BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, sku, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.sku, OLD.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_fts_update AFTER UPDATE OF name, sku, description ON items
+        BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, sku, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.sku, OLD.description);
+            INSERT INTO items_fts (rowid, name, sku, description)
+            VALUES (NEW.id, NEW.name, NEW.sku, NEW.description);
+        END''',
+        rebuild_search_index,
+    )),
+    # 11: أكثر من باركود للصنف؛ تغييره يختم الصنف برقم إصدار جديد للكتالوج
+    (11, (
+        '''CREATE TABLE IF NOT EXISTS item_barcodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            barcode TEXT UNIQUE NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(item_id) REFERENCES items(id) ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_item_barcodes_item_id ON item_barcodes(item_id)',
+        *[f'''CREATE TRIGGER IF NOT EXISTS trg_item_barcodes_version_{event.lower()} AFTER {event} ON item_barcodes
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'catalog';
+            UPDATE items SET row_version = (SELECT version FROM sync_state WHERE name = 'catalog')
+            WHERE id IN ({refs});
+        END''' for event, refs in (('INSERT', 'NEW.item_id'), ('UPDATE', 'OLD.item_id, NEW.item_id'),
+                                   ('DELETE', 'OLD.item_id'))],
+        *change_log_triggers('item_barcodes'),
+    )),
+    # 12: سجل حركات المخزون (للإضافة فقط) ولقطات الأرصدة الدورية مع رصيد افتتاحي
+    (12, (
+        '''CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            quantity_change INTEGER NOT NULL,
+            balance_after INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            reference_id INTEGER,
+            note TEXT,
+            user_id INTEGER,
+            user_name TEXT,
+            created_at TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_stock_movements_item_id ON stock_movements(item_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_stock_movements_created_at ON stock_movements(created_at)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stock_movements_no_update BEFORE UPDATE ON stock_movements
+        BEGIN
+            SELECT RAISE(ABORT, 'سجل حركات المخزون لا يعدل');
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stock_movements_no_delete BEFORE DELETE ON stock_movements
+        BEGIN
+            SELECT RAISE(ABORT, 'سجل حركات المخزون لا يحذف');
+        END''',
+        *change_log_triggers('stock_movements'),
+        # اللقطات مشتقة من السجل فلا تتبع في النسخ التزايدية
+        '''CREATE TABLE IF NOT EXISTS stock_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at TEXT NOT NULL,
+            movement_id INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_stock_snapshots_taken_at ON stock_snapshots(taken_at)',
+        '''CREATE TABLE IF NOT EXISTS stock_snapshot_items (
+            snapshot_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, item_id)
+        ) WITHOUT ROWID''',
+        open_stock_ledger,
+    )),
+    # 13: الأصناف المنخفضة محفوظة بـ triggers وطابور تنبيهات عبور حد إعادة الطلب
+    (13, (
+        '''CREATE TABLE IF NOT EXISTS low_stock_items (
+            item_id INTEGER PRIMARY KEY,
+            quantity INTEGER NOT NULL,
+            reorder_level INTEGER NOT NULL,
+            since TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_low_stock_items_quantity ON low_stock_items(quantity)',
+        '''CREATE TABLE IF NOT EXISTS stock_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            reorder_level INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )''',
+        # INSERT OR REPLACE لأن إعادة تطبيق النسخ التزايدية تدرج أصنافاً موجودة
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_low_stock_insert AFTER INSERT ON items
+        WHEN NEW.quantity <= NEW.reorder_level
+        BEGIN
+            INSERT OR REPLACE INTO low_stock_items (item_id, quantity, reorder_level, since)
+            VALUES (NEW.id, NEW.quantity, NEW.reorder_level, datetime('now', 'localtime'));
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_low_stock_update AFTER UPDATE OF quantity, reorder_level ON items
+        WHEN NEW.quantity <= NEW.reorder_level AND OLD.quantity <= OLD.reorder_level
+        BEGIN
+            UPDATE low_stock_items SET quantity = NEW.quantity, reorder_level = NEW.reorder_level
+            WHERE item_id = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_low_stock_enter AFTER UPDATE OF quantity, reorder_level ON items
+        WHEN NEW.quantity <= NEW.reorder_level AND OLD.quantity > OLD.reorder_level
+        BEGIN
+            INSERT OR REPLACE INTO low_stock_items (item_id, quantity, reorder_level, since)
+            VALUES (NEW.id, NEW.quantity, NEW.reorder_level, datetime('now', 'localtime'));
+            INSERT INTO stock_alerts (item_id, kind, quantity, reorder_level, created_at)
+            VALUES (NEW.id, 'low', NEW.quantity, NEW.reorder_level, datetime('now', 'localtime'));
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_low_stock_leave AFTER UPDATE OF quantity, reorder_level ON items
+        WHEN NEW.quantity > NEW.reorder_level AND OLD.quantity <= OLD.reorder_level
+        BEGIN
+            DELETE FROM low_stock_items WHERE item_id = NEW.id;
+            INSERT INTO stock_alerts (item_id, kind, quantity, reorder_level, created_at)
+            VALUES (NEW.id, 'restocked', NEW.quantity, NEW.reorder_level, datetime('now', 'localtime'));
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_items_low_stock_delete AFTER DELETE ON items
+        WHEN OLD.quantity <= OLD.reorder_level
+        BEGIN
+            DELETE FROM low_stock_items WHERE item_id = OLD.id;
+        END''',
+        rebuild_low_stock,
+    )),
+    # 14: جلسات الجرد وسطورها (الكمية المتوقعة مجمدة عند فتح الجلسة)
+    (14, (
+        '''CREATE TABLE IF NOT EXISTS stocktakes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_by INTEGER,
+            created_by_name TEXT,
+            created_at TEXT NOT NULL,
+            applied_at TEXT,
+            applied_by_name TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS stocktake_lines (
+            stocktake_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            expected_quantity INTEGER NOT NULL,
+            counted_quantity INTEGER,
+            counted_at TEXT,
+            PRIMARY KEY (stocktake_id, item_id),
+            FOREIGN KEY(stocktake_id) REFERENCES stocktakes(id) ON DELETE CASCADE
+        ) WITHOUT ROWID''',
+    )),
+    # 15: تكلفة الوحدة وقت البيع. المبيعات السابقة تأخذ متوسط تكلفة يومها من
+    # التجميع اليومي (سجل بسعر التكلفة وقت البيع) ثم سعر التكلفة الحالي
+    (15, (
+        'ALTER TABLE sales ADD COLUMN unit_cost REAL',
+        '''UPDATE sales SET unit_cost = COALESCE(
+            (SELECT d.cost / d.quantity FROM daily_item_sales d
+             WHERE d.day = substr(sales.created_at, 1, 10) AND d.item_id = sales.item_id AND d.quantity > 0),
+            (SELECT IFNULL(i.cost_price, 0) FROM items i WHERE i.id = sales.item_id),
+            0)''',
+    )),
+    # 16: التجميع اليومي حسب الكاشير والشهري حسب الصنف (تقرير الأرباح)
+    (16, (
+        '''CREATE TABLE IF NOT EXISTS daily_cashier_sales (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS monthly_item_sales (
+            month TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, item_id)
+        ) WITHOUT ROWID''',
+        rebuild_rollups,
+    )),
+]
+
+
+def get_schema_version(db):
+    """الحصول على إصدار المخطط الحالي"""
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(db):
+    """تطبيق الترقيات التي لم تطبق بعد"""
+    for version, steps in MIGRATIONS:
+        if version <= get_schema_version(db):
+            continue
+
+        # BEGIN IMMEDIATE يمنع عاملين من تطبيق نفس الترقية معاً
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= get_schema_version(db):
+                db.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(db)
+                else:
+                    db.execute(step)
+            db.execute(f'PRAGMA user_version = {int(version)}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
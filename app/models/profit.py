@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+تقرير الأرباح وهامش الربح
+
+يقرأ جداول التجميع اليومي فقط (لا يلمس جدول sales)، فتكلفة الاستعلام
+بعدد أيام النطاق لا بعدد المبيعات. الفترات (يوم/شهر/سنة) والإجماليات من
+daily_cashier_sales لأن الفاتورة تخص كاشيراً واحداً فعدد الفواتير فيه
+دقيق، والأصناف والفئات من جدوليهما. الأصناف على نطاق طويل تقرأ الأشهر
+الكاملة من monthly_item_sales وأيام الطرفين فقط من daily_item_sales. الإيراد
+مجموع صافي البنود والتكلفة بتكلفة الوحدة المحفوظة وقت البيع.
+"""
+
+from ..utils.date_ranges import month_range
+from .rollups import UNCATEGORIZED, UNKNOWN_CASHIER
+
+# التجميع: (العنوان، الجدول، مفتاح التجميع، الاسم المعروض، الربط، الترتيب)
+# الاسم والربط يستخدمان g.key أي المفتاح بعد التجميع (ربط واحد لكل مجموعة)
+GROUPINGS = {
+    'day': ('اليوم', 'daily_cashier_sales', 'd.day', 'g.key', '', 'g.key'),
+    'month': ('الشهر', 'daily_cashier_sales', 'substr(d.day, 1, 7)', 'g.key', '', 'g.key'),
+    'year': ('السنة', 'daily_cashier_sales', 'substr(d.day, 1, 4)', 'g.key', '', 'g.key'),
+    'item': ('الصنف', 'daily_item_sales', 'd.item_id', "IFNULL(i.name, 'صنف محذوف')",
+             'LEFT JOIN items i ON i.id = g.key', 'g.profit DESC'),
+    'category': ('الفئة', 'daily_category_sales', 'd.category_id',
+                 f"CASE WHEN g.key = {UNCATEGORIZED} THEN 'بدون فئة' ELSE IFNULL(c.name, 'فئة محذوفة') END",
+                 'LEFT JOIN categories c ON c.id = g.key', 'g.profit DESC'),
+    'cashier': ('الكاشير', 'daily_cashier_sales', 'd.user_id',
+                f"CASE WHEN g.key = {UNKNOWN_CASHIER} THEN 'غير معروف' ELSE IFNULL(u.username, 'مستخدم محذوف') END",
+                'LEFT JOIN users u ON u.id = g.key', 'g.profit DESC'),
+}
+
+GROUPING_LABELS = {key: grouping[0] for key, grouping in GROUPINGS.items()}
+
+_TOTALS = '''
+    SUM(d.quantity) AS quantity,
+    SUM(d.revenue) AS revenue,
+    SUM(d.cost) AS cost,
+    SUM(d.revenue - d.cost) AS profit,
+    SUM(d.line_count) AS line_count,
+    SUM(d.invoice_count) AS invoice_count
+'''
+
+
+def _range_filter(start, end):
+    """شرط نطاق الأيام (نصف مفتوح، أي منهما اختياري)"""
+    where = 'd.line_count > 0'
+    params = []
+    if start:
+        where += ' AND d.day >= ?'
+        params.append(start)
+    if end:
+        where += ' AND d.day < ?'
+        params.append(end)
+    return where, params
+
+
+def _item_source(start, end):
+    """مصدر صفوف الأصناف: (FROM، الشرط، المعاملات)"""
+    # حدود الأشهر الكاملة داخل النطاق
+    first = start if not start or start.endswith('-01') else month_range(start[:7])[1]
+    last = end[:8] + '01' if end else None
+    if first and last and first >= last:
+        where, params = _range_filter(start, end)
+        return 'daily_item_sales d', where, params
+
+    columns = 'item_id, quantity, revenue, cost, line_count, invoice_count'
+    month_filter = ''
+    params = []
+    if first:
+        month_filter += ' AND month >= ?'
+        params.append(first[:7])
+    if last:
+        month_filter += ' AND month < ?'
+        params.append(last[:7])
+    parts = [f'SELECT {columns} FROM monthly_item_sales WHERE 1=1{month_filter}']
+    for edge_start, edge_end in ((start, first), (last, end)):
+        if edge_start and edge_end and edge_start < edge_end:
+            parts.append(f'SELECT {columns} FROM daily_item_sales WHERE line_count > 0 AND day >= ? AND day < ?')
+            params.extend((edge_start, edge_end))
+    return f"({' UNION ALL '.join(parts)}) d", '1', params
+
+
+def _with_margin(row):
+    row = dict(row)
+    for key in ('quantity', 'revenue', 'cost', 'profit', 'line_count', 'invoice_count'):
+        row[key] = row[key] or 0
+    row['margin'] = row['profit'] * 100 / row['revenue'] if row['revenue'] else None
+    return row
+
+
+def profit_summary(db, start=None, end=None):
+    """إجمالي الإيراد والتكلفة والربح والهامش للنطاق"""
+    where, params = _range_filter(start, end)
+    return _with_margin(db.execute(f'SELECT {_TOTALS} FROM daily_cashier_sales d WHERE {where}',
+                                   params).fetchone())
+
+
+def profit_report(db, group_by='day', start=None, end=None, limit=None):
+    """الربح مجمعاً حسب group_by (أحد مفاتيح GROUPINGS) للنطاق [start, end)
+
+    الفترات مرتبة زمنياً والباقي الأعلى ربحاً أولاً. كل صف قاموس فيه key و name
+    والإجماليات و margin (نسبة مئوية، أو None إذا لم يكن هناك إيراد).
+    """
+    if group_by not in GROUPINGS:
+        raise ValueError(f'تجميع غير معروف: {group_by}')
+    _, table, key_expr, name_expr, join, order = GROUPINGS[group_by]
+    if table == 'daily_item_sales':
+        source, where, params = _item_source(start, end)
+    else:
+        source = f'{table} d'
+        where, params = _range_filter(start, end)
+    rows = db.execute(f'''
+        SELECT g.*, {name_expr} AS name
+        FROM (
+            SELECT {key_expr} AS key, {_TOTALS}
+            FROM {source}
+            WHERE {where}
+            GROUP BY 1
+        ) g
+        {join}
+        ORDER BY {order}
+        {'LIMIT ?' if limit else ''}
+    ''', params + [limit] if limit else params).fetchall()
+    return [_with_margin(row) for row in rows]
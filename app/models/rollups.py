@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+جداول التجميع اليومي للمبيعات
+
+daily_item_sales و daily_category_sales و daily_cashier_sales تحفظ لكل يوم
+وصنف (أو فئة أو كاشير) الكمية والإيراد والتكلفة وعدد البنود والفواتير،
+وتحدّث في نفس معاملة البيع أو الشراء. التقارير الشهرية والسنوية وتقرير
+الأرباح تقرأ منها بدلاً من جدول sales. monthly_item_sales نفس أرقام مبيعات
+الأصناف لكل شهر، لتقارير الأصناف على نطاقات طويلة.
+"""
+
+import click
+from flask.cli import with_appcontext
+
+from ..utils.date_ranges import month_range
+
+# الفئة 0 تمثل الأصناف غير المصنفة (لا يمكن استخدام NULL في المفتاح الأساسي)
+UNCATEGORIZED = 0
+# المستخدم 0 يمثل فواتير بدون مستخدم معروف
+UNKNOWN_CASHIER = 0
+
+_ITEM_UPSERT_SQL = '''
+    INSERT INTO daily_item_sales (day, item_id, quantity, revenue, cost, line_count, invoice_count,
+                                  purchased_quantity, purchased_cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, item_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        cost = cost + excluded.cost,
+        line_count = line_count + excluded.line_count,
+        invoice_count = invoice_count + excluded.invoice_count,
+        purchased_quantity = purchased_quantity + excluded.purchased_quantity,
+        purchased_cost = purchased_cost + excluded.purchased_cost
+'''
+
+_CATEGORY_UPSERT_SQL = '''
+    INSERT INTO daily_category_sales (day, category_id, quantity, revenue, cost, line_count, invoice_count,
+                                      purchased_quantity, purchased_cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, category_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        cost = cost + excluded.cost,
+        line_count = line_count + excluded.line_count,
+        invoice_count = invoice_count + excluded.invoice_count,
+        purchased_quantity = purchased_quantity + excluded.purchased_quantity,
+        purchased_cost = purchased_cost + excluded.purchased_cost
+'''
+
+_CASHIER_UPSERT_SQL = '''
+    INSERT INTO daily_cashier_sales (day, user_id, quantity, revenue, cost, line_count, invoice_count)
+    VALUES (?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(day, user_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        cost = cost + excluded.cost,
+        line_count = line_count + excluded.line_count,
+        invoice_count = invoice_count + 1
+'''
+
+_MONTHLY_ITEM_UPSERT_SQL = '''
+    INSERT INTO monthly_item_sales (month, item_id, quantity, revenue, cost, line_count, invoice_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(month, item_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        cost = cost + excluded.cost,
+        line_count = line_count + excluded.line_count,
+        invoice_count = invoice_count + excluded.invoice_count
+'''
+
+
+def _load_item_info(db, item_ids):
+    """جلب الفئة وسعر التكلفة لعدة أصناف باستعلام واحد"""
+    item_ids = sorted({int(item_id) for item_id in item_ids})
+    if not item_ids:
+        return {}
+    placeholders = ','.join('?' * len(item_ids))
+    rows = db.execute(
+        f'SELECT id, category_id, cost_price FROM items WHERE id IN ({placeholders})',
+        item_ids
+    ).fetchall()
+    return {row['id']: row for row in rows}
+
+
+def _accumulate(totals, key):
+    return totals.setdefault(key, [0, 0.0, 0.0, 0, 0, 0, 0.0])
+
+
+def _write(db, day, item_totals, category_totals):
+    db.executemany(_ITEM_UPSERT_SQL, [(day, key, *values) for key, values in item_totals.items()])
+    db.executemany(_CATEGORY_UPSERT_SQL, [(day, key, *values) for key, values in category_totals.items()])
+
+
+def record_sales(db, day, lines, item_info=None, user_id=None):
+    """إضافة بنود فاتورة واحدة إلى التجميع اليومي
+
+    lines: قائمة قواميس تحتوي item_id و quantity و revenue و cost (اختياري)
+    item_info: قاموس اختياري {item_id: صف يحتوي category_id و cost_price}
+    user_id: الكاشير الذي أنشأ الفاتورة
+    لا يتم الحفظ (commit) هنا - يتم ضمن معاملة البيع.
+    """
+    if not lines:
+        return
+    day = day[:10]
+    if item_info is None:
+        item_info = _load_item_info(db, [line['item_id'] for line in lines])
+
+    item_totals = {}
+    category_totals = {}
+    for line in lines:
+        item_id = int(line['item_id'])
+        info = item_info.get(item_id)
+        category_id = (info['category_id'] if info else None) or UNCATEGORIZED
+        cost = line.get('cost')
+        if cost is None:
+            cost = line['quantity'] * ((info['cost_price'] if info else 0) or 0)
+
+        for totals, key in ((item_totals, item_id), (category_totals, category_id)):
+            row = _accumulate(totals, key)
+            row[0] += line['quantity']
+            row[1] += line['revenue']
+            row[2] += cost
+            row[3] += 1
+            row[4] = 1  # الفاتورة تحسب مرة واحدة لكل صنف/فئة
+
+    _write(db, day, item_totals, category_totals)
+    db.executemany(_MONTHLY_ITEM_UPSERT_SQL, [
+        (day[:7], key, *values[:5]) for key, values in item_totals.items()
+    ])
+    db.execute(_CASHIER_UPSERT_SQL, (
+        day, user_id or UNKNOWN_CASHIER,
+        *(sum(row[i] for row in item_totals.values()) for i in range(4)),
+    ))
+
+
+def record_purchases(db, day, lines, item_info=None):
+    """إضافة بنود أمر شراء إلى التجميع اليومي
+
+    lines: قائمة قواميس تحتوي item_id و quantity و total_cost
+    """
+    if not lines:
+        return
+    day = day[:10]
+    if item_info is None:
+        item_info = _load_item_info(db, [line['item_id'] for line in lines])
+
+    item_totals = {}
+    category_totals = {}
+    for line in lines:
+        item_id = int(line['item_id'])
+        info = item_info.get(item_id)
+        category_id = (info['category_id'] if info else None) or UNCATEGORIZED
+        for totals, key in ((item_totals, item_id), (category_totals, category_id)):
+            row = _accumulate(totals, key)
+            row[5] += line['quantity']
+            row[6] += line['total_cost']
+
+    _write(db, day, item_totals, category_totals)
+
+
+def _columns(db, table):
+    """أسماء أعمدة جدول (مجموعة فارغة إذا لم يكن موجوداً)"""
+    return {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+
+
+def rebuild_rollups(db, start=None, end=None):
+    """إعادة بناء التجميع اليومي من الجداول الأصلية (للتعبئة الأولية أو الإصلاح)
+
+    start و end حدود نطاق نصف مفتوح بصيغة YYYY-MM-DD (اختياريان).
+    لا يتم الحفظ هنا - المستدعي مسؤول عن commit.
+    """
+    day_filter = ''
+    params = []
+    if start:
+        day_filter += ' AND day >= ?'
+        params.append(start)
+    if end:
+        day_filter += ' AND day < ?'
+        params.append(end)
+
+    # ترقية 1 تعيد البناء قبل أن تضيف الترقيات اللاحقة unit_cost وجدولي الكاشير والشهر
+    sales_columns = _columns(db, 'sales')
+    cashier_rollup = bool(_columns(db, 'daily_cashier_sales'))
+    monthly_rollup = bool(_columns(db, 'monthly_item_sales'))
+
+    db.execute(f'DELETE FROM daily_item_sales WHERE 1=1{day_filter}', params)
+    db.execute(f'DELETE FROM daily_category_sales WHERE 1=1{day_filter}', params)
+    if cashier_rollup:
+        db.execute(f'DELETE FROM daily_cashier_sales WHERE 1=1{day_filter}', params)
+
+    sales_filter = ''
+    purchases_filter = ''
+    if start:
+        sales_filter += ' AND s.created_at >= ?'
+        purchases_filter += ' AND pi.created_at >= ?'
+    if end:
+        sales_filter += ' AND s.created_at < ?'
+        purchases_filter += ' AND pi.created_at < ?'
+
+    # تكلفة البيع المحفوظة مع السطر، وسعر التكلفة الحالي للمبيعات القديمة
+    unit_cost = 's.unit_cost, ' if 'unit_cost' in sales_columns else ''
+    cost_expr = f'SUM(s.quantity * COALESCE({unit_cost}i.cost_price, 0))'
+
+    for table, key_column in (('daily_item_sales', 'item_id'), ('daily_category_sales', 'category_id')):
+        key_expr = 's.item_id' if key_column == 'item_id' else f'COALESCE(i.category_id, {UNCATEGORIZED})'
+        db.execute(f'''
+            INSERT INTO {table} (day, {key_column}, quantity, revenue, cost, line_count, invoice_count)
+            SELECT substr(s.created_at, 1, 10), {key_expr},
+                   SUM(s.quantity), SUM(s.final_price), {cost_expr},
+                   COUNT(*), COUNT(DISTINCT s.invoice_id)
+            FROM sales s
+            LEFT JOIN items i ON i.id = s.item_id
+            WHERE 1=1{sales_filter}
+            GROUP BY 1, 2
+        ''', params)
+
+        key_expr = 'pi.item_id' if key_column == 'item_id' else f'COALESCE(i.category_id, {UNCATEGORIZED})'
+        db.execute(f'''
+            INSERT INTO {table} (day, {key_column}, purchased_quantity, purchased_cost)
+            SELECT substr(pi.created_at, 1, 10), {key_expr}, SUM(pi.quantity), SUM(pi.total_cost)
+            FROM purchase_items pi
+            LEFT JOIN items i ON i.id = pi.item_id
+            WHERE 1=1{purchases_filter}
+            GROUP BY 1, 2
+            ON CONFLICT(day, {key_column}) DO UPDATE SET
+                purchased_quantity = excluded.purchased_quantity,
+                purchased_cost = excluded.purchased_cost
+        ''', params)
+
+    if cashier_rollup:
+        db.execute(f'''
+            INSERT INTO daily_cashier_sales (day, user_id, quantity, revenue, cost, line_count, invoice_count)
+            SELECT substr(s.created_at, 1, 10), COALESCE(inv.created_by, {UNKNOWN_CASHIER}),
+                   SUM(s.quantity), SUM(s.final_price), {cost_expr},
+                   COUNT(*), COUNT(DISTINCT s.invoice_id)
+            FROM sales s
+            LEFT JOIN invoices inv ON inv.id = s.invoice_id
+            LEFT JOIN items i ON i.id = s.item_id
+            WHERE 1=1{sales_filter}
+            GROUP BY 1, 2
+        ''', params)
+
+    if monthly_rollup:
+        _rebuild_monthly_item_sales(db, start, end)
+
+
+def _rebuild_monthly_item_sales(db, start=None, end=None):
+    """إعادة تجميع الأشهر التي يمسها النطاق [start, end) من daily_item_sales"""
+    month_filter = ''
+    day_filter = ''
+    params = []
+    if start:
+        month_filter += ' AND month >= ?'
+        day_filter += ' AND day >= ?'
+        params.append(start[:7] + '-01')
+    if end:
+        month_filter += ' AND month < ?'
+        day_filter += ' AND day < ?'
+        params.append(end if end.endswith('-01') else month_range(end[:7])[1])
+
+    db.execute(f'DELETE FROM monthly_item_sales WHERE 1=1{month_filter}', [param[:7] for param in params])
+    db.execute(f'''
+        INSERT INTO monthly_item_sales (month, item_id, quantity, revenue, cost, line_count, invoice_count)
+        SELECT substr(day, 1, 7), item_id, SUM(quantity), SUM(revenue), SUM(cost), SUM(line_count), SUM(invoice_count)
+        FROM daily_item_sales
+        WHERE line_count > 0{day_filter}
+        GROUP BY 1, 2
+    ''', params)
+
+
+@click.command('rebuild-rollups')
+@click.option('--start', default=None, help='أول يوم (YYYY-MM-DD)')
+@click.option('--end', default=None, help='اليوم التالي لآخر يوم (YYYY-MM-DD)')
+@with_appcontext
+def rebuild_rollups_command(start, end):
+    """إعادة بناء جداول التجميع اليومي للمبيعات"""
+    from .database import get_db
+
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        rebuild_rollups(db, start, end)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    click.echo('تمت إعادة بناء جداول التجميع اليومي')
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+البحث في الأصناف
+
+items_fts جدول FTS5 بمقسم trigram مرتبط بجدول items (content='items')
+وتحدثه triggers عند تغيير الاسم أو SKU أو الوصف فقط - تعديل الكمية لا
+يلمس الفهرس. trigram يطابق أي جزء من الكلمة (مناسب للعربية والأكواد)
+لكنه يحتاج 3 أحرف على الأقل؛ الكلمات الأقصر تبحث ببداية الاسم أو SKU.
+"""
+
+import re
+from collections import Counter
+
+from markupsafe import Markup, escape
+
+# أكبر محرف Unicode - نهاية نطاق البحث بالبادئة
+_PREFIX_END = '\U0010ffff'
+
+# أقل طول للكلمة في فهرس trigram
+MIN_TRIGRAM_LENGTH = 3
+
+# أقصى عدد مطابقات يرتب ويحسب في الفئات؛ كلمة شائعة تطابق آلاف الأصناف
+# لا تستحق ترتيبها كلها، والنتيجة تعلم بـ truncated. الترتيب لا يستخدم
+# bm25 لأنه يمر على كل المطابقات لحساب تكرار الكلمة، ومع trigram لا يعني
+# تكرار جزء من الكلمة صلة أكبر
+MAX_CANDIDATES = 500
+
+
+def _terms(query):
+    return [term for term in (query or '').split() if term]
+
+
+def match_expression(query):
+    """تعبير MATCH لـ FTS5 من نص البحث (كل الكلمات مطلوبة)، أو None إذا كانت كل الكلمات قصيرة"""
+    terms = [term for term in _terms(query) if len(term) >= MIN_TRIGRAM_LENGTH]
+    if not terms:
+        return None
+    return ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_filter(query, alias='i'):
+    """شرط SQL ومعاملاته لتصفية الأصناف بنص البحث (لاستخدامه داخل استعلامات أخرى)
+
+    الكلمات الطويلة تبحث في فهرس FTS، والقصيرة تبحث ببداية الاسم أو SKU.
+    """
+    conditions = []
+    params = []
+    expression = match_expression(query)
+    if expression:
+        conditions.append(f'{alias}.id IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)')
+        params.append(expression)
+    for term in _terms(query):
+        if len(term) < MIN_TRIGRAM_LENGTH:
+            conditions.append(f'(({alias}.name >= ? AND {alias}.name < ?) OR ({alias}.sku >= ? AND {alias}.sku < ?))')
+            params.extend([term, term + _PREFIX_END, term, term + _PREFIX_END])
+    return ' AND '.join(conditions) or '1=1', params
+
+
+def _highlight_pattern(query):
+    """نمط تمييز الكلمات: الطويلة في أي موضع، والقصيرة في بداية النص فقط"""
+    terms = sorted(_terms(query), key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile('|'.join(
+        re.escape(term) if len(term) >= MIN_TRIGRAM_LENGTH else '^' + re.escape(term)
+        for term in terms), re.IGNORECASE)
+
+
+def _relevance(row, query, terms):
+    """مفتاح ترتيب المطابقة: SKU المطابق تماماً، ثم ما يبدأ بالكلمة الأولى،
+    ثم عدد الكلمات الموجودة في الاسم، ثم الاسم الأقصر"""
+    name = (row['name'] or '').casefold()
+    sku = (row['sku'] or '').casefold()
+    return (
+        sku != query,
+        not (name.startswith(terms[0]) or sku.startswith(terms[0])),
+        -sum(term in name for term in terms),
+        len(name),
+        name,
+    )
+
+
+def _highlighted(value, pattern):
+    """النص كـ HTML آمن مع <mark> حول الأجزاء المطابقة"""
+    if value is None:
+        return None
+    value = str(value)
+    parts = []
+    last = 0
+    for match in pattern.finditer(value) if pattern else ():
+        parts.append(escape(value[last:match.start()]))
+        parts.append(Markup('<mark>%s</mark>') % match.group())
+        last = match.end()
+    parts.append(escape(value[last:]))
+    return str(Markup('').join(parts))
+
+
+def search_items(db, query, columns, limit=50, category_id=None, in_stock=False, facets=True):
+    """بحث مرتب حسب الصلة مع تمييز المطابقة وعدد النتائج لكل فئة
+
+    columns: أعمدة الأصناف المطلوبة (تعبير SQL على الاسمين المستعارين i و c).
+    يرجع قاموساً: items (مع highlight لكل صنف)، total، truncated، facets.
+    الترتيب وعدد الفئات على أول MAX_CANDIDATES مطابقة فقط، وعدد الفئات
+    يحسب قبل تصفية الفئة حتى تظهر كل الفئات المطابقة.
+    """
+    expression = match_expression(query)
+    if expression:
+        short_query = ' '.join(term for term in _terms(query) if len(term) < MIN_TRIGRAM_LENGTH)
+        short_filter, short_params = search_filter(short_query)
+        source = 'items_fts JOIN items i ON i.id = items_fts.rowid'
+        conditions = ['items_fts MATCH ?', short_filter]
+        params = [expression, *short_params]
+    else:
+        # كلمات قصيرة فقط - بحث بالبادئة عبر فهارس الاسم و SKU
+        short_filter, short_params = search_filter(query)
+        source = 'items i'
+        conditions = [short_filter]
+        params = list(short_params)
+    if in_stock:
+        conditions.append('i.quantity > 0')
+
+    # المرشحون: ما يلزم للترتيب وعدد الفئات فقط، والأعمدة المطلوبة لصفحة النتائج وحدها
+    def candidates(extra_conditions=(), extra_params=()):
+        return db.execute(f'''
+            SELECT i.id, i.name, i.sku, i.category_id, c.name AS category_name
+            FROM {source}
+            LEFT JOIN categories c ON c.id = i.category_id
+            WHERE {' AND '.join([*conditions, *extra_conditions])}
+            LIMIT ?
+        ''', [*params, *extra_params, MAX_CANDIDATES]).fetchall()
+
+    all_matches = candidates() if facets or not category_id else None
+    # + يمنع استخدام فهرس الفئة حتى يبقى البحث (FTS أو البادئة) هو المحرك للاستعلام
+    matches = candidates(['+i.category_id = ?'], [category_id]) if category_id else all_matches
+    truncated = len(matches) >= MAX_CANDIDATES
+    folded = query.casefold()
+    terms = [term.casefold() for term in _terms(query)]
+    matches = sorted(matches, key=lambda row: _relevance(row, folded, terms))
+
+    page_ids = [row['id'] for row in matches[:limit]]
+    rows = {}
+    if page_ids:
+        placeholders = ','.join('?' * len(page_ids))
+        rows = {row['_id']: row for row in db.execute(f'''
+            SELECT {columns}, i.id AS _id, i.name AS _name, i.sku AS _sku
+            FROM items i
+            LEFT JOIN categories c ON c.id = i.category_id
+            WHERE i.id IN ({placeholders})
+        ''', page_ids)}
+
+    pattern = _highlight_pattern(query)
+    items = []
+    for item_id in page_ids:
+        item = dict(rows[item_id])
+        item['highlight'] = {
+            'name': _highlighted(item.pop('_name'), pattern),
+            'sku': _highlighted(item.pop('_sku'), pattern),
+        }
+        del item['_id']
+        items.append(item)
+
+    result = {
+        'items': items,
+        'total': len(matches),
+        'truncated': truncated,
+        'facets': None,
+    }
+    if facets:
+        counts = Counter((row['category_id'], row['category_name']) for row in all_matches)
+        result['facets'] = {'categories': [
+            {'id': category, 'name': name, 'count': count}
+            for (category, name), count in counts.most_common()
+        ]}
+    return result
+
+
+def rebuild_search_index(db):
+    """إعادة بناء فهرس البحث من جدول items (بدون commit)"""
+    db.execute("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+تسلسل أرقام الفواتير
+
+عداد مستقل لكل بادئة (POS-، INV-، أو بادئة فرع/جهاز) يزاد داخل
+معاملة البيع نفسها، فلا يتكرر الرقم بين الأجهزة ولا تضيع أرقام عند
+فشل البيع.
+
+يمكن أيضاً حجز كتلة أرقام لكل جهاز (block_size > 0) بحيث يأخذ الجهاز
+أرقامه من كتلته دون تحديث صف العداد المشترك مع كل عملية بيع. الأرقام
+تبقى فريدة، لكن قد تبقى أرقام غير مستخدمة في نهاية الكتلة.
+"""
+
+# أقصى عدد أرقام يعتبر رقماً تسلسلياً عند تهيئة العداد من الفواتير الموجودة
+# (الفواتير القديمة من نوع INV-YYYYMMDDHHMMSS لا تدخل في الحساب)
+MAX_SEQUENCE_DIGITS = 8
+
+
+def format_invoice_number(prefix, value):
+    """تنسيق رقم الفاتورة"""
+    return f'{prefix}{value:06d}'
+
+
+def _ensure_sequence(db, prefix):
+    """إنشاء عداد البادئة إن لم يوجد، بدءاً من أكبر رقم مستخدم حالياً"""
+    db.execute('''
+        INSERT OR IGNORE INTO invoice_sequences (prefix, last_value)
+        SELECT ?, IFNULL(MAX(CAST(substr(invoice_number, ?) AS INTEGER)), 0)
+        FROM invoices
+        WHERE invoice_number >= ? AND invoice_number < ?
+          AND length(invoice_number) <= ?
+          AND substr(invoice_number, ?) NOT GLOB '*[^0-9]*'
+    ''', (prefix, len(prefix) + 1, prefix, prefix + '\U0010ffff',
+          len(prefix) + MAX_SEQUENCE_DIGITS, len(prefix) + 1))
+
+
+def _reserve(db, prefix, count):
+    """حجز عدد من الأرقام من العداد المشترك وإرجاع أولها"""
+    _ensure_sequence(db, prefix)
+    db.execute('UPDATE invoice_sequences SET last_value = last_value + ? WHERE prefix = ?',
+               (count, prefix))
+    last_value = db.execute('SELECT last_value FROM invoice_sequences WHERE prefix = ?',
+                            (prefix,)).fetchone()[0]
+    return last_value - count + 1
+
+
+def next_invoice_value(db, prefix, terminal_id=None, block_size=0):
+    """الحصول على الرقم التالي للبادئة
+
+    يجب استدعاؤها داخل معاملة البيع (قبل commit) حتى يُلغى الحجز إذا فشل البيع.
+    """
+    if not terminal_id or block_size <= 0:
+        return _reserve(db, prefix, 1)
+
+    block = db.execute('''
+        SELECT next_value, end_value FROM invoice_number_blocks
+        WHERE terminal_id = ? AND prefix = ?
+    ''', (terminal_id, prefix)).fetchone()
+
+    if block and block['next_value'] < block['end_value']:
+        db.execute('''
+            UPDATE invoice_number_blocks SET next_value = next_value + 1
+            WHERE terminal_id = ? AND prefix = ?
+        ''', (terminal_id, prefix))
+        return block['next_value']
+
+    # الكتلة الحالية انتهت - حجز كتلة جديدة من العداد المشترك
+    start = _reserve(db, prefix, block_size)
+    db.execute('''
+        INSERT INTO invoice_number_blocks (terminal_id, prefix, next_value, end_value)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(terminal_id, prefix) DO UPDATE SET
+            next_value = excluded.next_value,
+            end_value = excluded.end_value
+    ''', (terminal_id, prefix, start + 1, start + block_size))
+    return start
+
+
+def next_invoice_number(db, prefix, terminal_id=None, block_size=0):
+    """الحصول على رقم الفاتورة التالي منسقاً"""
+    return format_invoice_number(prefix, next_invoice_value(db, prefix, terminal_id, block_size))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+الإعدادات المخزنة في قاعدة البيانات
+
+كل مجموعة إعدادات (namespace) تحفظ في جدول settings كمفتاح وقيمة JSON،
+ولكل مجموعة رقم إصدار في settings_versions يزاد مع كل حفظ داخل نفس
+المعاملة. كل عملية تحتفظ بنسخة محملة من كل مجموعة، وتتحقق مرة واحدة في
+كل طلب من أرقام الإصدارات (استعلام واحد لكل المجموعات) ولا تعيد التحميل
+إلا للمجموعة التي تغيرت - فتبقى العمليات الأخرى (gunicorn workers) متسقة.
+"""
+
+import copy
+import json
+import os
+import threading
+from datetime import datetime
+
+from flask import g, has_app_context
+
+# ملفات الإعدادات القديمة - تنقل إلى قاعدة البيانات مرة واحدة عند الترقية
+LEGACY_SETTINGS_FILES = {
+    'store': 'store_settings.json',
+    'tax': 'tax_settings.json',
+    'payment_methods': 'payment_methods.json',
+    'currency': 'currency_settings.json',
+    'pos': 'pos_settings.json',
+}
+
+
+def _write_namespace(db, namespace, settings):
+    """كتابة مجموعة إعدادات كاملة ورفع رقم إصدارها (بدون commit)"""
+    db.execute('''
+        INSERT INTO settings_versions (namespace, version) VALUES (?, 1)
+        ON CONFLICT(namespace) DO UPDATE SET version = version + 1
+    ''', (namespace,))
+    version = db.execute('SELECT version FROM settings_versions WHERE namespace = ?',
+                         (namespace,)).fetchone()[0]
+    keys = list(settings)
+    placeholders = ','.join('?' * len(keys))
+    db.execute(f'DELETE FROM settings WHERE namespace = ? AND key NOT IN ({placeholders})',
+               [namespace, *keys])
+    db.executemany('''
+        INSERT INTO settings (namespace, key, value, version) VALUES (?, ?, ?, ?)
+        ON CONFLICT(namespace, key) DO UPDATE SET
+            value = excluded.value,
+            version = excluded.version
+    ''', [(namespace, key, json.dumps(value, ensure_ascii=False), version)
+          for key, value in settings.items()])
+    return version
+
+
+def import_settings_files(db):
+    """نقل ملفات الإعدادات JSON الموجودة إلى جدول settings (ترقية لمرة واحدة)"""
+    for namespace, settings_file in LEGACY_SETTINGS_FILES.items():
+        if not os.path.exists(settings_file):
+            continue
+        try:
+            with open(settings_file, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+        except Exception as e:
+            print(f"تعذر نقل ملف الإعدادات {settings_file}: {e}")
+            continue
+        if isinstance(settings, dict) and settings:
+            _write_namespace(db, namespace, settings)
+
+
+def _current_versions():
+    """أرقام إصدارات كل المجموعات - تقرأ مرة واحدة لكل طلب"""
+    from .database import get_read_db
+
+    versions = g.get('settings_versions')
+    if versions is None:
+        rows = get_read_db().execute('SELECT namespace, version FROM settings_versions').fetchall()
+        versions = g.settings_versions = {row['namespace']: row['version'] for row in rows}
+    return versions
+
+
+class CachedSettings:
+    """أساس مشترك لكائنات الإعدادات المحفوظة في قاعدة البيانات"""
+
+    # يستخدم في رسائل الأخطاء
+    label = 'الإعدادات'
+
+    def __init__(self, namespace, default_settings):
+        self.namespace = namespace
+        self.default_settings = default_settings
+        self._settings = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    @property
+    def settings(self):
+        """الإعدادات الحالية (يعاد تحميلها فقط إذا تغير رقم الإصدار)"""
+        self._revalidate()
+        if self._settings is None:
+            # خارج سياق التطبيق - القيم الافتراضية
+            return copy.deepcopy(self.default_settings)
+        return self._settings
+
+    @settings.setter
+    def settings(self, value):
+        self._settings = value
+
+    def _revalidate(self):
+        """إعادة تحميل الإعدادات إذا تغير رقم إصدار المجموعة"""
+        if not has_app_context():
+            return
+        try:
+            version = _current_versions().get(self.namespace, 0)
+        except Exception as e:
+            print(f"خطأ في تحميل {self.label}: {e}")
+            return
+        if self._settings is not None and version == self._version:
+            return
+        with self._lock:
+            if self._settings is not None and version == self._version:
+                return
+            self._settings = self.load_settings()
+            self._version = version
+
+    def load_settings(self):
+        """تحميل الإعدادات من قاعدة البيانات"""
+        from .database import get_read_db
+
+        try:
+            rows = get_read_db().execute('SELECT key, value FROM settings WHERE namespace = ?',
+                                         (self.namespace,)).fetchall()
+            settings = {row['key']: json.loads(row['value']) for row in rows}
+            # دمج الإعدادات الافتراضية مع المحملة (نسخة مستقلة حتى لا تتغير القيم الافتراضية)
+            return {**copy.deepcopy(self.default_settings), **settings}
+        except Exception as e:
+            print(f"خطأ في تحميل {self.label}: {e}")
+            return copy.deepcopy(self.default_settings)
+
+    def save_settings(self, settings):
+        """حفظ الإعدادات في معاملة واحدة"""
+        from .database import get_db
+
+        try:
+            # لا يعدل القاموس الممرر (قد يكون الإعدادات المشتركة نفسها)
+            settings = {**settings, 'last_updated': datetime.now().isoformat()}
+            db = get_db()
+            if not db.in_transaction:
+                db.execute('BEGIN IMMEDIATE')
+            try:
+                version = _write_namespace(db, self.namespace, settings)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            with self._lock:
+                self._settings = {**copy.deepcopy(self.default_settings), **copy.deepcopy(settings)}
+                self._version = version
+            versions = g.get('settings_versions')
+            if versions is not None:
+                versions[self.namespace] = version
+            return True
+        except Exception as e:
+            print(f"خطأ في حفظ {self.label}: {e}")
+            return False
+
+    def update_settings(self, new_settings):
+        """تحديث الإعدادات"""
+        try:
+            # دمج الإعدادات الجديدة مع الموجودة
+            settings = {**self.settings, **new_settings}
+            return self.save_settings(settings)
+        except Exception as e:
+            print(f"خطأ في تحديث {self.label}: {e}")
+            return False
+
+    def get_all_settings(self):
+        """الحصول على جميع الإعدادات"""
+        return self.settings
+
+    def reset_to_defaults(self):
+        """إعادة تعيين الإعدادات إلى القيم الافتراضية"""
+        return self.save_settings(copy.deepcopy(self.default_settings))
@@ -3,13 +3,15 @@
 نماذج الإعدادات المتقدمة
 """
 
-import json
-import os
+import copy
 from datetime import datetime
 
-class TaxSettings:
-    def __init__(self, settings_file='tax_settings.json'):
-        self.settings_file = settings_file
+from .settings_cache import CachedSettings
+
+class TaxSettings(CachedSettings):
+    label = 'إعدادات الضريبة'
+
+    def __init__(self, namespace='tax'):
         self.default_settings = {
             'tax_enabled': True,
             'tax_rate': 15.0,  # 15% VAT
@@ -18,45 +20,7 @@ class TaxSettings:
             'tax_number': '123456789012345',
             'last_updated': datetime.now().isoformat()
         }
-        self.settings = self.load_settings()
-    
-    def load_settings(self):
-        """تحميل إعدادات الضريبة"""
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return {**self.default_settings, **settings}
-            else:
-                self.save_settings(self.default_settings)
-                return self.default_settings
-        except Exception as e:
-            print(f"خطأ في تحميل إعدادات الضريبة: {e}")
-            return self.default_settings
-    
-    def save_settings(self, settings):
-        """حفظ إعدادات الضريبة"""
-        try:
-            settings['last_updated'] = datetime.now().isoformat()
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"خطأ في حفظ إعدادات الضريبة: {e}")
-            return False
-    
-    def update_settings(self, new_settings):
-        """تحديث إعدادات الضريبة"""
-        try:
-            self.settings.update(new_settings)
-            return self.save_settings(self.settings)
-        except Exception as e:
-            print(f"خطأ في تحديث إعدادات الضريبة: {e}")
-            return False
-    
-    def get_all_settings(self):
-        """الحصول على جميع إعدادات الضريبة"""
-        return self.settings
+        super().__init__(namespace, self.default_settings)
     
     def calculate_tax(self, amount):
         """حساب الضريبة"""
@@ -64,9 +28,10 @@ class TaxSettings:
             return 0
         return (amount * self.settings.get('tax_rate', 0)) / 100
 
-class PaymentMethodSettings:
-    def __init__(self, settings_file='payment_methods.json'):
-        self.settings_file = settings_file
+class PaymentMethodSettings(CachedSettings):
+    label = 'طرق الدفع'
+
+    def __init__(self, namespace='payment_methods'):
         self.default_settings = {
             'payment_methods': [
                 {
@@ -104,32 +69,7 @@ class PaymentMethodSettings:
             ],
             'last_updated': datetime.now().isoformat()
         }
-        self.settings = self.load_settings()
-    
-    def load_settings(self):
-        """تحميل طرق الدفع"""
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return {**self.default_settings, **settings}
-            else:
-                self.save_settings(self.default_settings)
-                return self.default_settings
-        except Exception as e:
-            print(f"خطأ في تحميل طرق الدفع: {e}")
-            return self.default_settings
-    
-    def save_settings(self, settings):
-        """حفظ طرق الدفع"""
-        try:
-            settings['last_updated'] = datetime.now().isoformat()
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"خطأ في حفظ طرق الدفع: {e}")
-            return False
+        super().__init__(namespace, self.default_settings)
     
     def get_enabled_methods(self):
         """الحصول على طرق الدفع المفعلة"""
@@ -139,14 +79,12 @@ class PaymentMethodSettings:
         """الحصول على جميع طرق الدفع"""
         return self.settings.get('payment_methods', [])
     
-    def get_all_settings(self):
-        """الحصول على جميع الإعدادات"""
-        return self.settings
-    
     def update_method(self, method_id, method_data):
         """تحديث طريقة دفع"""
         try:
-            methods = self.settings.get('payment_methods', [])
+            # نسخة مستقلة - الذاكرة المؤقتة تستبدل فقط بعد نجاح الحفظ
+            settings = copy.deepcopy(self.settings)
+            methods = settings.get('payment_methods', [])
             
             for i, method in enumerate(methods):
                 if method.get('id') == method_id:
@@ -155,8 +93,8 @@ class PaymentMethodSettings:
             else:
                 return False
                 
-            self.settings['payment_methods'] = methods
-            return self.save_settings(self.settings)
+            settings['payment_methods'] = methods
+            return self.save_settings(settings)
         except Exception as e:
             print(f"خطأ في تحديث طريقة الدفع: {e}")
             return False
@@ -164,13 +102,14 @@ class PaymentMethodSettings:
     def add_method(self, method_data):
         """إضافة طريقة دفع جديدة"""
         try:
-            methods = self.settings.get('payment_methods', [])
+            settings = copy.deepcopy(self.settings)
+            methods = settings.get('payment_methods', [])
             # إنشاء معرف فريد
             method_id = method_data.get('id', f"method_{len(methods) + 1}")
             method_data['id'] = method_id
             methods.append(method_data)
-            self.settings['payment_methods'] = methods
-            return self.save_settings(self.settings)
+            settings['payment_methods'] = methods
+            return self.save_settings(settings)
         except Exception as e:
             print(f"خطأ في إضافة طريقة الدفع: {e}")
             return False
@@ -178,17 +117,18 @@ class PaymentMethodSettings:
     def delete_method(self, method_id):
         """حذف طريقة دفع"""
         try:
-            methods = self.settings.get('payment_methods', [])
-            methods = [method for method in methods if method.get('id') != method_id]
-            self.settings['payment_methods'] = methods
-            return self.save_settings(self.settings)
+            settings = copy.deepcopy(self.settings)
+            settings['payment_methods'] = [method for method in settings.get('payment_methods', [])
+                                           if method.get('id') != method_id]
+            return self.save_settings(settings)
         except Exception as e:
             print(f"خطأ في حذف طريقة الدفع: {e}")
             return False
 
-class CurrencySettings:
-    def __init__(self, settings_file='currency_settings.json'):
-        self.settings_file = settings_file
+class CurrencySettings(CachedSettings):
+    label = 'إعدادات العملة'
+
+    def __init__(self, namespace='currency'):
         self.default_settings = {
             'default_currency': 'SAR',
             'currencies': [
@@ -222,32 +162,7 @@ class CurrencySettings:
             ],
             'last_updated': datetime.now().isoformat()
         }
-        self.settings = self.load_settings()
-    
-    def load_settings(self):
-        """تحميل إعدادات العملة"""
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return {**self.default_settings, **settings}
-            else:
-                self.save_settings(self.default_settings)
-                return self.default_settings
-        except Exception as e:
-            print(f"خطأ في تحميل إعدادات العملة: {e}")
-            return self.default_settings
-    
-    def save_settings(self, settings):
-        """حفظ إعدادات العملة"""
-        try:
-            settings['last_updated'] = datetime.now().isoformat()
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"خطأ في حفظ إعدادات العملة: {e}")
-            return False
+        super().__init__(namespace, self.default_settings)
     
     def get_default_currency(self):
         """الحصول على العملة الافتراضية"""
@@ -284,22 +199,10 @@ class CurrencySettings:
         else:
             return f"{formatted_amount} {symbol}"
     
-    def update_settings(self, new_settings):
-        """تحديث إعدادات العملة"""
-        try:
-            self.settings.update(new_settings)
-            return self.save_settings(self.settings)
-        except Exception as e:
-            print(f"خطأ في تحديث إعدادات العملة: {e}")
-            return False
-    
-    def get_all_settings(self):
-        """الحصول على جميع إعدادات العملة"""
-        return self.settings
+class POSSettings(CachedSettings):
+    label = 'إعدادات نقطة البيع'
 
-class POSSettings:
-    def __init__(self, settings_file='pos_settings.json'):
-        self.settings_file = settings_file
+    def __init__(self, namespace='pos'):
         self.default_settings = {
             'pos_enabled': True,
             'receipt_printer': {
@@ -320,46 +223,8 @@ class POSSettings:
             },
             'last_updated': datetime.now().isoformat()
         }
-        self.settings = self.load_settings()
+        super().__init__(namespace, self.default_settings)
     
-    def load_settings(self):
-        """تحميل إعدادات نقطة البيع"""
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return {**self.default_settings, **settings}
-            else:
-                self.save_settings(self.default_settings)
-                return self.default_settings
-        except Exception as e:
-            print(f"خطأ في تحميل إعدادات نقطة البيع: {e}")
-            return self.default_settings
-    
-    def save_settings(self, settings):
-        """حفظ إعدادات نقطة البيع"""
-        try:
-            settings['last_updated'] = datetime.now().isoformat()
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"خطأ في حفظ إعدادات نقطة البيع: {e}")
-            return False
-    
-    def update_settings(self, new_settings):
-        """تحديث إعدادات نقطة البيع"""
-        try:
-            self.settings.update(new_settings)
-            return self.save_settings(self.settings)
-        except Exception as e:
-            print(f"خطأ في تحديث إعدادات نقطة البيع: {e}")
-            return False
-    
-    def get_all_settings(self):
-        """الحصول على جميع إعدادات نقطة البيع"""
-        return self.settings
-
 # إنشاء مثيلات عامة للإعدادات
 tax_settings = TaxSettings()
 payment_method_settings = PaymentMethodSettings()
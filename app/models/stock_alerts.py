@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+مجموعة الأصناف المنخفضة وطابور تنبيهات المخزون
+
+quantity <= reorder_level مقارنة بين عمودين لا يخدمها فهرس، فكانت كل صفحة
+تمسح جدول الأصناف كاملاً. triggers على items تحفظ الأصناف المنخفضة في
+low_stock_items (إضافة، تعديل الكمية أو حد إعادة الطلب، حذف)، فعرضها
+وعددها بحجم التنبيهات لا بحجم الكتالوج. عند عبور صنف حده في أي اتجاه
+تسجل الـ triggers نفسها صفاً في stock_alerts (low عند الدخول، restocked
+عند الخروج) - مرة واحدة لكل عبور مهما كان مسار الكتابة أو العملية.
+كل عملية تقرأ الطابور من آخر رقم رأته وتنشر الجديد فقط. الطابور يقص
+دورياً إلى آخر STOCK_ALERTS_KEEP تنبيه.
+"""
+
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+LOW = 'low'
+RESTOCKED = 'restocked'
+
+# أقصى عدد تنبيهات تنشر في دفعة واحدة (استيراد كبير قد يعبر به آلاف الأصناف)
+MAX_ALERTS_PER_CHECK = 100
+
+_lock = threading.Lock()
+# آخر رقم تنبيه نشرته هذه العملية
+_cursor = None
+
+
+def rebuild_low_stock(db):
+    """إعادة بناء low_stock_items من الأصناف (بدون commit)"""
+    db.execute('DELETE FROM low_stock_items')
+    db.execute('''
+        INSERT INTO low_stock_items (item_id, quantity, reorder_level, since)
+        SELECT id, quantity, reorder_level, ? FROM items WHERE quantity <= reorder_level
+    ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+
+
+def prune_stock_alerts(db):
+    """حذف التنبيهات الأقدم من آخر STOCK_ALERTS_KEEP تنبيه (بدون commit) - يرجع عدد المحذوف"""
+    keep = current_app.config.get('STOCK_ALERTS_KEEP', 5000)
+    return db.execute('''
+        DELETE FROM stock_alerts WHERE id <= (SELECT MAX(id) FROM stock_alerts) - ?
+    ''', (keep,)).rowcount
+
+
+def low_stock_count(db):
+    """عدد الأصناف عند حد إعادة الطلب أو تحته"""
+    return db.execute('SELECT COUNT(*) FROM low_stock_items').fetchone()[0]
+
+
+def get_low_stock_items(db, limit=None, out_of_stock=False):
+    """الأصناف المنخفضة (أو النافدة فقط) مع اسم الفئة، الأقل كمية أولاً"""
+    return db.execute(f'''
+        SELECT i.*, c.name AS category_name, l.since AS low_since
+        FROM low_stock_items l
+        JOIN items i ON i.id = l.item_id
+        LEFT JOIN categories c ON c.id = i.category_id
+        {'WHERE l.quantity = 0' if out_of_stock else ''}
+        ORDER BY l.quantity ASC, i.name ASC
+        {'LIMIT ?' if limit else ''}
+    ''', (limit,) if limit else ()).fetchall()
+
+
+def recent_stock_alerts(db, limit=20):
+    """آخر عمليات عبور حد إعادة الطلب"""
+    return db.execute('''
+        SELECT a.*, i.name AS item_name
+        FROM stock_alerts a
+        LEFT JOIN items i ON i.id = a.item_id
+        ORDER BY a.id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def new_stock_alerts(db):
+    """التنبيهات المسجلة منذ آخر استدعاء في هذه العملية (كل تنبيه يرجع مرة واحدة)
+
+    أول استدعاء يبدأ من نهاية الطابور. إذا تراكم أكثر من MAX_ALERTS_PER_CHECK
+    يرجع الأحدث منها فقط.
+    """
+    global _cursor
+    with _lock:
+        latest = db.execute('SELECT IFNULL(MAX(id), 0) FROM stock_alerts').fetchone()[0]
+        # الطابور أقصر مما رأيناه = استعيدت نسخة احتياطية
+        if _cursor is None or latest < _cursor:
+            _cursor = latest
+        if latest == _cursor:
+            return []
+        alerts = db.execute('''
+            SELECT a.id, a.item_id, a.kind, a.quantity, a.reorder_level, a.created_at, i.name
+            FROM stock_alerts a
+            LEFT JOIN items i ON i.id = a.item_id
+            WHERE a.id > ? AND a.id <= ?
+            ORDER BY a.id
+        ''', (max(_cursor, latest - MAX_ALERTS_PER_CHECK), latest)).fetchall()
+        _cursor = latest
+        return alerts
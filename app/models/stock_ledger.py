@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+سجل حركات المخزون
+
+كل مسار يغير items.quantity يسجل في stock_movements حركة لكل صنف (مقدار
+التغيير، الرصيد بعده، السبب، المرجع، المستخدم) داخل نفس معاملة التغيير.
+السجل للإضافة فقط (triggers تمنع التعديل والحذف)، ومجموع حركات الصنف
+يساوي كميته. stock_snapshots تحفظ دورياً رصيد كل صنف محسوباً من اللقطة
+السابقة والحركات بعدها، فرصيد أي لحظة = آخر لقطة قبلها + الحركات القليلة
+بعدها بدلاً من المرور على كل التاريخ.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# أسباب الحركة
+OPENING = 'opening'
+SALE = 'sale'
+PURCHASE = 'purchase'
+ADJUSTMENT = 'adjustment'
+IMPORT = 'import'
+STOCKTAKE = 'stocktake'
+RETURN = 'return'
+
+REASON_LABELS = {
+    OPENING: 'رصيد افتتاحي',
+    SALE: 'بيع',
+    PURCHASE: 'شراء',
+    ADJUSTMENT: 'تعديل يدوي',
+    IMPORT: 'استيراد',
+    STOCKTAKE: 'جرد',
+    RETURN: 'مرتجع',
+}
+
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# الرصيد بعد الحركة يقرأ من الصنف نفسه بعد تحديث كميته
+_MOVEMENT_SQL = '''
+    INSERT INTO stock_movements (item_id, quantity_change, balance_after, reason, reference_id,
+                                 note, user_id, user_name, created_at)
+    SELECT id, ?, quantity, ?, ?, ?, ?, ?, ? FROM items WHERE {key} = ?
+'''
+
+# موعد التحقق التالي من استحقاق لقطة جديدة في هذه العملية
+_next_snapshot_check = 0
+
+
+def _now():
+    return datetime.now().strftime(_TIMESTAMP_FORMAT)
+
+
+def record_movements(db, changes, reason, reference_id=None, note=None, user_id=None, user_name=None,
+                     created_at=None, key='id'):
+    """تسجيل حركات المخزون بعد تحديث الكميات في نفس المعاملة (بدون commit)
+
+    changes: {item_id: مقدار التغيير} (أو {sku: التغيير} مع key='sku').
+    التغييرات الصفرية لا تسجل.
+    """
+    created_at = created_at or _now()
+    db.executemany(_MOVEMENT_SQL.format(key=key), [
+        (change, reason, reference_id, note, user_id, user_name, created_at, item)
+        for item, change in changes.items() if change
+    ])
+
+
+def open_stock_ledger(db):
+    """رصيد افتتاحي لكل صنف بكميته الحالية ثم أول لقطة (تستخدم في الترقية)"""
+    db.execute('''
+        INSERT INTO stock_movements (item_id, quantity_change, balance_after, reason, created_at)
+        SELECT id, quantity, quantity, ?, ? FROM items WHERE quantity != 0
+    ''', (OPENING, _now()))
+    take_stock_snapshot(db)
+
+
+def _latest_snapshot(db, before=None):
+    if before is None:
+        return db.execute('SELECT id, movement_id, taken_at FROM stock_snapshots ORDER BY id DESC LIMIT 1').fetchone()
+    return db.execute('''
+        SELECT id, movement_id, taken_at FROM stock_snapshots
+        WHERE taken_at < ? ORDER BY taken_at DESC, id DESC LIMIT 1
+    ''', (before,)).fetchone()
+
+
+def take_stock_snapshot(db):
+    """لقطة أرصدة كل الأصناف (بدون commit) ويرجع وصفها
+
+    الرصيد = اللقطة السابقة + الحركات بعدها، فاللقطة تطابق السجل دائماً ولا
+    تحفظ الأرصدة الصفرية. اللقطات الأقدم من آخر STOCK_SNAPSHOT_KEEP تحذف؛
+    الاستعلام عن لحظة قبلها يجمع السجل من بدايته.
+    """
+    previous = _latest_snapshot(db)
+    movement_id = db.execute('SELECT IFNULL(MAX(id), 0) FROM stock_movements').fetchone()[0]
+    taken_at = _now()
+    snapshot_id = db.execute('INSERT INTO stock_snapshots (taken_at, movement_id) VALUES (?, ?)',
+                             (taken_at, movement_id)).lastrowid
+    db.execute('''
+        INSERT INTO stock_snapshot_items (snapshot_id, item_id, quantity)
+        SELECT ?, item_id, SUM(quantity) FROM (
+            SELECT item_id, quantity FROM stock_snapshot_items WHERE snapshot_id = ?
+            UNION ALL
+            SELECT item_id, quantity_change FROM stock_movements WHERE id > ? AND id <= ?
+        )
+        GROUP BY item_id
+        HAVING SUM(quantity) != 0
+    ''', (snapshot_id, previous['id'] if previous else None, previous['movement_id'] if previous else 0,
+          movement_id))
+
+    keep = current_app.config.get('STOCK_SNAPSHOT_KEEP', 90) if current_app else 90
+    old = [row[0] for row in db.execute('SELECT id FROM stock_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?',
+                                        (keep,))]
+    if old:
+        placeholders = ','.join('?' * len(old))
+        db.execute(f'DELETE FROM stock_snapshot_items WHERE snapshot_id IN ({placeholders})', old)
+        db.execute(f'DELETE FROM stock_snapshots WHERE id IN ({placeholders})', old)
+
+    items = db.execute('SELECT COUNT(*) FROM stock_snapshot_items WHERE snapshot_id = ?',
+                       (snapshot_id,)).fetchone()[0]
+    return {'snapshot_id': snapshot_id, 'taken_at': taken_at, 'movement_id': movement_id, 'items': items}
+
+
+def snapshot_due(db, throttle=True):
+    """هل مضى STOCK_SNAPSHOT_INTERVAL ساعة على آخر لقطة؟
+
+    مع throttle يتحقق من القاعدة مرة كل دقيقة على الأكثر في هذه العملية.
+    """
+    global _next_snapshot_check
+    if throttle:
+        now = time.monotonic()
+        if now < _next_snapshot_check:
+            return False
+        _next_snapshot_check = now + 60
+
+    interval = current_app.config.get('STOCK_SNAPSHOT_INTERVAL', 24)
+    latest = _latest_snapshot(db)
+    if latest is None:
+        return True
+    due_at = datetime.strptime(latest['taken_at'], _TIMESTAMP_FORMAT) + timedelta(hours=interval)
+    return datetime.now() >= due_at
+
+
+def stock_at(db, at, item_ids=None):
+    """أرصدة الأصناف قبل اللحظة at مباشرة: {item_id: الكمية} (الأصناف بلا رصيد لا تظهر)
+
+    at: نص تاريخ/وقت بصيغة created_at (لرصيد نهاية يوم: day_range(day)[1]).
+    item_ids: أصناف محددة أو None لكل الأصناف.
+    """
+    item_filter = ''
+    item_params = []
+    if item_ids is not None:
+        item_ids = [int(item_id) for item_id in item_ids]
+        if not item_ids:
+            return {}
+        item_filter = f" AND item_id IN ({','.join('?' * len(item_ids))})"
+        item_params = item_ids
+
+    snapshot = _latest_snapshot(db, before=at)
+    rows = db.execute(f'''
+        SELECT item_id, SUM(quantity) AS quantity FROM (
+            SELECT item_id, quantity FROM stock_snapshot_items
+            WHERE snapshot_id = ?{item_filter}
+            UNION ALL
+            SELECT item_id, quantity_change FROM stock_movements
+            WHERE id > ? AND created_at < ?{item_filter}
+        )
+        GROUP BY item_id
+        HAVING SUM(quantity) != 0
+    ''', [snapshot['id'] if snapshot else None, *item_params,
+          snapshot['movement_id'] if snapshot else 0, at, *item_params]).fetchall()
+    return {row['item_id']: row['quantity'] for row in rows}
+
+
+def ledger_mismatches(db):
+    """الأصناف التي لا يساوي مجموع حركاتها كميتها الحالية (للتحقق)"""
+    return db.execute('''
+        SELECT i.id, i.name, i.quantity, IFNULL(m.balance, 0) AS ledger_balance
+        FROM items i
+        LEFT JOIN (SELECT item_id, SUM(quantity_change) AS balance
+                   FROM stock_movements GROUP BY item_id) m ON m.item_id = i.id
+        WHERE i.quantity != IFNULL(m.balance, 0)
+        ORDER BY i.id
+    ''').fetchall()
+
+
+@click.command('stock-snapshot')
+@click.option('--verify', is_flag=True, help='مقارنة مجموع الحركات بكميات الأصناف')
+@with_appcontext
+def stock_snapshot_command(verify):
+    """أخذ لقطة أرصدة المخزون الآن"""
+    from .database import get_db
+
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        snapshot = take_stock_snapshot(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    click.echo(f"اللقطة {snapshot['snapshot_id']}: {snapshot['items']} صنف حتى الحركة {snapshot['movement_id']}")
+    if verify:
+        mismatches = ledger_mismatches(db)
+        for row in mismatches:
+            click.echo(f"{row['id']} {row['name']}: الكمية {row['quantity']} - السجل {row['ledger_balance']}")
+        click.echo('السجل مطابق للكميات' if not mismatches else f'{len(mismatches)} صنف غير مطابق')
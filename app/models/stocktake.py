@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+جلسات الجرد
+
+فتح الجلسة يجمد الكمية المتوقعة لكل صنف (كل الأصناف أو فئة واحدة) في
+stocktake_lines. الكميات المعدودة تصل على دفعات من ملف CSV/Excel أو من
+واجهة JSON، وكل دفعة أمر executemany واحد في معاملة واحدة. الفرق = المعدود
+- المتوقع المجمد، ويطبق عند الاعتماد على الكمية الحالية (فالمبيعات أثناء
+العد لا تضيع)، لكل الأصناف في معاملة واحدة تسجل حركات المخزون.
+الأصناف التي لم تعد تبقى كما هي.
+"""
+
+from .barcodes import lookup_codes
+from .database import now_str
+from .events import stock_changed
+from .stock_ledger import STOCKTAKE, record_movements
+
+# حالات الجلسة
+OPEN = 'open'
+APPLIED = 'applied'
+CANCELLED = 'cancelled'
+
+STATUS_LABELS = {
+    OPEN: 'مفتوحة',
+    APPLIED: 'معتمدة',
+    CANCELLED: 'ملغاة',
+}
+
+# طريقة تسجيل العد: set يستبدل العد السابق للصنف، add يضيف إليه (الصنف على أكثر من رف)
+COUNT_MODES = ('set', 'add')
+
+# أقصى عدد أخطاء يحتفظ بها تقرير الدفعة
+MAX_REPORTED_ERRORS = 200
+
+_COUNT_SQL = '''
+    INSERT INTO stocktake_lines (stocktake_id, item_id, expected_quantity, counted_quantity, counted_at)
+    SELECT ?, id, quantity, ?, ? FROM items WHERE id = ?
+    ON CONFLICT(stocktake_id, item_id) DO UPDATE SET
+        counted_quantity = {counted},
+        counted_at = excluded.counted_at
+'''
+
+_COUNTED = {
+    'set': 'excluded.counted_quantity',
+    'add': 'IFNULL(counted_quantity, 0) + excluded.counted_quantity',
+}
+
+
+class StocktakeError(Exception):
+    """جلسة غير موجودة أو لم تعد مفتوحة"""
+
+
+def open_stocktake(db, name, category_id=None, user_id=None, user_name=None):
+    """فتح جلسة جرد وتجميد الكميات المتوقعة (بدون commit) - يرجع رقم الجلسة"""
+    created_at = now_str()
+    stocktake_id = db.execute('''
+        INSERT INTO stocktakes (name, category_id, status, created_by, created_by_name, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (name, category_id, OPEN, user_id, user_name, created_at)).lastrowid
+    db.execute(f'''
+        INSERT INTO stocktake_lines (stocktake_id, item_id, expected_quantity)
+        SELECT ?, id, quantity FROM items {'WHERE category_id = ?' if category_id else ''}
+    ''', (stocktake_id, category_id) if category_id else (stocktake_id,))
+    return stocktake_id
+
+
+def get_stocktake(db, stocktake_id):
+    return db.execute('''
+        SELECT s.*, c.name AS category_name
+        FROM stocktakes s
+        LEFT JOIN categories c ON c.id = s.category_id
+        WHERE s.id = ?
+    ''', (stocktake_id,)).fetchone()
+
+
+def list_stocktakes(db, limit=50):
+    return db.execute('''
+        SELECT s.*, c.name AS category_name
+        FROM stocktakes s
+        LEFT JOIN categories c ON c.id = s.category_id
+        ORDER BY s.id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def stocktake_summary(db, stocktake_id):
+    """عدد الأصناف والمعدود منها والفروق وصافي الفرق وقيمته بسعر التكلفة"""
+    return dict(db.execute('''
+        SELECT COUNT(*) AS total_lines,
+               COUNT(l.counted_quantity) AS counted_lines,
+               IFNULL(SUM(l.counted_quantity != l.expected_quantity), 0) AS variance_lines,
+               IFNULL(SUM(l.counted_quantity - l.expected_quantity), 0) AS net_variance,
+               IFNULL(SUM((l.counted_quantity - l.expected_quantity) * i.cost_price), 0) AS variance_value
+        FROM stocktake_lines l
+        LEFT JOIN items i ON i.id = l.item_id
+        WHERE l.stocktake_id = ?
+    ''', (stocktake_id,)).fetchone())
+
+
+def stocktake_lines(db, stocktake_id, variances_only=False, limit=None):
+    """سطور الجلسة مع الصنف والفرق (الأكبر فرقاً أولاً)"""
+    condition = 'AND l.counted_quantity != l.expected_quantity' if variances_only else ''
+    return db.execute(f'''
+        SELECT l.*, l.counted_quantity - l.expected_quantity AS variance,
+               i.name, i.sku, i.quantity AS current_quantity, i.cost_price
+        FROM stocktake_lines l
+        LEFT JOIN items i ON i.id = l.item_id
+        WHERE l.stocktake_id = ? {condition}
+        ORDER BY l.counted_quantity IS NULL, ABS(l.counted_quantity - l.expected_quantity) DESC, i.name
+        {'LIMIT ?' if limit else ''}
+    ''', (stocktake_id, limit) if limit else (stocktake_id,)).fetchall()
+
+
+def _begin_open(db, stocktake_id):
+    """بدء معاملة كتابة والتحقق من أن الجلسة مفتوحة"""
+    db.execute('BEGIN IMMEDIATE')
+    stocktake = get_stocktake(db, stocktake_id)
+    if stocktake is None:
+        db.rollback()
+        raise StocktakeError('جلسة الجرد غير موجودة')
+    if stocktake['status'] != OPEN:
+        db.rollback()
+        raise StocktakeError(f"جلسة الجرد {STATUS_LABELS.get(stocktake['status'], stocktake['status'])}")
+    return stocktake
+
+
+def new_count_report():
+    return {'success': True, 'recorded': 0, 'error_count': 0, 'errors': []}
+
+
+def add_count_error(report, line, message):
+    """خطأ في سطر عد (التقرير يحفظ أول MAX_REPORTED_ERRORS فقط)"""
+    report['error_count'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'row': line, 'message': message})
+
+
+def record_counts(db, stocktake_id, counts, mode='set', report=None):
+    """تسجيل دفعة كميات معدودة في معاملة واحدة ويرجع تقريراً
+
+    counts: قائمة (رقم السطر، item_id أو None، الرمز أو None، الكمية). الرمز
+    SKU أو باركود. الصنف الذي لم يجمد عند فتح الجلسة يضاف بكميته الحالية
+    متوقعاً. report: تقرير new_count_report يكمل (مثلاً بأخطاء قراءة الملف).
+    """
+    if mode not in COUNT_MODES:
+        raise ValueError(f'طريقة عد غير معروفة: {mode}')
+    report = report or new_count_report()
+
+    _begin_open(db, stocktake_id)
+    try:
+        codes = list({code for _, item_id, code, _ in counts if item_id is None and code is not None})
+        found = {code: item['id'] for code, item in lookup_codes(db, codes).items() if item} if codes else {}
+        known = set()
+        item_ids = [item_id for _, item_id, _, _ in counts if item_id is not None]
+        for start in range(0, len(item_ids), 500):
+            batch = item_ids[start:start + 500]
+            known.update(row[0] for row in db.execute(
+                f"SELECT id FROM items WHERE id IN ({','.join('?' * len(batch))})", batch))
+
+        counted_at = now_str()
+        params = []
+        for line, item_id, code, quantity in counts:
+            if item_id is None:
+                item_id = found.get(code)
+                if item_id is None:
+                    add_count_error(report, line, f'لا يوجد صنف بالرمز {code}' if code else 'رمز الصنف مطلوب')
+                    continue
+            elif item_id not in known:
+                add_count_error(report, line, f'الصنف غير موجود: {item_id}')
+                continue
+            params.append((stocktake_id, quantity, counted_at, item_id))
+
+        db.executemany(_COUNT_SQL.format(counted=_COUNTED[mode]), params)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report['recorded'] = len(params)
+    return report
+
+
+def parse_count(value):
+    """الكمية المعدودة: عدد صحيح غير سالب، أو ValueError"""
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, str):
+        value = value.strip()
+    quantity = float(value)
+    if not 0 <= quantity < 2 ** 63 or quantity != int(quantity):
+        raise ValueError
+    return int(quantity)
+
+
+def counts_from_rows(rows, report):
+    """قائمة العد من صفوف ملف (iter_file_rows): عمود sku أو barcode أو item_id،
+    وعمود counted أو quantity. الصفوف غير الصالحة تضاف لأخطاء التقرير."""
+    counts = []
+    for line, row in rows:
+        raw = row.get('counted', row.get('quantity'))
+        try:
+            quantity = parse_count(raw)
+        except (TypeError, ValueError):
+            add_count_error(report, line, f'كمية غير صحيحة: {raw}')
+            continue
+        item_id = row.get('item_id')
+        if item_id not in (None, ''):
+            try:
+                counts.append((line, int(float(item_id)), None, quantity))
+            except (ValueError, OverflowError):
+                add_count_error(report, line, f'رقم صنف غير صحيح: {item_id}')
+            continue
+        code = row.get('sku') or row.get('barcode') or row.get('code')
+        code = str(code).strip() if code is not None else None
+        counts.append((line, None, code or None, quantity))
+    return counts
+
+
+def apply_stocktake(db, stocktake_id, user_id=None, user_name=None):
+    """اعتماد الجلسة: تطبيق كل الفروق وتسجيل حركاتها في معاملة واحدة
+
+    الكمية الجديدة = الكمية الحالية + (المعدود - المتوقع)، ولا تقل عن صفر.
+    يرجع {'items': عدد الأصناف المعدلة، 'net_change': صافي التغيير}.
+    """
+    _begin_open(db, stocktake_id)
+    try:
+        changes = {}
+        updates = []
+        for row in db.execute('''
+            SELECT l.item_id, l.counted_quantity - l.expected_quantity AS variance, i.quantity
+            FROM stocktake_lines l
+            JOIN items i ON i.id = l.item_id
+            WHERE l.stocktake_id = ? AND l.counted_quantity != l.expected_quantity
+        ''', (stocktake_id,)):
+            new_quantity = max(row['quantity'] + row['variance'], 0)
+            if new_quantity != row['quantity']:
+                changes[row['item_id']] = new_quantity - row['quantity']
+                updates.append((new_quantity, row['item_id']))
+
+        applied_at = now_str()
+        db.executemany('UPDATE items SET quantity = ? WHERE id = ?', updates)
+        record_movements(db, changes, STOCKTAKE, reference_id=stocktake_id, user_id=user_id,
+                         user_name=user_name, created_at=applied_at)
+        db.execute('''
+            UPDATE stocktakes SET status = ?, applied_at = ?, applied_by_name = ? WHERE id = ?
+        ''', (APPLIED, applied_at, user_name, stocktake_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    stock_changed(db)
+    return {'items': len(changes), 'net_change': sum(changes.values())}
+
+
+def cancel_stocktake(db, stocktake_id):
+    """إلغاء جلسة مفتوحة دون تعديل المخزون"""
+    _begin_open(db, stocktake_id)
+    try:
+        db.execute('UPDATE stocktakes SET status = ? WHERE id = ?', (CANCELLED, stocktake_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
@@ -347,6 +347,27 @@ function enhanceConfirmButtons() {
   });
 }
 
+// البث الحي من الخادم (لوحة التحكم وتنبيهات المخزون)
+function connectLiveEvents(handlers) {
+  if (!window.EventSource) {
+    return null;
+  }
+  const source = new EventSource('/api/events');
+  Object.entries(handlers).forEach(([type, handler]) => {
+    source.addEventListener(type, event => handler(JSON.parse(event.data)));
+  });
+  return source;
+}
+
+function notifyLowStock(item) {
+  if (!item.low) {
+    return;
+  }
+  const name = document.createElement('span');
+  name.textContent = item.name;
+  showNotification(`تنبيه مخزون: ${name.innerHTML} - المتبقي ${item.quantity} (حد الطلب ${item.reorder_level})`, 'warning', 8000);
+}
+
 // عمليات الصفحة الرئيسية
 function refreshDashboard() {
   showConfirmModal({
@@ -358,6 +379,10 @@ function refreshDashboard() {
     cancelText: 'إلغاء',
     icon: 'arrow-clockwise',
     onConfirm: () => {
+      if (typeof loadDashboardData === 'function') {
+        loadDashboardData().then(() => showNotification('تم تحديث البيانات', 'success', 2000));
+        return;
+      }
       showNotification('جاري تحديث البيانات...', 'info', 2000);
       setTimeout(() => {
         window.location.reload();
@@ -4,7 +4,7 @@
 """
 
 from functools import wraps
-from flask import request, redirect, url_for, flash, session
+from flask import request, redirect, url_for, flash, session, jsonify
 from ..models.database import get_db
 
 def check_user_permissions(username, required_role):
@@ -46,6 +46,15 @@ def login_required(role=None):
         return wrapper
     return auth_decorator
 
+def api_login_required(f):
+    """مطلوب تسجيل الدخول لواجهات JSON - يرجع 401 بدلاً من التحويل"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'message': 'الرجاء تسجيل الدخول'}), 401
+        return f(*args, **kwargs)
+    return wrapper
+
 def manager_required(f):
     """مطلوب دور مدير للوصول"""
     @wraps(f)
@@ -124,4 +133,20 @@ def dev_or_owner_required(f):
         else:
             flash('لا تملك صلاحية الوصول. هذه الصفحة متاحة للمطور والمالك فقط.', 'danger')
             return redirect(url_for('main.index'))
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+# الأدوار التي تدير المخزون والتقارير المالية
+ADMIN_ROLES = ('owner', 'dev', 'admin')
+
+def admin_required(f):
+    """مطلوب دور المالك أو المطور أو المشرف للوصول"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('الرجاء تسجيل الدخول', 'warning')
+            return redirect(url_for('auth.login', next=request.path))
+        if session.get('role') in ADMIN_ROLES or session.get('username') in ['dev', 'owner']:
+            return f(*args, **kwargs)
+        flash('لا تملك صلاحية الوصول. هذه الصفحة متاحة للمالك والمطور والمشرف فقط.', 'danger')
+        return redirect(url_for('main.index'))
+    return wrapper
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+أدوات نطاقات التاريخ
+
+تعيد حدود نطاق نصف مفتوح [البداية، النهاية) بصيغة النص المخزنة في
+created_at، لتستخدم في الاستعلامات بالشكل:
+    created_at >= ? AND created_at < ?
+وهو ما يسمح لـ SQLite باستخدام الفهارس بدلاً من DATE(created_at) = ?
+"""
+
+from datetime import datetime, timedelta
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def day_range(day=None):
+    """نطاق يوم واحد (افتراضياً اليوم)"""
+    start = datetime.strptime(day, DATE_FORMAT) if day else datetime.now()
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=1)
+    return start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)
+
+
+def month_range(month=None):
+    """نطاق شهر بصيغة YYYY-MM (افتراضياً الشهر الحالي)"""
+    start = datetime.strptime(month, '%Y-%m') if month else datetime.now().replace(day=1)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start.strftime('%Y-%m-01'), end.strftime('%Y-%m-01')
+
+
+def year_range(year=None):
+    """نطاق سنة بصيغة YYYY (افتراضياً السنة الحالية)"""
+    year = int(year) if year else datetime.now().year
+    return f'{year:04d}-01-01', f'{year + 1:04d}-01-01'
+
+
+def date_span(start_date=None, end_date=None):
+    """نطاق من تاريخ بداية إلى تاريخ نهاية شامل (أي منهما اختياري)
+
+    تعيد (start, end) حيث end هو اليوم التالي لتاريخ النهاية، أو None.
+    """
+    start = day_range(start_date)[0] if start_date else None
+    end = day_range(end_date)[1] if end_date else None
+    return start, end
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+تصدير البيانات إلى CSV و Excel
+
+الصفوف تقرأ من مؤشر قاعدة البيانات على دفعات وتكتب مباشرة إلى
+الاستجابة، فلا تحمل الجداول كاملة في الذاكرة ولا تبقى ملفات على القرص.
+CSV يستخدم مكتبة csv القياسية، و Excel يستخدم openpyxl في وضع
+الكتابة فقط (write_only) إن كانت مثبتة.
+"""
+
+import csv
+import io
+import tempfile
+
+from flask import Response, stream_with_context
+
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+# عدد الصفوف المقروءة من المؤشر في كل دفعة
+EXPORT_BATCH_SIZE = 1000
+
+# حجم الأجزاء المرسلة من ملف Excel المؤقت
+_CHUNK_SIZE = 64 * 1024
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def default_format():
+    """صيغة التصدير الافتراضية (Excel إن كانت openpyxl متوفرة)"""
+    return 'xlsx' if OPENPYXL_AVAILABLE else 'csv'
+
+
+def iter_rows(cursor, columns, batch_size=EXPORT_BATCH_SIZE):
+    """قراءة صفوف المؤشر على دفعات كقوائم قيم بترتيب الأعمدة"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield [row[column] for column in columns]
+
+
+def stream_csv(columns, rows):
+    """توليد ملف CSV على أجزاء (مع BOM حتى يعرض Excel النص العربي بشكل صحيح)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _build_workbook(columns, rows, sheet_title=None):
+    """ملف Excel في وضع الكتابة فقط (الصفوف تكتب مباشرة ولا تبقى في الذاكرة)"""
+    if not OPENPYXL_AVAILABLE:
+        raise ValueError('مكتبة openpyxl غير متوفرة. يمكن التصدير بصيغة CSV')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(columns)
+    try:
+        for row in rows:
+            sheet.append(row)
+    except Exception:
+        # إغلاق الورقة حتى لا يكتب مولدها الداخلي في ملف مغلق عند التنظيف
+        sheet.close()
+        raise
+    return workbook
+
+
+def save_xlsx(columns, rows, sheet_title=None):
+    """كتابة ملف Excel كاملاً إلى ملف مؤقت وإرجاعه مفتوحاً من بدايته
+
+    ملف xlsx أرشيف zip لا يمكن إرساله قبل اكتماله، لذلك يبنى قبل إنشاء
+    الاستجابة: أي خطأ (openpyxl أو المؤشر) يظهر قبل إرسال الترويسات.
+    الملف يحذف تلقائياً عند إغلاقه.
+    """
+    output = tempfile.TemporaryFile()
+    try:
+        _build_workbook(columns, rows, sheet_title).save(output)
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
+    return output
+
+
+def stream_file(output):
+    """إرسال ملف مفتوح على أجزاء ثم إغلاقه"""
+    with output:
+        while True:
+            chunk = output.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def write_export(path, columns, rows, export_format=None, sheet_title=None):
+    """كتابة التصدير إلى ملف (للمهام الخلفية) - يرجع الصيغة المستخدمة"""
+    export_format = export_format or default_format()
+    if export_format == 'xlsx':
+        _build_workbook(columns, rows, sheet_title).save(path)
+    elif export_format == 'csv':
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in stream_csv(columns, rows):
+                f.write(chunk)
+    else:
+        raise ValueError(f'صيغة التصدير غير مدعومة: {export_format}')
+    return export_format
+
+
+def export_response(filename, columns, rows, export_format=None, sheet_title=None):
+    """استجابة تنزيل ملف CSV أو Excel (CSV يبث الصفوف أثناء قراءتها، و Excel
+    يبنى كاملاً قبل الاستجابة حتى تصل أخطاؤه إلى المستدعي)
+
+    filename: اسم الملف بدون الامتداد
+    rows: أي مولد لقوائم القيم (مثلاً iter_rows)
+    """
+    export_format = export_format or default_format()
+    if export_format == 'xlsx' and not OPENPYXL_AVAILABLE:
+        raise ValueError('مكتبة openpyxl غير متوفرة. يمكن التصدير بصيغة CSV')
+    output = None
+    if export_format == 'xlsx':
+        output = save_xlsx(columns, rows, sheet_title)
+        body = stream_file(output)
+    elif export_format == 'csv':
+        body = stream_csv(columns, rows)
+    else:
+        raise ValueError(f'صيغة التصدير غير مدعومة: {export_format}')
+
+    response = Response(stream_with_context(body), mimetype=MIMETYPES[export_format])
+    if output is not None:
+        # إذا لم يبدأ الإرسال (انقطع الاتصال) يغلق الملف المؤقت مع الاستجابة
+        response.call_on_close(output.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+استيراد الأصناف والفئات من CSV و Excel
+
+الملف يقرأ على دفعات (csv القياسية أو openpyxl في وضع القراءة فقط)،
+الفئات تحمل مرة واحدة في قاموس اسم -> معرف، والأصناف تدرج أو تحدث
+حسب SKU بأمر executemany لكل دفعة داخل معاملة واحدة. الصفوف غير
+الصالحة لا توقف الاستيراد وتعود في تقرير الأخطاء مع رقم السطر.
+"""
+
+import csv
+import io
+import math
+from functools import partial
+from itertools import islice
+
+try:
+    from openpyxl import load_workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+from ..models.barcodes import parse_barcodes
+from ..models.database import now_str
+from ..models.stock_ledger import IMPORT, record_movements
+
+# عدد الصفوف في كل دفعة executemany
+IMPORT_BATCH_SIZE = 1000
+
+# أقصى عدد أخطاء يحتفظ بها التقرير (العدد الكلي يبقى صحيحاً)
+MAX_REPORTED_ERRORS = 200
+
+# أسماء أعمدة القوالب القديمة
+_ITEM_COLUMN_ALIASES = {
+    'price': 'selling_price',
+    'min_quantity': 'reorder_level',
+}
+
+# الصنف الموجود: cost_price متوسط مرجح (models/costing.py) فلا يستبدل بتكلفة
+# الملف. زيادة الكمية تدخل المتوسط بتكلفة الملف مثل بند شراء، والنقص أو عدم
+# التغيير يبقي المتوسط كما هو، وبدون رصيد موجب تصبح التكلفة تكلفة الملف
+_ITEM_UPSERT_SQL = '''
+    INSERT INTO items (name, sku, cost_price, selling_price, quantity, reorder_level,
+                       category_id, description, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(sku) DO UPDATE SET
+        name = excluded.name,
+        cost_price = CASE
+            WHEN items.quantity <= 0 THEN excluded.cost_price
+            WHEN excluded.quantity > items.quantity
+                THEN (items.quantity * IFNULL(items.cost_price, 0)
+                      + (excluded.quantity - items.quantity) * excluded.cost_price) / excluded.quantity
+            ELSE items.cost_price END,
+        selling_price = excluded.selling_price,
+        quantity = excluded.quantity,
+        reorder_level = excluded.reorder_level,
+        category_id = COALESCE(excluded.category_id, items.category_id),
+        description = COALESCE(excluded.description, items.description)
+'''
+
+
+# باركود إضافي لصنف حسب SKU (يتخطى إذا كان مستخدماً أو يطابق SKU صنف آخر)
+_BARCODE_INSERT_SQL = '''
+    INSERT OR IGNORE INTO item_barcodes (item_id, barcode)
+    SELECT id, ? FROM items
+    WHERE sku = ? AND NOT EXISTS (SELECT 1 FROM items WHERE sku = ?)
+'''
+
+
+class ImportFileError(Exception):
+    """الملف نفسه غير صالح (صيغة غير مدعومة أو أعمدة مطلوبة مفقودة)"""
+
+
+def _normalize_header(header):
+    return [str(column or '').strip().lower() for column in header]
+
+
+def _iter_csv(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    if header is None:
+        return
+    yield _normalize_header(header)
+    yield from reader
+
+
+def _iter_xlsx(stream):
+    if not OPENPYXL_AVAILABLE:
+        raise ImportFileError('مكتبة openpyxl غير متوفرة. يرجى استخدام ملف CSV')
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield _normalize_header(header)
+        yield from rows
+    finally:
+        workbook.close()
+
+
+def iter_file_rows(stream, filename):
+    """قراءة صفوف الملف كقواميس (رقم السطر، {العمود: القيمة}) بدون تحميله كاملاً"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        rows = _iter_csv(stream)
+    elif extension == 'xlsx':
+        rows = _iter_xlsx(stream)
+    else:
+        raise ImportFileError('صيغة الملف غير مدعومة. يرجى حفظه بصيغة CSV أو xlsx')
+
+    header = next(rows, None)
+    if header is None:
+        return
+    for line_number, values in enumerate(rows, 2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield line_number, dict(zip(header, values))
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value, cast, default):
+    value = _text(value)
+    if value is None:
+        return default
+    if cast is not int:
+        number = cast(value)
+        if not math.isfinite(number):
+            raise ValueError(value)
+        return number
+    number = int(float(value))
+    # أكبر من عدد SQLite الصحيح (64 بت) يفشل عند الإدراج ويوقف الاستيراد كله
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise OverflowError(value)
+    return number
+
+
+def _new_report():
+    return {'success': True, 'count': 0, 'inserted': 0, 'updated': 0, 'skipped': 0,
+            'error_count': 0, 'errors': []}
+
+
+def _add_error(report, line_number, message):
+    report['error_count'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'row': line_number, 'message': message})
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            break
+        yield batch
+
+
+def _run_import(db, handler, rows, progress=None):
+    """تنفيذ الاستيراد كاملاً داخل معاملة واحدة"""
+    report = _new_report()
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    try:
+        handler(db, rows, report, progress)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report['count'] = report['inserted'] + report['updated']
+    return report
+
+
+def _category_map(db):
+    return {row['name']: row['id'] for row in db.execute('SELECT id, name FROM categories')}
+
+
+def _import_items(db, rows, report, progress, user_id=None, user_name=None):
+    categories = _category_map(db)
+    # الكمية الحالية لكل SKU لحساب حركات المخزون (الاستيراد يستبدل الكمية)
+    quantities = {row['sku']: row['quantity']
+                  for row in db.execute('SELECT sku, quantity FROM items WHERE sku IS NOT NULL')}
+    created_at = now_str()
+    header_checked = False
+    movement = {'user_id': user_id, 'user_name': user_name, 'created_at': created_at}
+
+    for batch in _batches(rows, IMPORT_BATCH_SIZE):
+        params = []
+        barcode_params = []
+        changes = {}
+        for line_number, row in batch:
+            for old, new in _ITEM_COLUMN_ALIASES.items():
+                if old in row and new not in row:
+                    row[new] = row[old]
+            if not header_checked:
+                if 'name' not in row:
+                    raise ImportFileError('العمود "name" مطلوب')
+                header_checked = True
+
+            name = _text(row.get('name'))
+            if not name:
+                _add_error(report, line_number, 'اسم الصنف مطلوب')
+                continue
+            try:
+                cost_price = _number(row.get('cost_price'), float, 0.0)
+                selling_price = _number(row.get('selling_price'), float, 0.0)
+                quantity = _number(row.get('quantity'), int, 0)
+                reorder_level = _number(row.get('reorder_level'), int, 5)
+            except (ValueError, OverflowError):
+                _add_error(report, line_number, f'قيمة رقمية غير صحيحة في الصنف {name}')
+                continue
+            if quantity < 0 or cost_price < 0 or selling_price < 0:
+                _add_error(report, line_number, f'قيم سالبة غير مسموحة في الصنف {name}')
+                continue
+
+            category_id = None
+            category_name = _text(row.get('category_name'))
+            if category_name:
+                category_id = categories.get(category_name)
+                if category_id is None:
+                    category_id = db.execute(
+                        'INSERT INTO categories (name, created_at) VALUES (?, ?)',
+                        (category_name, created_at)
+                    ).lastrowid
+                    categories[category_name] = category_id
+
+            sku = _text(row.get('sku'))
+            item_params = (name, sku, cost_price, selling_price, quantity, reorder_level,
+                           category_id, _text(row.get('description')), created_at)
+            if sku is None:
+                # صنف جديد دائماً - يدرج منفرداً لمعرفة رقمه في سجل الحركات
+                report['inserted'] += 1
+                item_id = db.execute(_ITEM_UPSERT_SQL, item_params).lastrowid
+                record_movements(db, {item_id: quantity}, IMPORT, **movement)
+            else:
+                if sku in quantities:
+                    report['updated'] += 1
+                else:
+                    report['inserted'] += 1
+                changes[sku] = changes.get(sku, 0) + quantity - quantities.get(sku, 0)
+                quantities[sku] = quantity
+                params.append(item_params)
+            barcodes = parse_barcodes(_text(row.get('barcodes')))
+            if barcodes and sku is None:
+                _add_error(report, line_number, f'الباركودات تحتاج SKU في الصنف {name}')
+            elif barcodes:
+                barcode_params.extend((code, sku, code) for code in barcodes)
+
+        if params:
+            db.executemany(_ITEM_UPSERT_SQL, params)
+            record_movements(db, changes, IMPORT, key='sku', **movement)
+        if barcode_params:
+            db.executemany(_BARCODE_INSERT_SQL, barcode_params)
+        if progress:
+            progress(line_number)
+
+
+def _import_categories(db, rows, report, progress):
+    categories = _category_map(db)
+    created_at = now_str()
+    header_checked = False
+
+    for batch in _batches(rows, IMPORT_BATCH_SIZE):
+        params = []
+        for line_number, row in batch:
+            if not header_checked:
+                if 'name' not in row:
+                    raise ImportFileError('العمود "name" مطلوب')
+                header_checked = True
+
+            name = _text(row.get('name'))
+            if not name:
+                _add_error(report, line_number, 'اسم الفئة مطلوب')
+                continue
+            if name in categories:
+                report['skipped'] += 1
+                continue
+            categories[name] = None
+            report['inserted'] += 1
+            params.append((name, _text(row.get('description')), created_at))
+
+        if params:
+            db.executemany('INSERT INTO categories (name, description, created_at) VALUES (?, ?, ?)', params)
+        if progress:
+            progress(line_number)
+
+
+def import_items(db, rows, progress=None, user_id=None, user_name=None):
+    """استيراد الأصناف (إدراج أو تحديث حسب SKU) وإرجاع تقرير الاستيراد
+
+    rows: مخرجات iter_file_rows. الأعمدة: name (مطلوب)، sku، cost_price،
+    selling_price، quantity، reorder_level، category_name، description،
+    barcodes (باركودات إضافية مفصولة بفاصلة، تضاف إلى الموجودة).
+    الفئات غير الموجودة تنشأ تلقائياً. الكمية تستبدل، أما cost_price للصنف
+    الموجود فلا يستبدل: الزيادة في الكمية تدخل متوسط التكلفة بتكلفة الملف.
+    progress: دالة اختيارية تستدعى بعد كل دفعة برقم آخر سطر تمت معالجته.
+    تغييرات الكمية تسجل في سجل حركات المخزون باسم المستخدم.
+    """
+    return _run_import(db, partial(_import_items, user_id=user_id, user_name=user_name), rows, progress)
+
+
+def import_categories(db, rows, progress=None):
+    """استيراد الفئات (الفئات الموجودة بنفس الاسم تتخطى) وإرجاع تقرير الاستيراد"""
+    return _run_import(db, _import_categories, rows, progress)
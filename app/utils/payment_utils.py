@@ -18,8 +18,7 @@ def get_payment_method_name(payment_method_id: str) -> str:
         str: اسم طريقة الدفع أو 'غير محدد' إذا لم توجد
     """
     try:
-        # إعادة تحميل الإعدادات للتأكد من الحصول على أحدث البيانات
-        payment_method_settings.settings = payment_method_settings.load_settings()
+        # الإعدادات تعاد قراءتها من قاعدة البيانات فقط إذا تغير رقم إصدارها
         methods = payment_method_settings.get_all_methods()
         
         for method in methods:
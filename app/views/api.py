@@ -3,18 +3,55 @@
 API endpoints للتطبيق
 """
 
-from flask import Blueprint, jsonify
-from ..models.database import get_db
-from ..utils.auth import dev_or_owner_required
+from flask import (Blueprint, Response, jsonify, request, session, current_app, send_file, url_for,
+                   stream_with_context)
+from werkzeug.http import generate_etag
+from ..models.database import get_db, get_read_db, get_pool_stats
+from ..models.checkout import checkout, terminal_options, CheckoutError
+from ..models.catalog import get_catalog_version, get_catalog_changes
+from ..models.jobs import get_job, get_job_file
+from ..models.dashboard import get_dashboard_snapshot
+from ..models.events import event_stream
+from ..models.search import search_items as search_items_index
+from ..models.barcodes import lookup_code, lookup_codes, MAX_BATCH_CODES
+from ..models.stock_ledger import stock_at
+from ..models.stocktake import (COUNT_MODES, StocktakeError, get_stocktake, stocktake_summary, record_counts,
+                                new_count_report, add_count_error, parse_count)
+from ..models.backups import (create_backup, create_incremental_backup, list_backups, get_backup_path,
+                              restore_backup, BackupError)
+from ..utils.auth import dev_or_owner_required, api_login_required
+from ..utils.date_ranges import day_range
 
 api_bp = Blueprint('api', __name__)
 
+# الحقول المتاحة في واجهة الأصناف وتعبير SQL لكل حقل
+ITEM_FIELDS = {
+    'id': 'i.id',
+    'name': 'i.name',
+    'sku': 'i.sku',
+    'price': 'CASE WHEN i.selling_price > 0 THEN i.selling_price ELSE i.cost_price END',
+    'quantity': 'i.quantity',
+    'reorder_level': 'i.reorder_level',
+    'category_id': 'i.category_id',
+    'category_name': 'c.name',
+}
+DEFAULT_ITEM_FIELDS = ('id', 'name', 'sku', 'price', 'quantity', 'category_id', 'category_name')
+SEARCH_LIMIT = 50
+# أقصى عدد سطور في دفعة عد واحدة
+MAX_STOCKTAKE_LINES = 5000
+
+def _item_columns():
+    """أعمدة الاستعلام حسب المعامل fields (مثال: ?fields=id,name,price)"""
+    requested = request.args.get('fields', '')
+    fields = [f.strip() for f in requested.split(',') if f.strip() in ITEM_FIELDS] or DEFAULT_ITEM_FIELDS
+    return ', '.join(f'{ITEM_FIELDS[f]} AS {f}' for f in fields)
+
 @api_bp.route('/api/statistics/items')
 @dev_or_owner_required
 def get_items_statistics():
     """إحصائيات الأصناف"""
     try:
-        db = get_db()
+        db = get_read_db()
         count = db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
         return jsonify({'count': count})
     except Exception as e:
@@ -25,7 +62,7 @@ def get_items_statistics():
 def get_categories_statistics():
     """إحصائيات الفئات"""
     try:
-        db = get_db()
+        db = get_read_db()
         count = db.execute('SELECT COUNT(*) FROM categories').fetchone()[0]
         return jsonify({'count': count})
     except Exception as e:
@@ -36,7 +73,7 @@ def get_categories_statistics():
 def get_invoices_statistics():
     """إحصائيات الفواتير"""
     try:
-        db = get_db()
+        db = get_read_db()
         count = db.execute('SELECT COUNT(*) FROM invoices').fetchone()[0]
         return jsonify({'count': count})
     except Exception as e:
@@ -47,8 +84,342 @@ def get_invoices_statistics():
 def get_sales_statistics():
     """إحصائيات المبيعات"""
     try:
-        db = get_db()
+        db = get_read_db()
         count = db.execute('SELECT COUNT(*) FROM sales').fetchone()[0]
         return jsonify({'count': count})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/api/statistics/db-pool')
+@dev_or_owner_required
+def get_db_pool_statistics():
+    """إحصائيات مجمع اتصالات قاعدة البيانات"""
+    try:
+        return jsonify(get_pool_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/api/dashboard_stats')
+@api_login_required
+def get_dashboard_stats():
+    """إحصائيات لوحة التحكم (نفس اللقطة المعروضة في الصفحة الرئيسية)"""
+    try:
+        return jsonify(get_dashboard_snapshot(get_read_db()))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/api/events')
+@api_login_required
+def live_events():
+    """بث حي (Server-Sent Events) للوحة التحكم وتنبيهات المخزون"""
+    response = Response(stream_with_context(event_stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ==================== المهام الخلفية ====================
+
+@api_bp.route('/api/jobs/<job_id>')
+@dev_or_owner_required
+def get_job_status(job_id):
+    """حالة مهمة خلفية ونسبة تقدمها ونتيجتها"""
+    try:
+        job = get_job(get_read_db(), job_id)
+        if job is None:
+            return jsonify({'success': False, 'message': 'المهمة غير موجودة'}), 404
+        if job['has_file'] and job['status'] == 'done':
+            job['download_url'] = url_for('api.download_job_result', job_id=job_id)
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/jobs/<job_id>/download')
+@dev_or_owner_required
+def download_job_result(job_id):
+    """تنزيل ملف نتيجة مهمة منتهية"""
+    result = get_job_file(get_read_db(), job_id)
+    if result is None:
+        return jsonify({'success': False, 'message': 'لا يوجد ملف لهذه المهمة'}), 404
+    return send_file(result['result_path'], mimetype=result['result_mimetype'],
+                     as_attachment=True, download_name=result['result_name'])
+
+# ==================== النسخ الاحتياطي ====================
+
+@api_bp.route('/api/backup/create', methods=['POST'])
+@dev_or_owner_required
+def create_backup_api():
+    """إنشاء نسخة احتياطية مضغوطة من قاعدة البيانات أثناء العمل
+
+    {"mode": "incremental"} ينشئ نسخة بالتغييرات منذ آخر نسخة فقط.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('mode') == 'incremental':
+            backup = create_incremental_backup()
+        else:
+            backup = create_backup()
+        return jsonify({'success': True, 'message': 'تم إنشاء النسخة الاحتياطية بنجاح', **backup})
+    except Exception as e:
+        print(f"خطأ في إنشاء النسخة الاحتياطية: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/backup/list')
+@dev_or_owner_required
+def list_backups_api():
+    """قائمة النسخ الاحتياطية المتوفرة"""
+    try:
+        return jsonify({'success': True, 'backups': list_backups()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/backup/download/<backup_name>')
+@dev_or_owner_required
+def download_backup(backup_name):
+    """تنزيل ملف نسخة احتياطية"""
+    path = get_backup_path(backup_name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'النسخة الاحتياطية غير موجودة'}), 404
+    return send_file(path, mimetype='application/octet-stream',
+                     as_attachment=True, download_name=backup_name)
+
+@api_bp.route('/api/backup/restore', methods=['POST'])
+@dev_or_owner_required
+def restore_backup_api():
+    """استعادة نسخة احتياطية (تؤخذ نسخة من البيانات الحالية قبل الاستعادة)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        result = restore_backup(data.get('backup_name'))
+        return jsonify({
+            'success': True,
+            'message': f'تمت الاستعادة. نسخة البيانات السابقة: {result["safety_backup"]}',
+            **result
+        })
+    except BackupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"خطأ في استعادة النسخة الاحتياطية: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== واجهات نقطة البيع ====================
+
+@api_bp.route('/api/items')
+@api_login_required
+def get_items():
+    """كتالوج الأصناف لأجهزة نقطة البيع مع دعم ETag"""
+    try:
+        db = get_read_db()
+        
+        # ETag مبني على إصدار الكتالوج - لا حاجة لتنفيذ الاستعلام إذا لم يتغير شيء
+        etag = generate_etag(f'{get_catalog_version(db)}?{request.query_string.decode()}'.encode())
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        query = f'''
+            SELECT {_item_columns()}
+            FROM items i
+            LEFT JOIN categories c ON c.id = i.category_id
+            WHERE 1=1
+        '''
+        params = []
+        if request.args.get('category'):
+            query += ' AND i.category_id = ?'
+            params.append(request.args.get('category'))
+        if request.args.get('in_stock') == '1':
+            query += ' AND i.quantity > 0'
+        query += ' ORDER BY i.name'
+        
+        items = [dict(row) for row in db.execute(query, params)]
+        response = jsonify({'items': items})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/items/changes')
+@api_login_required
+def get_items_changes():
+    """التغييرات على الكتالوج منذ إصدار معين (?since=<version>) مع المحذوفات"""
+    try:
+        since = request.args.get('since', 0, type=int)
+        return jsonify(get_catalog_changes(get_read_db(), since))
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/items/by-sku/<path:code>')
+@api_login_required
+def get_item_by_sku(code):
+    """الصنف صاحب SKU أو الباركود (مسح الباركود عند نقطة البيع)"""
+    try:
+        item = lookup_code(get_read_db(), code)
+        if item is None:
+            return jsonify({'success': False, 'message': 'لا يوجد صنف بهذا الرمز'}), 404
+        return jsonify({'success': True, 'item': item})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/items/by-sku', methods=['POST'])
+@api_login_required
+def get_items_by_sku():
+    """عدة رموز في طلب واحد: {"codes": [...]} -> {"items": {الرمز: الصنف أو null}}"""
+    data = request.get_json(silent=True) or {}
+    codes = data.get('codes')
+    if not isinstance(codes, list) or not codes:
+        return jsonify({'success': False, 'message': 'قائمة الرموز مطلوبة'}), 400
+    if len(codes) > MAX_BATCH_CODES:
+        return jsonify({'success': False, 'message': f'الحد الأقصى {MAX_BATCH_CODES} رمز في الطلب'}), 400
+    
+    try:
+        return jsonify({'success': True, 'items': lookup_codes(get_read_db(), [str(code) for code in codes])})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/stock/at')
+@api_login_required
+def get_stock_at():
+    """أرصدة المخزون في نهاية يوم: ?date=YYYY-MM-DD واختيارياً item_id (يتكرر)
+    
+    ترجع {"balances": {رقم الصنف: الرصيد}} للأصناف ذات الرصيد فقط.
+    """
+    date = request.args.get('date', '').strip()
+    item_ids = request.args.getlist('item_id', type=int)
+    try:
+        at = day_range(date)[1]
+    except ValueError:
+        return jsonify({'success': False, 'message': 'تاريخ غير صالح (YYYY-MM-DD)'}), 400
+    
+    try:
+        balances = stock_at(get_read_db(), at, item_ids or None)
+        return jsonify({'success': True, 'date': date or None, 'balances': balances})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/stocktakes/<int:stocktake_id>')
+@api_login_required
+def get_stocktake_summary(stocktake_id):
+    """حالة جلسة الجرد وملخص العد والفروق"""
+    db = get_read_db()
+    stocktake = get_stocktake(db, stocktake_id)
+    if not stocktake:
+        return jsonify({'success': False, 'message': 'جلسة الجرد غير موجودة'}), 404
+    return jsonify({'success': True, 'stocktake': dict(stocktake), 'summary': stocktake_summary(db, stocktake_id)})
+
+@api_bp.route('/api/stocktakes/<int:stocktake_id>/lines', methods=['POST'])
+@api_login_required
+def post_stocktake_lines(stocktake_id):
+    """دفعة عد: {"mode": "set|add", "lines": [{"sku" أو "barcode" أو "item_id", "counted"}]}
+    
+    الدفعة كاملة في معاملة واحدة. السطور غير الصالحة تعود في errors برقمها
+    (يبدأ من 1) ولا توقف الباقي.
+    """
+    data = request.get_json(silent=True) or {}
+    lines = data.get('lines')
+    mode = data.get('mode', 'set')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'success': False, 'message': 'قائمة السطور مطلوبة'}), 400
+    if len(lines) > MAX_STOCKTAKE_LINES:
+        return jsonify({'success': False, 'message': f'الحد الأقصى {MAX_STOCKTAKE_LINES} سطر في الطلب'}), 400
+    if mode not in COUNT_MODES:
+        return jsonify({'success': False, 'message': 'طريقة العد غير صحيحة'}), 400
+    
+    report = new_count_report()
+    counts = []
+    for number, line in enumerate(lines, 1):
+        if not isinstance(line, dict):
+            add_count_error(report, number, 'سطر غير صالح')
+            continue
+        try:
+            quantity = parse_count(line.get('counted', line.get('quantity')))
+            item_id = line.get('item_id')
+            item_id = int(item_id) if item_id is not None else None
+        except (TypeError, ValueError, OverflowError):
+            add_count_error(report, number, 'كمية أو رقم صنف غير صحيح')
+            continue
+        code = line.get('sku') or line.get('barcode') or line.get('code')
+        counts.append((number, item_id, str(code).strip() if code is not None else None, quantity))
+    
+    db = get_db()
+    try:
+        report = record_counts(db, stocktake_id, counts, mode, report)
+        report['summary'] = stocktake_summary(db, stocktake_id)
+        return jsonify(report)
+    except StocktakeError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/search_items')
+@api_login_required
+def search_items():
+    """البحث في الأصناف بالاسم أو SKU أو الوصف (فهرس FTS5) مرتباً حسب الصلة
+    
+    المعاملات: q، limit، category، in_stock=1، facets=0 لإلغاء عدد الفئات، fields.
+    كل صنف يحمل highlight (HTML آمن مع <mark>)، ومع النتائج total و truncated
+    (الكلمة طابقت أكثر مما يرتب) و facets.
+    """
+    try:
+        q = request.args.get('q', '').strip()
+        limit = max(1, min(request.args.get('limit', SEARCH_LIMIT, type=int), SEARCH_LIMIT))
+        if not q:
+            return jsonify({'items': [], 'total': 0, 'truncated': False, 'facets': None})
+        
+        result = search_items_index(
+            get_read_db(), q, _item_columns(), limit=limit,
+            category_id=request.args.get('category', type=int),
+            in_stock=request.args.get('in_stock') == '1',
+            facets=request.args.get('facets', '1') != '0'
+        )
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@api_bp.route('/api/checkout', methods=['POST'])
+@api_login_required
+def api_checkout():
+    """إتمام البيع من أجهزة نقطة البيع - يرجع رقم الفاتورة في نفس الطلب"""
+    data = request.get_json(silent=True)
+    cart = data.get('cart') if isinstance(data, dict) else None
+    if not isinstance(cart, list) or not cart:
+        return jsonify({'success': False, 'message': 'لا توجد أصناف في السلة'}), 400
+    if not all(isinstance(line, dict) for line in cart):
+        return jsonify({'success': False, 'message': 'بيانات السلة غير صحيحة'}), 400
+    try:
+        discount_amount = float(data.get('discount_amount', 0) or 0)
+        tax_amount = float(data.get('tax_amount', 0) or 0)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'قيمة الخصم أو الضريبة غير صحيحة'}), 400
+    
+    try:
+        lines = [{
+            'item_id': line.get('item_id', line.get('id')),
+            'quantity': line.get('quantity'),
+            # بدون سعر يباع بسعر البيع المسجل للصنف (وليس بصفر)
+            'unit_price': line.get('unit_price', line.get('price')),
+        } for line in cart]
+        
+        result = checkout(
+            get_db(), lines,
+            prefix=current_app.config.get('POS_INVOICE_PREFIX', 'POS-'),
+            payment_method=data.get('payment_method', 'cash'),
+            customer_name=data.get('customer_name'),
+            customer_phone=data.get('customer_phone'),
+            discount_amount=discount_amount,
+            tax_amount=tax_amount,
+            user_id=session.get('user_id'),
+            user_name=session.get('username'),
+            fill_selling_price=True,
+            **terminal_options()
+        )
+        return jsonify({
+            'success': True,
+            'message': f'تم إتمام البيع بنجاح! رقم الفاتورة: {result["invoice_number"]}',
+            'invoice_id': result['invoice_id'],
+            'invoice_number': result['invoice_number'],
+            'final_amount': result['final_amount']
+        })
+    except CheckoutError as e:
+        return jsonify({'success': False, 'message': e.message, 'problems': e.problems}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في البيع: {str(e)}'}), 500
@@ -4,30 +4,22 @@
 """
 
 import os
-import json
-import csv
+import uuid
 from datetime import datetime
 
-try:
-    import pandas as pd
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
-    print("Warning: pandas not available. Excel export/import will be limited.")
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from werkzeug.utils import secure_filename
-from ..models.database import get_db
+from ..models.database import get_db, get_read_db
+from ..models.jobs import job_handler, submit_job, results_dir
 from ..utils.auth import dev_or_owner_required
+from ..utils.exporters import (export_response, write_export, iter_rows, default_format,
+                               MIMETYPES, EXPORT_BATCH_SIZE)
+from ..utils.importers import iter_file_rows, import_items, import_categories, ImportFileError
 
 data_management_bp = Blueprint('data_management', __name__)
 
-# إعدادات رفع الملفات
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls', 'json'}
-
-# إنشاء مجلد الرفع إذا لم يكن موجوداً
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# الملفات المسموح باستيرادها
+ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
 
 def allowed_file(filename):
     """التحقق من نوع الملف المسموح"""
@@ -39,189 +31,145 @@ def index():
     """الصفحة الرئيسية لإدارة البيانات"""
     return render_template('data_management/index.html')
 
+# الأعمدة والاستعلام لكل نوع تصدير
+EXPORTS = {
+    'items': (
+        ['id', 'name', 'sku', 'cost_price', 'selling_price', 'quantity', 'reorder_level',
+         'category_name', 'description', 'barcodes', 'created_at'],
+        '''
+        SELECT i.id, i.name, i.sku, i.cost_price, i.selling_price, i.quantity, i.reorder_level,
+               c.name as category_name, i.description,
+               (SELECT group_concat(b.barcode, ',') FROM item_barcodes b WHERE b.item_id = i.id) as barcodes,
+               i.created_at
+        FROM items i 
+        LEFT JOIN categories c ON c.id = i.category_id 
+        ORDER BY i.name
+        ''',
+    ),
+    'categories': (
+        ['id', 'name', 'description', 'created_at'],
+        'SELECT id, name, description, created_at FROM categories ORDER BY name',
+    ),
+    'invoices': (
+        ['id', 'invoice_number', 'customer_name', 'customer_phone', 'total_amount',
+         'discount_amount', 'tax_amount', 'final_amount', 'payment_method', 'status',
+         'created_at', 'created_by_name'],
+        '''
+        SELECT i.id, i.invoice_number, i.customer_name, i.customer_phone, i.total_amount,
+               i.discount_amount, i.tax_amount, i.final_amount, i.payment_method, i.status,
+               i.created_at, COALESCE(i.created_by_name, u.username) as created_by_name
+        FROM invoices i 
+        LEFT JOIN users u ON u.id = i.created_by 
+        ORDER BY i.created_at DESC
+        ''',
+    ),
+    'sales': (
+        ['id', 'invoice_number', 'item_name', 'quantity', 'unit_price', 'total_price',
+         'discount_amount', 'tax_amount', 'final_price', 'unit_cost', 'created_at'],
+        '''
+        SELECT s.id, inv.invoice_number, i.name as item_name, s.quantity, s.unit_price,
+               s.total_price, s.discount_amount, s.tax_amount, s.final_price, s.unit_cost, s.created_at
+        FROM sales s 
+        JOIN items i ON i.id = s.item_id 
+        JOIN invoices inv ON inv.id = s.invoice_id
+        ORDER BY s.created_at DESC
+        ''',
+    ),
+}
+
 @data_management_bp.route('/data-management/export')
 @dev_or_owner_required
 def export_data():
     """تصدير البيانات"""
     export_type = request.args.get('type', 'items')
     
-    if export_type == 'items':
-        return export_items()
-    elif export_type == 'categories':
-        return export_categories()
-    elif export_type == 'invoices':
-        return export_invoices()
-    elif export_type == 'sales':
-        return export_sales()
-    else:
+    if export_type not in EXPORTS:
         flash('نوع التصدير غير صحيح', 'danger')
         return redirect(url_for('data_management.index'))
-
-def export_items():
-    """تصدير بيانات الأصناف"""
+    
     try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام تصدير Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        db = get_db()
-        items = db.execute('''
-            SELECT i.*, c.name as category_name 
-            FROM items i 
-            LEFT JOIN categories c ON c.id = i.category_id 
-            ORDER BY i.name
-        ''').fetchall()
-        
-        # تحويل إلى DataFrame
-        data = []
-        for item in items:
-            data.append({
-                'id': item['id'],
-                'name': item['name'],
-                'sku': item['sku'],
-                'price': item['price'],
-                'quantity': item['quantity'],
-                'min_quantity': item['min_quantity'],
-                'category_name': item['category_name'],
-                'description': item['description'],
-                'created_at': item['created_at']
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # حفظ كملف Excel
-        filename = f'items_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
-        
+        columns, query = EXPORTS[export_type]
+        cursor = get_read_db().execute(query)
+        return export_response(_export_filename(export_type), columns, iter_rows(cursor, columns),
+                               _export_format(), sheet_title=export_type)
     except Exception as e:
         flash(f'خطأ في تصدير البيانات: {str(e)}', 'danger')
         return redirect(url_for('data_management.index'))
 
-def export_categories():
-    """تصدير بيانات الفئات"""
-    try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام تصدير Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        db = get_db()
-        categories = db.execute('SELECT * FROM categories ORDER BY name').fetchall()
-        
-        data = []
-        for cat in categories:
-            data.append({
-                'id': cat['id'],
-                'name': cat['name'],
-                'description': cat['description'],
-                'created_at': cat['created_at']
-            })
-        
-        df = pd.DataFrame(data)
-        
-        filename = f'categories_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
-        
-    except Exception as e:
-        flash(f'خطأ في تصدير البيانات: {str(e)}', 'danger')
-        return redirect(url_for('data_management.index'))
+def _export_format():
+    """صيغة التصدير المطلوبة (?format=csv أو xlsx)"""
+    return request.values.get('format') or default_format()
+
+def _export_filename(name):
+    return f'{name}_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+
+@job_handler('export')
+def _export_job(job, params):
+    """تصدير في الخلفية إلى ملف نتيجة المهمة"""
+    export_type = params['type']
+    export_format = params['format']
+    columns, query = EXPORTS[export_type]
+    db = get_read_db()
+    total = db.execute(f'SELECT COUNT(*) FROM ({query})').fetchone()[0]
+    
+    def counted(rows):
+        for count, row in enumerate(rows, 1):
+            if count % EXPORT_BATCH_SIZE == 0:
+                job.progress(count / total, f'تم تصدير {count} من {total}')
+            yield row
+    
+    path = job.result_file(f'{_export_filename(export_type)}.{export_format}', MIMETYPES[export_format])
+    write_export(path, columns, counted(iter_rows(db.execute(query), columns)),
+                 export_format, sheet_title=export_type)
+    return {'rows': total}
+
+@job_handler('import')
+def _import_job(job, params):
+    """استيراد في الخلفية من الملف المرفوع"""
+    def progress(line_number):
+        job.progress(message=f'تمت معالجة {line_number} سطر', persist=False)
+    
+    with open(params['input_path'], 'rb') as f:
+        rows = iter_file_rows(f, params['filename'])
+        if params['type'] == 'items':
+            return import_items(get_db(), rows, progress, params.get('user_id'), params.get('user_name'))
+        return import_categories(get_db(), rows, progress)
 
-def export_invoices():
-    """تصدير بيانات الفواتير"""
-    try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام تصدير Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        db = get_db()
-        invoices = db.execute('''
-            SELECT i.*, u.username as created_by_name
-            FROM invoices i 
-            LEFT JOIN users u ON u.id = i.created_by 
-            ORDER BY i.created_at DESC
-        ''').fetchall()
-        
-        data = []
-        for inv in invoices:
-            data.append({
-                'id': inv['id'],
-                'invoice_number': inv['invoice_number'],
-                'customer_name': inv['customer_name'],
-                'customer_phone': inv['customer_phone'],
-                'total_amount': inv['total_amount'],
-                'discount_amount': inv['discount_amount'],
-                'tax_amount': inv['tax_amount'],
-                'final_amount': inv['final_amount'],
-                'payment_method': inv['payment_method'],
-                'status': inv['status'],
-                'created_at': inv['created_at'],
-                'created_by_name': inv['created_by_name']
-            })
-        
-        df = pd.DataFrame(data)
-        
-        filename = f'invoices_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
-        
-    except Exception as e:
-        flash(f'خطأ في تصدير البيانات: {str(e)}', 'danger')
-        return redirect(url_for('data_management.index'))
+@data_management_bp.route('/data-management/jobs/export', methods=['POST'])
+@dev_or_owner_required
+def export_job():
+    """تصدير في الخلفية - يرجع رقم المهمة لمتابعتها عبر /api/jobs/<id>"""
+    export_type = request.values.get('type', 'items')
+    export_format = _export_format()
+    if export_type not in EXPORTS or export_format not in MIMETYPES:
+        return jsonify({'success': False, 'message': 'نوع التصدير غير صحيح'}), 400
+    
+    job_id = submit_job('export', {'type': export_type, 'format': export_format}, session.get('user_id'))
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': url_for('api.get_job_status', job_id=job_id)}), 202
 
-def export_sales():
-    """تصدير بيانات المبيعات"""
-    try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام تصدير Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        db = get_db()
-        sales = db.execute('''
-            SELECT s.*, i.name as item_name, inv.invoice_number
-            FROM sales s 
-            JOIN items i ON i.id = s.item_id 
-            JOIN invoices inv ON inv.id = s.invoice_id
-            ORDER BY s.created_at DESC
-        ''').fetchall()
-        
-        data = []
-        for sale in sales:
-            data.append({
-                'id': sale['id'],
-                'invoice_number': sale['invoice_number'],
-                'item_name': sale['item_name'],
-                'quantity': sale['quantity'],
-                'unit_price': sale['unit_price'],
-                'total_price': sale['total_price'],
-                'discount_amount': sale['discount_amount'],
-                'tax_amount': sale['tax_amount'],
-                'final_price': sale['final_price'],
-                'created_at': sale['created_at']
-            })
-        
-        df = pd.DataFrame(data)
-        
-        filename = f'sales_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
-        
-    except Exception as e:
-        flash(f'خطأ في تصدير البيانات: {str(e)}', 'danger')
-        return redirect(url_for('data_management.index'))
+@data_management_bp.route('/data-management/jobs/import', methods=['POST'])
+@dev_or_owner_required
+def import_job():
+    """استيراد في الخلفية - الملف يحفظ مؤقتاً ويحذف بعد انتهاء المهمة"""
+    import_type = request.form.get('import_type')
+    file = request.files.get('file')
+    if import_type not in ('items', 'categories'):
+        return jsonify({'success': False, 'message': 'نوع الاستيراد غير صحيح'}), 400
+    if not file or not allowed_file(file.filename):
+        return jsonify({'success': False, 'message': 'نوع الملف غير مدعوم. الملفات المدعومة: CSV, Excel'}), 400
+    
+    input_path = os.path.join(results_dir(), f'upload_{uuid.uuid4().hex}_{secure_filename(file.filename)}')
+    file.save(input_path)
+    job_id = submit_job('import', {'type': import_type, 'filename': file.filename, 'input_path': input_path,
+                                   'user_id': session.get('user_id'), 'user_name': session.get('username')},
+                        session.get('user_id'))
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': url_for('api.get_job_status', job_id=job_id)}), 202
 
 @data_management_bp.route('/data-management/import', methods=['GET', 'POST'])
 @dev_or_owner_required
 def import_data():
     """استيراد البيانات"""
+    report = None
     if request.method == 'POST':
         import_type = request.form.get('import_type')
         file = request.files.get('file')
@@ -235,173 +183,28 @@ def import_data():
             return redirect(url_for('data_management.import_data'))
         
         try:
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
+            # الملف يقرأ مباشرة من الطلب دون حفظه على القرص
+            rows = iter_file_rows(file.stream, file.filename)
             
             if import_type == 'items':
-                result = import_items(filepath)
+                report = import_items(get_db(), rows, user_id=session.get('user_id'),
+                                      user_name=session.get('username'))
             elif import_type == 'categories':
-                result = import_categories(filepath)
+                report = import_categories(get_db(), rows)
             else:
                 flash('نوع الاستيراد غير صحيح', 'danger')
                 return redirect(url_for('data_management.import_data'))
             
-            if result['success']:
-                flash(f"تم استيراد {result['count']} سجل بنجاح", 'success')
-            else:
-                flash(f"خطأ في الاستيراد: {result['error']}", 'danger')
-            
-            # حذف الملف المؤقت
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            flash(f"تم استيراد {report['count']} سجل بنجاح", 'success')
+            if report['error_count']:
+                flash(f"تم تخطي {report['error_count']} صف بسبب أخطاء في البيانات", 'warning')
                 
+        except ImportFileError as e:
+            flash(f'خطأ في الاستيراد: {e}', 'danger')
         except Exception as e:
             flash(f'خطأ في معالجة الملف: {str(e)}', 'danger')
     
-    return render_template('data_management/import.html')
-
-def import_items(filepath):
-    """استيراد بيانات الأصناف"""
-    try:
-        if not PANDAS_AVAILABLE:
-            return {
-                'success': False,
-                'error': 'مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام استيراد Excel'
-            }
-            
-        # قراءة الملف
-        if filepath.endswith('.csv'):
-            df = pd.read_csv(filepath)
-        else:
-            df = pd.read_excel(filepath)
-        
-        # التحقق من الأعمدة المطلوبة
-        required_columns = ['name', 'price', 'quantity']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return {
-                'success': False,
-                'error': f'الأعمدة المطلوبة مفقودة: {", ".join(missing_columns)}'
-            }
-        
-        db = get_db()
-        cursor = db.cursor()
-        
-        imported_count = 0
-        
-        for _, row in df.iterrows():
-            try:
-                # البحث عن الفئة
-                category_id = None
-                if 'category_name' in df.columns and pd.notna(row['category_name']):
-                    category = cursor.execute(
-                        'SELECT id FROM categories WHERE name = ?', 
-                        (row['category_name'],)
-                    ).fetchone()
-                    if category:
-                        category_id = category['id']
-                
-                # إدراج الصنف
-                cursor.execute('''
-                    INSERT INTO items (name, sku, price, quantity, min_quantity, 
-                                     category_id, description, created_at, created_by)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    row['name'],
-                    row.get('sku', ''),
-                    float(row['price']),
-                    int(row['quantity']),
-                    int(row.get('min_quantity', 0)),
-                    category_id,
-                    row.get('description', ''),
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    session.get('user_id')
-                ))
-                
-                imported_count += 1
-                
-            except Exception as e:
-                print(f"خطأ في استيراد الصنف {row.get('name', 'غير معروف')}: {e}")
-                continue
-        
-        db.commit()
-        
-        return {
-            'success': True,
-            'count': imported_count
-        }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def import_categories(filepath):
-    """استيراد بيانات الفئات"""
-    try:
-        if not PANDAS_AVAILABLE:
-            return {
-                'success': False,
-                'error': 'مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام استيراد Excel'
-            }
-            
-        # قراءة الملف
-        if filepath.endswith('.csv'):
-            df = pd.read_csv(filepath)
-        else:
-            df = pd.read_excel(filepath)
-        
-        # التحقق من الأعمدة المطلوبة
-        if 'name' not in df.columns:
-            return {
-                'success': False,
-                'error': 'العمود "name" مطلوب'
-            }
-        
-        db = get_db()
-        cursor = db.cursor()
-        
-        imported_count = 0
-        
-        for _, row in df.iterrows():
-            try:
-                # التحقق من عدم وجود الفئة مسبقاً
-                existing = cursor.execute(
-                    'SELECT id FROM categories WHERE name = ?', 
-                    (row['name'],)
-                ).fetchone()
-                
-                if not existing:
-                    cursor.execute('''
-                        INSERT INTO categories (name, description, created_at)
-                        VALUES (?, ?, ?)
-                    ''', (
-                        row['name'],
-                        row.get('description', ''),
-                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    ))
-                    
-                    imported_count += 1
-                
-            except Exception as e:
-                print(f"خطأ في استيراد الفئة {row.get('name', 'غير معروف')}: {e}")
-                continue
-        
-        db.commit()
-        
-        return {
-            'success': True,
-            'count': imported_count
-        }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+    return render_template('data_management/import.html', report=report)
 
 @data_management_bp.route('/data-management/template/<template_type>')
 @dev_or_owner_required
@@ -422,27 +225,13 @@ def download_template(template_type):
 def download_items_template():
     """تحميل قالب الأصناف"""
     try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام قوالب Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        # إنشاء DataFrame فارغ بالأعمدة المطلوبة
-        df = pd.DataFrame(columns=[
-            'name', 'sku', 'price', 'quantity', 'min_quantity', 
-            'category_name', 'description'
-        ])
-        
+        columns = ['name', 'sku', 'cost_price', 'selling_price', 'quantity', 'reorder_level',
+                   'category_name', 'description', 'barcodes']
         # إضافة مثال
-        df.loc[0] = [
-            'مثال: إطار سيارة', 'SKU001', 500.0, 10, 2, 
-            'إطارات', 'إطار سيارة عالي الجودة'
-        ]
-        
-        filename = f'items_template_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        example = ['مثال: إطار سيارة', 'SKU001', 400.0, 500.0, 10, 2, 'إطارات', 'إطار سيارة عالي الجودة',
+                   '6281234567890,6281234567891']
+        filename = f'items_template_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        return export_response(filename, columns, iter([example]), _export_format(), sheet_title='items')
     except Exception as e:
         flash(f'خطأ في إنشاء القالب: {str(e)}', 'danger')
         return redirect(url_for('data_management.index'))
@@ -450,21 +239,11 @@ def download_items_template():
 def download_categories_template():
     """تحميل قالب الفئات"""
     try:
-        if not PANDAS_AVAILABLE:
-            flash('مكتبة pandas غير متوفرة. يرجى تثبيتها لاستخدام قوالب Excel', 'danger')
-            return redirect(url_for('data_management.index'))
-            
-        # إنشاء DataFrame فارغ بالأعمدة المطلوبة
-        df = pd.DataFrame(columns=['name', 'description'])
-        
+        columns = ['name', 'description']
         # إضافة مثال
-        df.loc[0] = ['مثال: إطارات', 'فئة الإطارات والجنوط']
-        
-        filename = f'categories_template_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        example = ['مثال: إطارات', 'فئة الإطارات والجنوط']
+        filename = f'categories_template_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        return export_response(filename, columns, iter([example]), _export_format(), sheet_title='categories')
     except Exception as e:
         flash(f'خطأ في إنشاء القالب: {str(e)}', 'danger')
         return redirect(url_for('data_management.index'))
@@ -3,65 +3,173 @@
 إدارة الفواتير
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from ..models.database import get_db, now_str
+import json
+
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, current_app,
+                   jsonify, Response, stream_with_context)
+from ..models.database import get_db, get_read_db, now_str
+from ..models.checkout import checkout, terminal_options, CheckoutError
+from ..models.sequences import format_invoice_number
 from ..models.settings_models import tax_settings, payment_method_settings, currency_settings
 from ..utils.auth import login_required, dev_or_owner_required
 from ..utils.payment_utils import get_payment_method_display_name
+from ..utils.date_ranges import day_range, date_span
 
 bp = Blueprint('invoices', __name__)
 
-@bp.route('/invoices')
-@login_required()
-def list():
-    """قائمة الفواتير - للكاشير والمدير"""
+# أعلى حرف يونيكود - لتحويل البحث ببداية النص إلى نطاق يستخدم الفهرس
+_PREFIX_END = '\U0010ffff'
+
+def _invoice_filters(search_date, search_customer, search_invoice):
+    """شروط البحث في الفواتير - نطاقات أو مطابقة تامة على أعمدة مفهرسة، عدا اسم العميل"""
+    conditions = []
+    params = []
     
-    db = get_db()
+    if search_date:
+        # تاريخ غير صالح يتجاهل (الصفحة تنبه المستخدم)
+        try:
+            date_bounds = day_range(search_date)
+        except ValueError:
+            date_bounds = None
+        if date_bounds:
+            conditions.append('i.created_at >= ? AND i.created_at < ?')
+            params.extend(date_bounds)
     
-    # Get search parameters
-    search_date = request.args.get('date', '')
-    search_customer = request.args.get('customer', '')
-    search_invoice = request.args.get('invoice', '')
+    if search_customer:
+        # جزء من اسم العميل (اسم العائلة، بأي حالة أحرف) أو بداية رقم الهاتف
+        conditions.append('(i.customer_name LIKE ?'
+                          ' OR (i.customer_phone >= ? AND i.customer_phone < ?))')
+        params.extend([f'%{search_customer}%', search_customer, search_customer + _PREFIX_END])
+    
+    if search_invoice:
+        # بداية رقم الفاتورة، أو الرقم التسلسلي وحده (مثلاً 125 -> POS-000125)
+        invoice_conditions = ['(i.invoice_number >= ? AND i.invoice_number < ?)']
+        params.extend([search_invoice, search_invoice + _PREFIX_END])
+        if search_invoice.isdigit():
+            prefixes = {current_app.config.get('POS_INVOICE_PREFIX', 'POS-'),
+                        current_app.config.get('INVOICE_PREFIX', 'INV-')}
+            for prefix in sorted(prefixes):
+                invoice_conditions.append('i.invoice_number = ?')
+                params.append(format_invoice_number(prefix, int(search_invoice)))
+        conditions.append('(' + ' OR '.join(invoice_conditions) + ')')
+    
+    where = ' AND '.join(conditions) if conditions else '1=1'
+    return where, params
+
+def _encode_cursor(invoice):
+    return f"{invoice['created_at']}|{invoice['id']}"
+
+def _decode_cursor(cursor):
+    """تحويل مؤشر الصفحة (created_at|id) إلى قيمه - None إذا كان غير صالح"""
+    created_at, _, invoice_id = (cursor or '').rpartition('|')
+    if not created_at or not invoice_id.isdigit():
+        return None
+    return created_at, int(invoice_id)
+
+def _invoice_page(db, search_date, search_customer, search_invoice, cursor=None, limit=None):
+    """صفحة من الفواتير مرتبة من الأحدث (ترقيم بالمؤشر على created_at و id)
+    
+    يرجع (الفواتير، مؤشر الصفحة التالية أو None).
+    """
+    per_page = current_app.config.get('REPORTS_PER_PAGE', 50)
+    limit = max(1, min(limit or per_page, per_page * 4))
+    where, params = _invoice_filters(search_date, search_customer, search_invoice)
     
-    # Build query
-    query = '''
+    position = _decode_cursor(cursor)
+    if position:
+        where += ' AND (i.created_at, i.id) < (?, ?)'
+        params.extend(position)
+    
+    rows = db.execute(f'''
         SELECT i.*, COALESCE(i.created_by_name, u.username, 'مستخدم محذوف') as created_by_name
         FROM invoices i
         LEFT JOIN users u ON u.id = i.created_by
-        WHERE 1=1
-    '''
-    params = []
+        WHERE {where}
+        ORDER BY i.created_at DESC, i.id DESC
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
     
-    if search_date:
-        query += ' AND DATE(i.created_at) = ?'
-        params.append(search_date)
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
     
-    if search_customer:
-        query += ' AND (i.customer_name LIKE ? OR i.customer_phone LIKE ?)'
-        params.append(f'%{search_customer}%')
-        params.append(f'%{search_customer}%')
+    # إضافة أسماء طرق الدفع للفواتير
+    invoices = []
+    for row in rows[:limit]:
+        invoice = dict(row)
+        invoice['payment_method_name'] = get_payment_method_display_name(invoice['payment_method'])
+        invoices.append(invoice)
+    return invoices, next_cursor
+
+def _carried_summary(args):
+    """إجماليات البحث المحمولة في رابط الصفحة التالية (None إن لم توجد)"""
+    try:
+        return {'count': int(args['count']), 'total': float(args['total']),
+                'cash_count': int(args['cash_count'])}
+    except (KeyError, ValueError):
+        return None
+
+def _invoice_summary(db, search_date, search_customer, search_invoice):
+    """إجماليات كل الفواتير المطابقة للبحث (وليس الصفحة الحالية فقط)"""
+    where, params = _invoice_filters(search_date, search_customer, search_invoice)
+    return db.execute(f'''
+        SELECT COUNT(*) as count,
+               COALESCE(SUM(i.final_amount), 0) as total,
+               COALESCE(SUM(CASE WHEN i.payment_method = 'cash' THEN 1 ELSE 0 END), 0) as cash_count
+        FROM invoices i
+        WHERE {where}
+    ''', params).fetchone()
+
+@bp.route('/invoices')
+@login_required()
+def list():
+    """قائمة الفواتير - للكاشير والمدير"""
     
-    if search_invoice:
-        query += ' AND i.invoice_number LIKE ?'
-        params.append(f'%{search_invoice}%')
+    db = get_read_db()
     
-    query += ' ORDER BY i.created_at DESC'
+    # Get search parameters
+    search_date = request.args.get('date', '')
+    search_customer = request.args.get('customer', '').strip()
+    search_invoice = request.args.get('invoice', '').strip()
+    cursor = request.args.get('cursor', '')
     
-    invoices = db.execute(query, params).fetchall()
+    if search_date:
+        try:
+            day_range(search_date)
+        except ValueError:
+            flash('صيغة التاريخ غير صحيحة', 'danger')
+            search_date = ''
     
-    # إضافة أسماء طرق الدفع للفواتير
-    invoices_with_payment_names = []
-    for invoice in invoices:
-        invoice_dict = dict(invoice)
-        invoice_dict['payment_method_name'] = get_payment_method_display_name(invoice['payment_method'])
-        invoices_with_payment_names.append(invoice_dict)
+    invoices, next_cursor = _invoice_page(db, search_date, search_customer, search_invoice, cursor)
+    # الإجماليات تحسب في الصفحة الأولى وتنقل مع رابط الصفحة التالية
+    summary = _carried_summary(request.args) if cursor else None
+    if summary is None:
+        summary = _invoice_summary(db, search_date, search_customer, search_invoice)
     
     return render_template('invoices/list.html', 
-                         invoices=invoices_with_payment_names, 
+                         invoices=invoices, 
+                         summary=summary,
+                         cursor=cursor,
+                         next_cursor=next_cursor,
                          search_date=search_date,
                          search_customer=search_customer,
                          search_invoice=search_invoice)
 
+@bp.route('/invoices/data')
+@login_required()
+def list_data():
+    """قائمة الفواتير بصيغة JSON للتمرير اللانهائي (?cursor=<next_cursor>)"""
+    try:
+        invoices, next_cursor = _invoice_page(
+            get_read_db(),
+            request.args.get('date', ''),
+            request.args.get('customer', '').strip(),
+            request.args.get('invoice', '').strip(),
+            request.args.get('cursor', ''),
+            request.args.get('limit', type=int),
+        )
+        return jsonify({'invoices': invoices, 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @bp.route('/invoices/new', methods=['GET', 'POST'])
 @login_required()
 def new():
@@ -93,38 +201,26 @@ def new():
         
         db = get_db()
         try:
-            # Calculate totals
-            total_amount = sum(item['total_price'] for item in items)
             discount_amount = float(request.form.get('discount_amount', 0))
             tax_amount = float(request.form.get('tax_amount', 0))
-            final_amount = total_amount - discount_amount + tax_amount
-            
-            # Generate invoice number
-            invoice_number = f"INV-{now_str().replace(':', '').replace('-', '').replace(' ', '')}"
             
-            # Create invoice record
-            invoice_id = db.execute('''
-                INSERT INTO invoices (invoice_number, customer_name, customer_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, created_by, created_by_name)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (invoice_number, customer_name, customer_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, session['user_id'], session['username'])).lastrowid
-            
-            # Add invoice items and update inventory
-            for item in items:
-                db.execute('''
-                    INSERT INTO sales (invoice_id, item_id, quantity, unit_price, total_price, final_price)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (invoice_id, item['item_id'], item['quantity'], item['unit_price'], item['total_price'], item['total_price']))
-                
-                # Update item quantity
-                db.execute('''
-                    UPDATE items 
-                    SET quantity = quantity - ?
-                    WHERE id = ?
-                ''', (item['quantity'], item['item_id']))
+            result = checkout(
+                db, items,
+                prefix=current_app.config.get('INVOICE_PREFIX', 'INV-'),
+                payment_method=payment_method,
+                customer_name=customer_name,
+                customer_phone=customer_phone,
+                discount_amount=discount_amount,
+                tax_amount=tax_amount,
+                user_id=session['user_id'],
+                user_name=session['username'],
+                **terminal_options()
+            )
             
-            db.commit()
             flash('تم إنشاء الفاتورة بنجاح', 'success')
-            return redirect(url_for('invoices.view', invoice_id=invoice_id))
+            return redirect(url_for('invoices.view', invoice_id=result['invoice_id']))
+        except CheckoutError as e:
+            flash(f'خطأ في إنشاء الفاتورة: {e.message}', 'danger')
         except Exception as e:
             flash(f'خطأ في إنشاء الفاتورة: {str(e)}', 'danger')
     
@@ -283,65 +379,120 @@ def get_invoice_data(invoice_id):
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب البيانات: {str(e)}'}), 500
 
+# عدد الصفوف المقروءة من قاعدة البيانات في كل دفعة أثناء التصدير
+EXPORT_FETCH_SIZE = 500
+
+def _export_filters(start_date, end_date):
+    """شروط نطاق التاريخ للتصدير"""
+    where = ''
+    params = []
+    range_start, range_end = date_span(start_date, end_date)
+    if range_start:
+        where += ' AND i.created_at >= ?'
+        params.append(range_start)
+    if range_end:
+        where += ' AND i.created_at < ?'
+        params.append(range_end)
+    return where, params
+
+def _export_invoices_cursor(db, where, params):
+    """تنفيذ استعلام التصدير (قبل بدء البث، لتظهر أخطاؤه قبل إرسال الترويسات)"""
+    invoice_columns = [row['name'] for row in db.execute('PRAGMA table_info(invoices)')]
+    sale_columns = [row['name'] for row in db.execute('PRAGMA table_info(sales)')]
+    select = ', '.join(
+        [f'i."{column}" AS "i_{column}"' for column in invoice_columns if column != 'created_by_name'] +
+        [f's."{column}" AS "s_{column}"' for column in sale_columns]
+    )
+    return db.execute(f'''
+        SELECT {select},
+               COALESCE(i.created_by_name, u.username) AS i_created_by_name,
+               it.name AS s_item_name
+        FROM invoices i
+        LEFT JOIN users u ON u.id = i.created_by
+        LEFT JOIN sales s ON s.invoice_id = i.id
+        LEFT JOIN items it ON it.id = s.item_id
+        WHERE 1=1{where}
+        ORDER BY i.created_at DESC, i.id DESC, s.id
+    ''', params)
+
+def _iter_export_invoices(cursor):
+    """الفواتير مع بنودها من استعلام التصدير، فاتورة تلو الأخرى
+    
+    الصفوف تقرأ على دفعات ويتم تجميع بنود كل فاتورة من الصفوف المتتالية،
+    فلا تحمل النتيجة كاملة في الذاكرة.
+    """
+    invoice = None
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            if invoice is None or invoice['id'] != row['i_id']:
+                if invoice is not None:
+                    yield invoice
+                invoice = {key[2:]: row[key] for key in row.keys() if key.startswith('i_')}
+                invoice['items'] = []
+            if row['s_id'] is not None:
+                invoice['items'].append({key[2:]: row[key] for key in row.keys() if key.startswith('s_')})
+    if invoice is not None:
+        yield invoice
+
 @bp.route('/api/invoices/export')
 @dev_or_owner_required
 def export_invoices():
-    """تصدير جميع الفواتير كـ JSON - لمستخدم dev فقط"""
-    from flask import jsonify
+    """تصدير جميع الفواتير - لمستخدم dev فقط
     
+    الاستجابة تبث أثناء القراءة: JSON (افتراضي) أو NDJSON (?format=ndjson)
+    بفاتورة في كل سطر. ?summary=1 يرجع الإجماليات فقط.
+    """
     try:
-        db = get_db()
+        db = get_read_db()
         
         # Get date range from query parameters
         start_date = request.args.get('start_date', '')
         end_date = request.args.get('end_date', '')
+        export_format = request.args.get('format', 'json')
+        filters = {'start_date': start_date, 'end_date': end_date}
         
-        query = '''
-            SELECT i.*, u.username as created_by_name
-            FROM invoices i
-            LEFT JOIN users u ON u.id = i.created_by
-            WHERE 1=1
-        '''
-        params = []
-        
-        if start_date:
-            query += ' AND DATE(i.created_at) >= ?'
-            params.append(start_date)
+        try:
+            where, params = _export_filters(start_date, end_date)
+        except ValueError:
+            return jsonify({'error': 'صيغة التاريخ غير صحيحة (YYYY-MM-DD)'}), 400
         
-        if end_date:
-            query += ' AND DATE(i.created_at) <= ?'
-            params.append(end_date)
+        if request.args.get('summary'):
+            totals = db.execute(f'''
+                SELECT COUNT(*) as total_count,
+                       COALESCE(SUM(i.final_amount), 0) as total_amount,
+                       COALESCE(SUM((SELECT COUNT(*) FROM sales s WHERE s.invoice_id = i.id)), 0) as total_items
+                FROM invoices i
+                WHERE 1=1{where}
+            ''', params).fetchone()
+            return jsonify({**dict(totals), 'export_date': now_str(), 'filters': filters})
         
-        query += ' ORDER BY i.created_at DESC'
+        invoices = _iter_export_invoices(_export_invoices_cursor(db, where, params))
         
-        invoices = db.execute(query, params).fetchall()
+        def generate_ndjson():
+            for invoice in invoices:
+                yield json.dumps(invoice, ensure_ascii=False) + '\n'
         
-        # Convert to list of dictionaries
-        invoices_data = []
-        for invoice in invoices:
-            invoice_dict = dict(invoice)
-            
-            # Get items for each invoice
-            items = db.execute('''
-                SELECT s.*, i.name as item_name
-                FROM sales s
-                JOIN items i ON i.id = s.item_id
-                WHERE s.invoice_id = ?
-                ORDER BY s.id
-            ''', (invoice['id'],)).fetchall()
-            
-            invoice_dict['items'] = [dict(item) for item in items]
-            invoices_data.append(invoice_dict)
+        def generate_json():
+            header = json.dumps({'export_date': now_str(), 'filters': filters}, ensure_ascii=False)
+            yield header[:-1] + ', "invoices": ['
+            total_count = 0
+            chunk = []
+            for invoice in invoices:
+                chunk.append(json.dumps(invoice, ensure_ascii=False))
+                total_count += 1
+                if len(chunk) >= EXPORT_FETCH_SIZE:
+                    yield (',' if total_count > len(chunk) else '') + ','.join(chunk)
+                    chunk = []
+            if chunk:
+                yield (',' if total_count > len(chunk) else '') + ','.join(chunk)
+            yield f'], "total_count": {total_count}}}'
         
-        return jsonify({
-            'invoices': invoices_data,
-            'total_count': len(invoices_data),
-            'export_date': now_str(),
-            'filters': {
-                'start_date': start_date,
-                'end_date': end_date
-            }
-        })
+        if export_format == 'ndjson':
+            return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+        return Response(stream_with_context(generate_json()), mimetype='application/json')
     except Exception as e:
         return jsonify({'error': f'خطأ في تصدير البيانات: {str(e)}'}), 500
 
@@ -5,6 +5,9 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from ..models.database import get_db
+from ..models.search import search_filter
+from ..models.barcodes import parse_barcodes, get_item_barcodes, set_item_barcodes
+from ..models.stock_ledger import ADJUSTMENT, OPENING, record_movements
 from ..utils.auth import login_required
 
 bp = Blueprint('items', __name__)
@@ -29,8 +32,9 @@ def list():
     params = []
     
     if search:
-        query += ' AND (i.name LIKE ? OR i.sku LIKE ?)'
-        params.extend([f'%{search}%', f'%{search}%'])
+        search_sql, search_params = search_filter(search)
+        query += f' AND {search_sql}'
+        params.extend(search_params)
     
     if category_id:
         query += ' AND i.category_id = ?'
@@ -60,6 +64,7 @@ def new():
         reorder_level = int(request.form.get('reorder_level', 5))
         cost_price = float(request.form.get('cost_price', 0))
         selling_price = float(request.form.get('selling_price', 0))
+        barcodes = parse_barcodes(request.form.get('barcodes', ''))
         
         if not name:
             flash('اسم الصنف مطلوب', 'danger')
@@ -67,14 +72,18 @@ def new():
         
         db = get_db()
         try:
-            db.execute('''
+            item_id = db.execute('''
                 INSERT INTO items (name, category_id, sku, description, quantity, reorder_level, cost_price, selling_price)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, category_id or None, sku or None, description, quantity, reorder_level, cost_price, selling_price))
+            ''', (name, category_id or None, sku or None, description, quantity, reorder_level, cost_price, selling_price)).lastrowid
+            set_item_barcodes(db, item_id, barcodes)
+            record_movements(db, {item_id: quantity}, OPENING,
+                             user_id=session.get('user_id'), user_name=session.get('username'))
             db.commit()
             flash('تم إضافة الصنف بنجاح', 'success')
             return redirect(url_for('items.list'))
         except Exception as e:
+            db.rollback()
             flash(f'خطأ في إضافة الصنف: {str(e)}', 'danger')
     
     db = get_db()
@@ -104,25 +113,34 @@ def edit(item_id):
         reorder_level = int(request.form.get('reorder_level', 5))
         cost_price = float(request.form.get('cost_price', 0))
         selling_price = float(request.form.get('selling_price', 0))
+        barcodes = parse_barcodes(request.form.get('barcodes', ''))
         
         if not name:
             flash('اسم الصنف مطلوب', 'danger')
             return redirect(url_for('items.edit', item_id=item_id))
         
         try:
+            # الكمية الحالية داخل المعاملة - قد تكون تغيرت ببيع منذ فتح النموذج
+            db.execute('BEGIN IMMEDIATE')
+            current_quantity = db.execute('SELECT quantity FROM items WHERE id = ?', (item_id,)).fetchone()['quantity']
             db.execute('''
                 UPDATE items 
                 SET name=?, category_id=?, sku=?, description=?, quantity=?, reorder_level=?, cost_price=?, selling_price=?
                 WHERE id=?
             ''', (name, category_id or None, sku or None, description, quantity, reorder_level, cost_price, selling_price, item_id))
+            set_item_barcodes(db, item_id, barcodes)
+            record_movements(db, {item_id: quantity - current_quantity}, ADJUSTMENT, note='تعديل الصنف',
+                             user_id=session.get('user_id'), user_name=session.get('username'))
             db.commit()
             flash('تم تحديث الصنف بنجاح', 'success')
             return redirect(url_for('items.list'))
         except Exception as e:
+            db.rollback()
             flash(f'خطأ في تحديث الصنف: {str(e)}', 'danger')
     
     categories = db.execute('SELECT * FROM categories ORDER BY name').fetchall()
-    return render_template('items/edit.html', item=item, categories=categories)
+    return render_template('items/edit.html', item=item, categories=categories,
+                         barcodes=get_item_barcodes(db, item_id))
 
 @bp.route('/items/<int:item_id>/delete', methods=['POST'])
 @login_required('manager')
@@ -135,11 +153,21 @@ def delete(item_id):
         flash('الصنف غير موجود', 'danger')
         return redirect(url_for('items.list'))
     
+    # Check if item has sales history (would be cascaded away with foreign keys on)
+    sales_count = db.execute('SELECT COUNT(*) as c FROM sales WHERE item_id = ?', (item_id,)).fetchone()['c']
+    if sales_count > 0:
+        flash(f'لا يمكن حذف الصنف لأنه مرتبط بـ {sales_count} عملية بيع', 'danger')
+        return redirect(url_for('items.list'))
+    
     try:
+        # حركة تصفير الرصيد قبل الحذف حتى يبقى مجموع السجل مساوياً للمخزون
+        record_movements(db, {item_id: -item['quantity']}, ADJUSTMENT, note=f'حذف الصنف {item["name"]}',
+                         user_id=session.get('user_id'), user_name=session.get('username'))
         db.execute('DELETE FROM items WHERE id = ?', (item_id,))
         db.commit()
         flash('تم حذف الصنف بنجاح', 'success')
     except Exception as e:
+        db.rollback()
         flash(f'خطأ في حذف الصنف: {str(e)}', 'danger')
     
     return redirect(url_for('items.list'))
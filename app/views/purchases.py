@@ -4,7 +4,11 @@
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from ..models.costing import receive_stock
 from ..models.database import get_db, now_str
+from ..models.events import stock_changed
+from ..models.rollups import record_purchases
+from ..models.stock_ledger import PURCHASE, record_movements
 from ..utils.auth import login_required
 from ..utils.payment_utils import get_payment_method_display_name
 
@@ -69,29 +73,37 @@ def new():
             final_amount = total_amount - discount_amount + tax_amount
             
             # Create purchase record
+            created_at = now_str()
             purchase_id = db.execute('''
-                INSERT INTO purchases (supplier_name, supplier_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, created_by)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (supplier_name, supplier_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, session['user_id'])).lastrowid
+                INSERT INTO purchases (supplier_name, supplier_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, created_at, created_by)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (supplier_name, supplier_phone, total_amount, discount_amount, tax_amount, final_amount, payment_method, created_at, session['user_id'])).lastrowid
             
             # Add purchase items and update inventory
             for item in items:
                 db.execute('''
-                    INSERT INTO purchase_items (purchase_id, item_id, quantity, unit_cost, total_cost)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (purchase_id, item['item_id'], item['quantity'], item['unit_cost'], item['total_cost']))
+                    INSERT INTO purchase_items (purchase_id, item_id, quantity, unit_cost, total_cost, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (purchase_id, item['item_id'], item['quantity'], item['unit_cost'], item['total_cost'], created_at))
                 
-                # Update item quantity
-                db.execute('''
-                    UPDATE items 
-                    SET quantity = quantity + ?, cost_price = ?
-                    WHERE id = ?
-                ''', (item['quantity'], item['unit_cost'], item['item_id']))
+                # Update item quantity and weighted-average cost
+                receive_stock(db, item['item_id'], item['quantity'], item['unit_cost'])
+            
+            # Update daily rollups in the same transaction
+            record_purchases(db, created_at, items)
+            
+            deltas = {}
+            for item in items:
+                deltas[int(item['item_id'])] = deltas.get(int(item['item_id']), 0) + item['quantity']
+            record_movements(db, deltas, PURCHASE, reference_id=purchase_id, user_id=session['user_id'],
+                             user_name=session.get('username'), created_at=created_at)
             
             db.commit()
+            stock_changed(db)
             flash('تم إنشاء أمر الشراء بنجاح', 'success')
             return redirect(url_for('purchases.view', purchase_id=purchase_id))
         except Exception as e:
+            db.rollback()
             flash(f'خطأ في إنشاء أمر الشراء: {str(e)}', 'danger')
     
     db = get_db()
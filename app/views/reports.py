@@ -3,13 +3,20 @@
 التقارير والإحصائيات
 """
 
-from flask import Blueprint, render_template, request
-from ..models.database import get_db
-from ..utils.auth import login_required
+from flask import Blueprint, render_template, request, jsonify, session, url_for, flash
+from ..models.database import get_db, get_read_db
+from ..models.jobs import job_handler, submit_job
+from ..models.profit import GROUPING_LABELS, profit_report, profit_summary
+from ..models.rollups import rebuild_rollups
+from ..utils.auth import login_required, admin_required, dev_or_owner_required
 from datetime import datetime, timedelta
+from ..utils.date_ranges import day_range, month_range, year_range, date_span
 
 bp = Blueprint('reports', __name__)
 
+# أقصى عدد أصناف في تقرير الأرباح حسب الصنف (الأعلى ربحاً)
+PROFIT_ITEMS_LIMIT = 500
+
 @bp.route('/reports')
 @login_required()
 def index():
@@ -20,39 +27,41 @@ def index():
 @login_required()
 def daily():
     """التقرير اليومي"""
-    db = get_db()
+    db = get_read_db()
     today = datetime.now().strftime('%Y-%m-%d')
+    start, end = day_range(today)
     
     # Daily sales summary
     summary = db.execute('''
         SELECT 
             COUNT(DISTINCT s.id) as total_sales,
             SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
+            SUM(s.final_price) as total_amount,
+            SUM(s.final_price - s.quantity * IFNULL(s.unit_cost, 0)) as gross_profit
         FROM sales s
-        WHERE DATE(s.created_at) = ?
-    ''', (today,)).fetchone()
+        WHERE s.created_at >= ? AND s.created_at < ?
+    ''', (start, end)).fetchone()
     
     # Top selling items today
     top_items = db.execute('''
         SELECT i.name, SUM(s.quantity) as total_qty, SUM(s.final_price) as total_amount
         FROM sales s
         JOIN items i ON i.id = s.item_id
-        WHERE DATE(s.created_at) = ?
+        WHERE s.created_at >= ? AND s.created_at < ?
         GROUP BY i.id, i.name
         ORDER BY total_qty DESC
         LIMIT 10
-    ''', (today,)).fetchall()
+    ''', (start, end)).fetchall()
     
     # Recent sales
     recent_sales = db.execute('''
         SELECT s.*, i.name as item_name
         FROM sales s
         JOIN items i ON i.id = s.item_id
-        WHERE DATE(s.created_at) = ?
+        WHERE s.created_at >= ? AND s.created_at < ?
         ORDER BY s.created_at DESC
         LIMIT 20
-    ''', (today,)).fetchall()
+    ''', (start, end)).fetchall()
     
     return render_template('reports/daily.html', 
                          summary=summary, 
@@ -63,43 +72,47 @@ def daily():
 @bp.route('/reports/monthly')
 @login_required()
 def monthly():
-    """التقرير الشهري"""
-    db = get_db()
+    """التقرير الشهري - من جداول التجميع اليومي"""
+    db = get_read_db()
     current_month = datetime.now().strftime('%Y-%m')
+    start, end = month_range(current_month)
     
     # Monthly summary
     summary = db.execute('''
         SELECT 
-            COUNT(DISTINCT s.id) as total_sales,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
-        FROM sales s
-        WHERE strftime('%Y-%m', s.created_at) = ?
-    ''', (current_month,)).fetchone()
+            SUM(d.line_count) as total_sales,
+            SUM(d.quantity) as total_quantity,
+            SUM(d.revenue) as total_amount,
+            SUM(d.revenue - d.cost) as gross_profit
+        FROM daily_item_sales d
+        WHERE d.day >= ? AND d.day < ?
+    ''', (start, end)).fetchone()
     
     # Top selling items this month
     top_items = db.execute('''
-        SELECT i.name, SUM(s.quantity) as total_qty, SUM(s.final_price) as total_amount
-        FROM sales s
-        JOIN items i ON i.id = s.item_id
-        WHERE strftime('%Y-%m', s.created_at) = ?
+        SELECT i.name, SUM(d.quantity) as total_qty, SUM(d.revenue) as total_amount
+        FROM daily_item_sales d
+        JOIN items i ON i.id = d.item_id
+        WHERE d.day >= ? AND d.day < ?
         GROUP BY i.id, i.name
+        HAVING total_qty > 0
         ORDER BY total_qty DESC
         LIMIT 10
-    ''', (current_month,)).fetchall()
+    ''', (start, end)).fetchall()
     
     # Daily breakdown
     daily_breakdown = db.execute('''
         SELECT 
-            DATE(s.created_at) as sale_date,
-            COUNT(DISTINCT s.id) as sales_count,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
-        FROM sales s
-        WHERE strftime('%Y-%m', s.created_at) = ?
-        GROUP BY DATE(s.created_at)
+            d.day as sale_date,
+            SUM(d.line_count) as sales_count,
+            SUM(d.quantity) as total_quantity,
+            SUM(d.revenue) as total_amount
+        FROM daily_item_sales d
+        WHERE d.day >= ? AND d.day < ?
+        GROUP BY d.day
+        HAVING sales_count > 0
         ORDER BY sale_date DESC
-    ''', (current_month,)).fetchall()
+    ''', (start, end)).fetchall()
     
     return render_template('reports/monthly.html', 
                          summary=summary, 
@@ -110,50 +123,106 @@ def monthly():
 @bp.route('/reports/yearly')
 @login_required()
 def yearly():
-    """التقرير السنوي"""
-    db = get_db()
+    """التقرير السنوي - من جداول التجميع اليومي"""
+    db = get_read_db()
     current_year = datetime.now().strftime('%Y')
+    start, end = year_range(current_year)
     
     # Yearly summary
     summary = db.execute('''
         SELECT 
-            COUNT(DISTINCT s.id) as total_sales,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
-        FROM sales s
-        WHERE strftime('%Y', s.created_at) = ?
-    ''', (current_year,)).fetchone()
+            SUM(d.line_count) as total_sales,
+            SUM(d.quantity) as total_quantity,
+            SUM(d.revenue) as total_amount,
+            SUM(d.revenue - d.cost) as gross_profit
+        FROM daily_category_sales d
+        WHERE d.day >= ? AND d.day < ?
+    ''', (start, end)).fetchone()
     
     # Monthly breakdown
     monthly_breakdown = db.execute('''
         SELECT 
-            strftime('%Y-%m', s.created_at) as sale_month,
-            COUNT(DISTINCT s.id) as sales_count,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
-        FROM sales s
-        WHERE strftime('%Y', s.created_at) = ?
-        GROUP BY strftime('%Y-%m', s.created_at)
+            substr(d.day, 1, 7) as sale_month,
+            SUM(d.line_count) as sales_count,
+            SUM(d.quantity) as total_quantity,
+            SUM(d.revenue) as total_amount
+        FROM daily_category_sales d
+        WHERE d.day >= ? AND d.day < ?
+        GROUP BY substr(d.day, 1, 7)
+        HAVING sales_count > 0
         ORDER BY sale_month DESC
-    ''', (current_year,)).fetchall()
+    ''', (start, end)).fetchall()
     
     # Category performance
     category_performance = db.execute('''
         SELECT 
             c.name as category_name,
-            COUNT(DISTINCT s.id) as sales_count,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.final_price) as total_amount
-        FROM sales s
-        JOIN items i ON i.id = s.item_id
-        LEFT JOIN categories c ON c.id = i.category_id
-        WHERE strftime('%Y', s.created_at) = ?
-        GROUP BY c.id, c.name
+            SUM(d.line_count) as sales_count,
+            SUM(d.quantity) as total_quantity,
+            SUM(d.revenue) as total_amount
+        FROM daily_category_sales d
+        LEFT JOIN categories c ON c.id = d.category_id
+        WHERE d.day >= ? AND d.day < ?
+        GROUP BY d.category_id, c.name
+        HAVING sales_count > 0
         ORDER BY total_amount DESC
-    ''', (current_year,)).fetchall()
+    ''', (start, end)).fetchall()
     
     return render_template('reports/yearly.html', 
                          summary=summary, 
                          monthly_breakdown=monthly_breakdown,
                          category_performance=category_performance,
                          year=current_year)
+
+@bp.route('/reports/profit')
+@admin_required
+def profit():
+    """تقرير الأرباح لأي نطاق تاريخ - من جداول التجميع اليومي"""
+    db = get_read_db()
+    today = datetime.now().strftime('%Y-%m-%d')
+    start_date = request.args.get('start_date') or today[:8] + '01'
+    end_date = request.args.get('end_date') or today
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in GROUPING_LABELS:
+        group_by = 'day'
+    
+    try:
+        start, end = date_span(start_date, end_date)
+    except ValueError:
+        flash('صيغة التاريخ غير صحيحة', 'danger')
+        start_date, end_date = today[:8] + '01', today
+        start, end = date_span(start_date, end_date)
+    
+    summary = profit_summary(db, start, end)
+    rows = profit_report(db, group_by, start, end,
+                         limit=PROFIT_ITEMS_LIMIT if group_by == 'item' else None)
+    
+    return render_template('reports/profit.html',
+                         summary=summary,
+                         rows=rows,
+                         group_by=group_by,
+                         grouping_labels=GROUPING_LABELS,
+                         start_date=start_date,
+                         end_date=end_date,
+                         items_limit=PROFIT_ITEMS_LIMIT)
+
+@job_handler('rebuild_rollups')
+def _rebuild_rollups_job(job, params):
+    """إعادة بناء جداول التجميع اليومي في الخلفية"""
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        rebuild_rollups(db, params.get('start'), params.get('end'))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {'start': params.get('start'), 'end': params.get('end')}
+
+@bp.route('/reports/rebuild', methods=['POST'])
+@dev_or_owner_required
+def rebuild():
+    """إعادة بناء بيانات التقارير في الخلفية (?start=YYYY-MM-DD&end=YYYY-MM-DD اختياريان)"""
+    params = {'start': request.values.get('start') or None, 'end': request.values.get('end') or None}
+    job_id = submit_job('rebuild_rollups', params, session.get('user_id'))
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': url_for('api.get_job_status', job_id=job_id)}), 202
@@ -3,8 +3,10 @@
 إدارة المبيعات
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from ..models.database import get_db, now_str
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from ..models.database import get_db
+from ..models.checkout import checkout, terminal_options, CheckoutError
+from ..models.catalog import get_catalog_version
 from ..utils.auth import login_required
 from ..models.settings_models import pos_settings, tax_settings, payment_method_settings, currency_settings
 
@@ -59,70 +61,30 @@ def new():
                 final_tax_amount = calculated_tax
             
             db = get_db()
-            cursor = db.cursor()
-            user_id = session.get('user_id')
+            result = checkout(
+                db, items,
+                prefix=current_app.config.get('POS_INVOICE_PREFIX', 'POS-'),
+                payment_method=payment_method,
+                total_amount=total_amount,
+                discount_amount=discount_amount,
+                tax_amount=final_tax_amount,
+                final_amount=taxable_amount + final_tax_amount,
+                user_id=session.get('user_id'),
+                user_name=session.get('username'),
+                fill_selling_price=True,
+                **terminal_options()
+            )
             
-            # Create invoice
-            invoice_number = f"POS-{db.execute('SELECT COUNT(*) FROM invoices').fetchone()[0] + 1:06d}"
-            cursor.execute('''
-                INSERT INTO invoices (invoice_number, customer_name, customer_phone, total_amount, 
-                                    discount_amount, tax_amount, final_amount, payment_method, created_at, created_by)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (invoice_number, None, None, total_amount, discount_amount, final_tax_amount, 
-                  taxable_amount + final_tax_amount, payment_method, now_str(), user_id))
-            
-            invoice_id = cursor.lastrowid
-            
-            # Process each item
-            for item in items:
-                item_id = item['item_id']
-                quantity = item['quantity']
-                unit_price = item['unit_price']
-                total_price = item['total_price']
-                
-                # Check stock availability
-                current_item = cursor.execute('SELECT * FROM items WHERE id = ?', (item_id,)).fetchone()
-                if not current_item:
-                    flash(f'الصنف غير موجود: {item_id}', 'warning')
-                    continue
-                
-                if current_item['quantity'] < quantity:
-                    flash(f'الكمية المتاحة من {current_item["name"]}: {current_item["quantity"]} فقط', 'warning')
-                    continue
-                
-                # Update item quantity
-                new_quantity = current_item['quantity'] - quantity
-                cursor.execute('UPDATE items SET quantity = ? WHERE id = ?', (new_quantity, item_id))
-                
-                # Update selling price if not set
-                if not current_item['selling_price'] or current_item['selling_price'] == 0:
-                    cursor.execute('UPDATE items SET selling_price = ? WHERE id = ?', (unit_price, item_id))
-                
-                # Record sale
-                cursor.execute('''
-                    INSERT INTO sales (invoice_id, item_id, quantity, unit_price, total_price, 
-                                     discount_amount, tax_amount, final_price, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (invoice_id, item_id, quantity, unit_price, total_price, 
-                      0, 0, total_price, now_str()))
-            
-            db.commit()
-            
-            # Debug: Check if data was saved correctly
-            print(f"Debug: Created invoice with ID: {invoice_id}")
-            print(f"Debug: Invoice number: {invoice_number}")
-            
-            # Check sales records
-            sales_check = cursor.execute('SELECT COUNT(*) FROM sales WHERE invoice_id = ?', (invoice_id,)).fetchone()
-            print(f"Debug: Sales records count: {sales_check[0]}")
-            
-            flash(f'تم إتمام البيع بنجاح! رقم الفاتورة: {invoice_number}', 'success')
-            return redirect(url_for('invoices.view', invoice_id=invoice_id))
+            flash(f'تم إتمام البيع بنجاح! رقم الفاتورة: {result["invoice_number"]}', 'success')
+            return redirect(url_for('invoices.view', invoice_id=result['invoice_id']))
+        except CheckoutError as e:
+            flash(f'خطأ في البيع: {e.message}', 'danger')
         except Exception as e:
             print(f"Debug: Error in sales: {str(e)}")
             flash(f'خطأ في البيع: {str(e)}', 'danger')
     
     db = get_db()
+    catalog_version = get_catalog_version(db)
     items = db.execute('''
         SELECT i.*, c.name as category_name,
                CASE 
@@ -146,6 +108,7 @@ def new():
     return render_template('sales/new.html', 
                          items=items, 
                          categories=categories,
+                         catalog_version=catalog_version,
                          pos_settings=pos_config,
                          tax_config=tax_config,
                          payment_methods=payment_methods,
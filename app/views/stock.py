@@ -9,38 +9,36 @@
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from ..models.database import get_db
-from ..utils.auth import login_required
+from ..models.database import get_db, get_read_db
+from ..models.events import stock_changed
+from ..models.jobs import job_handler
+from ..models.stock_alerts import get_low_stock_items, prune_stock_alerts, recent_stock_alerts
+from ..models.stock_ledger import (ADJUSTMENT, REASON_LABELS, record_movements, snapshot_due, stock_at,
+                                   take_stock_snapshot)
+from ..models.stocktake import (STATUS_LABELS, COUNT_MODES, StocktakeError, open_stocktake, get_stocktake,
+                                list_stocktakes, stocktake_summary, stocktake_lines, record_counts,
+                                new_count_report, counts_from_rows, apply_stocktake, cancel_stocktake)
+from ..utils.auth import login_required, admin_required
+from ..utils.date_ranges import day_range
+from ..utils.importers import iter_file_rows, ImportFileError
 
 bp = Blueprint('stock', __name__)
 
+# عدد الحركات المعروضة في صفحة السجل
+MOVEMENTS_PER_PAGE = 200
+
+# عدد سطور الجرد المعروضة في صفحة الجلسة
+STOCKTAKE_LINES_PER_PAGE = 500
+
 @bp.route('/stock/alerts')
 @login_required()
 def alerts():
     """تنبيهات المخزون المنخفض"""
     db = get_db()
-    
-    # الأصناف المنخفضة
-    low_stock_items = db.execute('''
-        SELECT i.*, c.name as category_name
-        FROM items i
-        LEFT JOIN categories c ON c.id = i.category_id
-        WHERE i.quantity <= i.reorder_level
-        ORDER BY i.quantity ASC
-    ''').fetchall()
-    
-    # الأصناف النافدة
-    out_of_stock_items = db.execute('''
-        SELECT i.*, c.name as category_name
-        FROM items i
-        LEFT JOIN categories c ON c.id = i.category_id
-        WHERE i.quantity = 0
-        ORDER BY i.name ASC
-    ''').fetchall()
-    
     return render_template('stock/alerts.html', 
-                         low_stock_items=low_stock_items,
-                         out_of_stock_items=out_of_stock_items)
+                         low_stock_items=get_low_stock_items(db),
+                         out_of_stock_items=get_low_stock_items(db, out_of_stock=True),
+                         recent_alerts=recent_stock_alerts(db))
 
 @bp.route('/stock/adjust')
 @login_required()
@@ -65,36 +63,203 @@ def adjust_post():
     quantity = int(request.form.get('quantity', 0))
     reason = request.form.get('reason', '').strip()
     
-    if not item_id or not adjustment_type or quantity <= 0:
+    if not item_id or adjustment_type not in ('add', 'subtract', 'set') or quantity <= 0:
         flash('يرجى ملء جميع الحقول بشكل صحيح', 'danger')
         return redirect(url_for('stock.adjust'))
     
     db = get_db()
-    item = db.execute('SELECT * FROM items WHERE id = ?', (item_id,)).fetchone()
-    
-    if not item:
-        flash('الصنف غير موجود', 'danger')
-        return redirect(url_for('stock.adjust'))
-    
     try:
+        # قراءة الكمية وتعديلها وتسجيل الحركة في معاملة واحدة
+        db.execute('BEGIN IMMEDIATE')
+        item = db.execute('SELECT * FROM items WHERE id = ?', (item_id,)).fetchone()
+        if not item:
+            db.rollback()
+            flash('الصنف غير موجود', 'danger')
+            return redirect(url_for('stock.adjust'))
+        
         if adjustment_type == 'add':
             new_quantity = item['quantity'] + quantity
-            db.execute('UPDATE items SET quantity = ? WHERE id = ?', (new_quantity, item_id))
-            flash(f'تم إضافة {quantity} قطعة إلى {item["name"]}. الكمية الجديدة: {new_quantity}', 'success')
+            message = f'تم إضافة {quantity} قطعة إلى {item["name"]}. الكمية الجديدة: {new_quantity}'
         elif adjustment_type == 'subtract':
             if item['quantity'] < quantity:
+                db.rollback()
                 flash(f'الكمية المتاحة ({item["quantity"]}) أقل من الكمية المطلوب خصمها ({quantity})', 'danger')
                 return redirect(url_for('stock.adjust'))
             new_quantity = item['quantity'] - quantity
-            db.execute('UPDATE items SET quantity = ? WHERE id = ?', (new_quantity, item_id))
-            flash(f'تم خصم {quantity} قطعة من {item["name"]}. الكمية الجديدة: {new_quantity}', 'success')
-        elif adjustment_type == 'set':
-            db.execute('UPDATE items SET quantity = ? WHERE id = ?', (quantity, item_id))
-            flash(f'تم تعيين كمية {item["name"]} إلى {quantity}', 'success')
+            message = f'تم خصم {quantity} قطعة من {item["name"]}. الكمية الجديدة: {new_quantity}'
+        else:
+            new_quantity = quantity
+            message = f'تم تعيين كمية {item["name"]} إلى {quantity}'
         
+        delta = {item['id']: new_quantity - item['quantity']}
+        db.execute('UPDATE items SET quantity = ? WHERE id = ?', (new_quantity, item['id']))
+        record_movements(db, delta, ADJUSTMENT, note=reason or None,
+                         user_id=session.get('user_id'), user_name=session.get('username'))
         db.commit()
+        stock_changed(db)
+        flash(message, 'success')
         return redirect(url_for('stock.adjust'))
         
     except Exception as e:
+        db.rollback()
         flash(f'خطأ في تعديل المخزون: {str(e)}', 'danger')
-        return redirect(url_for('stock.adjust'))
\ No newline at end of file
+        return redirect(url_for('stock.adjust'))
+
+@bp.route('/stock/movements')
+@login_required()
+def movements():
+    """سجل حركات المخزون ورصيد الأصناف في تاريخ معين"""
+    db = get_read_db()
+    item_id = request.args.get('item_id', type=int)
+    reason = request.args.get('reason', '')
+    date = request.args.get('date', '').strip()
+    
+    conditions = []
+    params = []
+    if item_id:
+        conditions.append('m.item_id = ?')
+        params.append(item_id)
+    if reason in REASON_LABELS:
+        conditions.append('m.reason = ?')
+        params.append(reason)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    movements = db.execute(f'''
+        SELECT m.*, i.name AS item_name
+        FROM stock_movements m
+        LEFT JOIN items i ON i.id = m.item_id
+        {where}
+        ORDER BY m.id DESC
+        LIMIT ?
+    ''', [*params, MOVEMENTS_PER_PAGE]).fetchall()
+    
+    # الرصيد في نهاية التاريخ المطلوب (آخر لقطة قبله + الحركات بعدها)
+    balances = None
+    if date:
+        try:
+            balances = stock_at(db, day_range(date)[1], [item_id] if item_id else None)
+        except ValueError:
+            flash('تاريخ غير صالح', 'danger')
+            date = ''
+    
+    items = db.execute('SELECT id, name, quantity FROM items ORDER BY name').fetchall()
+    return render_template('stock/movements.html',
+                         movements=movements,
+                         items=items,
+                         item_id=item_id,
+                         reason=reason,
+                         date=date,
+                         balances=balances,
+                         reason_labels=REASON_LABELS)
+
+@job_handler('stock_snapshot')
+def _stock_snapshot_job(job, params):
+    """لقطة أرصدة المخزون الدورية في الخلفية"""
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # عمليات أخرى قد تكون أرسلت نفس المهمة
+        if not snapshot_due(db, throttle=False):
+            db.rollback()
+            return {'skipped': True}
+        snapshot = take_stock_snapshot(db)
+        snapshot['pruned_alerts'] = prune_stock_alerts(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return snapshot
+
+@bp.route('/stock/stocktakes', methods=['GET', 'POST'])
+@login_required()
+def stocktakes():
+    """جلسات الجرد وفتح جلسة جديدة"""
+    db = get_db()
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip() or f"جرد {day_range()[0]}"
+        category_id = request.form.get('category_id', type=int)
+        try:
+            stocktake_id = open_stocktake(db, name, category_id, session.get('user_id'), session.get('username'))
+            db.commit()
+            flash('تم فتح جلسة الجرد وتجميد الكميات الحالية', 'success')
+            return redirect(url_for('stock.stocktake', stocktake_id=stocktake_id))
+        except Exception as e:
+            db.rollback()
+            flash(f'خطأ في فتح جلسة الجرد: {str(e)}', 'danger')
+    
+    categories = db.execute('SELECT id, name FROM categories ORDER BY name').fetchall()
+    return render_template('stock/stocktakes.html',
+                         stocktakes=list_stocktakes(db),
+                         categories=categories,
+                         status_labels=STATUS_LABELS)
+
+@bp.route('/stock/stocktakes/<int:stocktake_id>')
+@login_required()
+def stocktake(stocktake_id):
+    """جلسة جرد: الملخص والفروق ورفع ملف العد"""
+    db = get_read_db()
+    stocktake = get_stocktake(db, stocktake_id)
+    if not stocktake:
+        flash('جلسة الجرد غير موجودة', 'danger')
+        return redirect(url_for('stock.stocktakes'))
+    
+    variances_only = request.args.get('variances') == '1'
+    return render_template('stock/stocktake.html',
+                         stocktake=stocktake,
+                         summary=stocktake_summary(db, stocktake_id),
+                         lines=stocktake_lines(db, stocktake_id, variances_only, STOCKTAKE_LINES_PER_PAGE),
+                         lines_limit=STOCKTAKE_LINES_PER_PAGE,
+                         variances_only=variances_only,
+                         status_labels=STATUS_LABELS)
+
+@bp.route('/stock/stocktakes/<int:stocktake_id>/upload', methods=['POST'])
+@login_required()
+def stocktake_upload(stocktake_id):
+    """رفع ملف عد (CSV أو Excel): عمود sku أو barcode أو item_id وعمود counted"""
+    file = request.files.get('file')
+    mode = request.form.get('mode', 'set')
+    if not file or file.filename == '' or mode not in COUNT_MODES:
+        flash('لم يتم اختيار ملف', 'danger')
+        return redirect(url_for('stock.stocktake', stocktake_id=stocktake_id))
+    
+    db = get_db()
+    try:
+        report = new_count_report()
+        counts = counts_from_rows(iter_file_rows(file.stream, file.filename), report)
+        report = record_counts(db, stocktake_id, counts, mode, report)
+        flash(f"تم تسجيل عد {report['recorded']} صنف", 'success')
+        for error in report['errors'][:10]:
+            flash(f"السطر {error['row']}: {error['message']}", 'warning')
+        if report['error_count'] > 10:
+            flash(f"و {report['error_count'] - 10} أخطاء أخرى", 'warning')
+    except (ImportFileError, StocktakeError) as e:
+        flash(f'خطأ في رفع ملف العد: {e}', 'danger')
+    except Exception as e:
+        flash(f'خطأ في معالجة الملف: {str(e)}', 'danger')
+    return redirect(url_for('stock.stocktake', stocktake_id=stocktake_id))
+
+@bp.route('/stock/stocktakes/<int:stocktake_id>/apply', methods=['POST'])
+@admin_required
+def stocktake_apply(stocktake_id):
+    """اعتماد الجرد وتطبيق الفروق على المخزون"""
+    db = get_db()
+    try:
+        result = apply_stocktake(db, stocktake_id, session.get('user_id'), session.get('username'))
+        flash(f"تم اعتماد الجرد وتعديل {result['items']} صنف (صافي التغيير {result['net_change']:+d})", 'success')
+    except StocktakeError as e:
+        flash(str(e), 'danger')
+    except Exception as e:
+        flash(f'خطأ في اعتماد الجرد: {str(e)}', 'danger')
+    return redirect(url_for('stock.stocktake', stocktake_id=stocktake_id))
+
+@bp.route('/stock/stocktakes/<int:stocktake_id>/cancel', methods=['POST'])
+@admin_required
+def stocktake_cancel(stocktake_id):
+    """إلغاء جلسة الجرد دون تعديل المخزون"""
+    db = get_db()
+    try:
+        cancel_stocktake(db, stocktake_id)
+        flash('تم إلغاء جلسة الجرد', 'success')
+    except StocktakeError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('stock.stocktake', stocktake_id=stocktake_id))
@@ -16,6 +16,11 @@ class Config:
     
     # إعدادات قاعدة البيانات
     DATABASE = os.environ.get('DATABASE_URL') or 'inventory.db'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))        # اتصالات الكتابة لكل عملية
+    DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', 5))  # اتصالات القراءة لكل عملية
+    DB_BUSY_TIMEOUT = 5000          # بالمللي ثانية
+    DB_CACHE_SIZE = -16000          # 16MB لكل اتصال
+    DB_MMAP_SIZE = 256 * 1024 * 1024
     
     # إعدادات التطبيق
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
@@ -31,8 +36,37 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     UPLOAD_FOLDER = 'uploads'
     
+    # إعدادات أرقام الفواتير
+    POS_INVOICE_PREFIX = os.environ.get('POS_INVOICE_PREFIX', 'POS-')
+    INVOICE_PREFIX = os.environ.get('INVOICE_PREFIX', 'INV-')
+    INVOICE_BLOCK_SIZE = int(os.environ.get('INVOICE_BLOCK_SIZE', 0))  # 0 = عداد مشترك بدون فجوات
+    
     # إعدادات التقارير
     REPORTS_PER_PAGE = 50
+    DASHBOARD_CACHE_TTL = 10  # أقصى مدة (بالثواني) قبل التحقق من تغير بيانات لوحة التحكم
+    
+    # إعدادات سجل حركات المخزون
+    STOCK_SNAPSHOT_INTERVAL = int(os.environ.get('STOCK_SNAPSHOT_INTERVAL', 24))  # ساعات بين لقطات الأرصدة
+    STOCK_SNAPSHOT_KEEP = int(os.environ.get('STOCK_SNAPSHOT_KEEP', 90))  # عدد اللقطات المحتفظ بها
+    STOCK_ALERTS_KEEP = int(os.environ.get('STOCK_ALERTS_KEEP', 5000))  # عدد تنبيهات المخزون المحتفظ بها
+    
+    # إعدادات البث الحي (SSE) - يحتاج خادماً بخيوط أو gevent (gunicorn --threads أو -k gevent)
+    EVENTS_HEARTBEAT = 15           # ثوانٍ بين رسائل إبقاء الاتصال
+    EVENTS_POLL_INTERVAL = 5        # ثوانٍ بين التحقق من تغييرات العمليات الأخرى
+    EVENTS_STREAM_TIMEOUT = 600     # مدة البث قبل أن يعيد المتصفح الاتصال
+    
+    # إعدادات المهام الخلفية
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR')  # الافتراضي: job_results بجانب قاعدة البيانات
+    JOB_RESULT_TTL = 24  # ساعات الاحتفاظ بنتائج المهام
+    JOB_STALE_AFTER = 60  # دقائق بلا تقدم قبل اعتبار المهمة المنتظرة أو الجارية متوقفة
+    
+    # إعدادات النسخ الاحتياطي
+    BACKUP_DIR = os.environ.get('BACKUP_DIR')  # الافتراضي: backups بجانب قاعدة البيانات
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 10))  # عدد النسخ المحتفظ بها
+    BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION')  # zstd أو gzip (الافتراضي: zstd إن توفر)
+    BACKUP_PAGES = 4096             # صفحات كل دفعة نسخ
+    BACKUP_STEP_SLEEP = 0.005       # استراحة بين الدفعات بالثواني
     
     # إعدادات النظام
     APP_NAME = 'نظام إدارة المخزون - مخزن الزينة'
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""إعدادات الاختبارات: تطبيق بقاعدة بيانات مؤقتة لكل اختبار"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.database import get_db, init_db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app()
+    app.config.update(
+        TESTING=True,
+        DATABASE=str(tmp_path / 'inventory.db'),
+        BACKUP_DIR=str(tmp_path / 'backups'),
+        JOB_RESULTS_DIR=str(tmp_path / 'jobs'),
+    )
+    with app.app_context():
+        init_db()
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db(app):
+    return get_db()
+
+
+@pytest.fixture
+def make_item(db):
+    """إضافة صنف وإرجاع معرفه"""
+    def make_item(name='صنف', quantity=10, cost_price=5, selling_price=8):
+        item_id = db.execute('''
+            INSERT INTO items (name, quantity, cost_price, selling_price)
+            VALUES (?, ?, ?, ?)
+        ''', (name, quantity, cost_price, selling_price)).lastrowid
+        db.commit()
+        return item_id
+    return make_item
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""النسخ الاحتياطي: نسخة كاملة ثم تزايدية ثم الاستعادة من كل حلقة"""
+
+import os
+import time
+
+import pytest
+
+from app.models.backups import (BackupError, create_backup, create_incremental_backup,
+                                get_backup_path, restore_backup)
+from app.models.checkout import checkout
+
+
+def _state(db):
+    """محتوى الجداول التي تهم المقارنة (بدون أرقام الإصدارات)"""
+    queries = (
+        'SELECT id, name, quantity, cost_price, selling_price FROM items ORDER BY id',
+        'SELECT id, invoice_number, final_amount FROM invoices ORDER BY id',
+        'SELECT id, invoice_id, item_id, quantity, total_price FROM sales ORDER BY id',
+        'SELECT prefix, last_value FROM invoice_sequences ORDER BY prefix',
+        'SELECT day, item_id, quantity, revenue FROM daily_item_sales ORDER BY day, item_id',
+    )
+    return [[tuple(row) for row in db.execute(query)] for query in queries]
+
+
+def _next_second():
+    # أسماء النسخ بدقة الثانية
+    time.sleep(1.05)
+
+
+def test_full_and_incremental_restore_round_trip(db, make_item):
+    first = make_item(name='أ', quantity=10)
+    checkout(db, [{'item_id': first, 'quantity': 2, 'unit_price': 8}], 'POS-')
+    full = create_backup()
+    full_state = _state(db)
+
+    _next_second()
+    second = make_item(name='ب', quantity=4)
+    checkout(db, [{'item_id': second, 'quantity': 1, 'unit_price': 20}], 'POS-')
+    first_increment = create_incremental_backup()
+    first_state = _state(db)
+    assert first_increment['kind'] == 'incremental'
+    assert first_increment['parent'] == full['backup_name']
+
+    _next_second()
+    db.execute('UPDATE items SET selling_price = 9 WHERE id = ?', (first,))
+    db.execute('DELETE FROM items WHERE id = ?', (make_item(name='ج'),))
+    db.commit()
+    checkout(db, [{'item_id': first, 'quantity': 3, 'unit_price': 9}], 'POS-')
+    second_increment = create_incremental_backup()
+    second_state = _state(db)
+    assert second_increment['parent'] == first_increment['backup_name']
+    assert second_increment['base'] == full['backup_name']
+
+    # تغييرات بعد آخر نسخة يجب أن تختفي بعد الاستعادة
+    checkout(db, [{'item_id': second, 'quantity': 3, 'unit_price': 20}], 'POS-')
+    make_item(name='د')
+
+    for manifest, expected, chain_length in ((second_increment, second_state, 3),
+                                             (first_increment, first_state, 2),
+                                             (full, full_state, 1)):
+        _next_second()
+        result = restore_backup(manifest['backup_name'])
+        assert result['chain_length'] == chain_length
+        assert _state(db) == expected
+
+
+def test_restore_rejects_corrupted_chain(db, make_item):
+    make_item()
+    create_backup()
+    _next_second()
+    make_item()
+    increment = create_incremental_backup()
+    path = get_backup_path(increment['backup_name'])
+    with open(path, 'r+b') as backup:
+        backup.seek(os.path.getsize(path) // 2)
+        data = backup.read(1)
+        backup.seek(-1, os.SEEK_CUR)
+        backup.write(bytes([data[0] ^ 1]))
+
+    before = _state(db)
+    with pytest.raises(BackupError):
+        restore_backup(increment['backup_name'])
+    assert _state(db) == before
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""إتمام البيع: منع البيع بأكثر من المتاح والتراجع الكامل عند الفشل"""
+
+import pytest
+
+from app.models.checkout import CheckoutError, checkout
+
+
+def _counts(db):
+    return tuple(db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                 for table in ('invoices', 'sales', 'daily_item_sales', 'stock_movements'))
+
+
+def _quantity(db, item_id):
+    return db.execute('SELECT quantity FROM items WHERE id = ?', (item_id,)).fetchone()[0]
+
+
+def test_checkout_decrements_stock(db, make_item):
+    item_id = make_item(quantity=5)
+    result = checkout(db, [{'item_id': item_id, 'quantity': 2, 'unit_price': 8}], 'POS-')
+    assert result['invoice_number'] == 'POS-000001'
+    assert result['final_amount'] == 16
+    assert _quantity(db, item_id) == 3
+
+
+def test_oversell_is_rejected_and_rolled_back(db, make_item):
+    first = make_item(name='أ', quantity=5)
+    second = make_item(name='ب', quantity=1)
+    before = _counts(db)
+    with pytest.raises(CheckoutError) as error:
+        # الصنف المكرر يجمع: 3 + 3 أكثر من المتاح
+        checkout(db, [
+            {'item_id': first, 'quantity': 3, 'unit_price': 8},
+            {'item_id': first, 'quantity': 3, 'unit_price': 8},
+            {'item_id': second, 'quantity': 1, 'unit_price': 8},
+        ], 'POS-')
+    assert len(error.value.problems) == 1
+    assert not db.in_transaction
+    assert _counts(db) == before
+    assert (_quantity(db, first), _quantity(db, second)) == (5, 1)
+
+
+def test_stock_changed_during_checkout_rolls_back(db, make_item):
+    item_id = make_item(quantity=5)
+    other_id = make_item(quantity=5)
+    before = _counts(db)
+    # محاكاة عامل آخر يبيع المخزون بعد التحقق وقبل الخصم المشروط
+    db.execute(f'''
+        CREATE TEMP TRIGGER take_stock AFTER INSERT ON invoices
+        BEGIN UPDATE items SET quantity = 0 WHERE id = {item_id}; END
+    ''')
+    try:
+        with pytest.raises(CheckoutError, match='تغير المخزون'):
+            checkout(db, [
+                {'item_id': item_id, 'quantity': 2, 'unit_price': 8},
+                {'item_id': other_id, 'quantity': 1, 'unit_price': 8},
+            ], 'POS-')
+    finally:
+        db.execute('DROP TRIGGER take_stock')
+    assert _counts(db) == before
+    assert (_quantity(db, item_id), _quantity(db, other_id)) == (5, 5)
+    # رقم الفاتورة المحجوز أُلغي مع المعاملة
+    result = checkout(db, [{'item_id': item_id, 'quantity': 1, 'unit_price': 8}], 'POS-')
+    assert result['invoice_number'] == 'POS-000001'
+
+
+@pytest.mark.parametrize('cart', [
+    [{'item_id': 1, 'quantity': 0}],
+    [{'item_id': 1, 'quantity': 'x'}],
+    [{'item_id': 1, 'quantity': 1.5}],
+    [{'item_id': 1, 'quantity': '1.5'}],
+    [{'quantity': 1}],
+    [],
+])
+def test_invalid_cart_is_rejected(db, make_item, cart):
+    make_item()
+    before = _counts(db)
+    with pytest.raises(CheckoutError):
+        checkout(db, cart, 'POS-')
+    assert _counts(db) == before
+
+
+def test_missing_price_uses_item_selling_price(db, make_item):
+    item_id = make_item(selling_price=8)
+    result = checkout(db, [{'item_id': item_id, 'quantity': 2}], 'POS-', fill_selling_price=True)
+    assert result['final_amount'] == 16
+    assert db.execute('SELECT total_price FROM sales').fetchone()[0] == 16
+
+
+def test_missing_price_without_selling_price_is_rejected(db, make_item):
+    item_id = make_item(selling_price=0)
+    before = _counts(db)
+    with pytest.raises(CheckoutError, match='لا يوجد سعر بيع'):
+        checkout(db, [{'item_id': item_id, 'quantity': 1}], 'POS-', fill_selling_price=True)
+    assert _counts(db) == before
+
+
+def test_fill_selling_price_rejects_conflicting_prices(db, make_item):
+    item_id = make_item(selling_price=0)
+    with pytest.raises(CheckoutError, match='أسعار مختلفة'):
+        checkout(db, [
+            {'item_id': item_id, 'quantity': 1, 'unit_price': 8},
+            {'item_id': item_id, 'quantity': 1, 'unit_price': 9},
+        ], 'POS-', fill_selling_price=True)
+    assert tuple(db.execute('SELECT selling_price, quantity FROM items').fetchone()) == (0, 10)
+
+    checkout(db, [
+        {'item_id': item_id, 'quantity': 1, 'unit_price': 8},
+        {'item_id': item_id, 'quantity': 1, 'unit_price': 8},
+    ], 'POS-', fill_selling_price=True)
+    assert tuple(db.execute('SELECT selling_price, quantity FROM items').fetchone()) == (8, 8)
+
+
+def test_integral_float_quantity_is_accepted(db, make_item):
+    item_id = make_item(quantity=5)
+    checkout(db, [{'item_id': item_id, 'quantity': 2.0, 'unit_price': 8}], 'POS-')
+    assert _quantity(db, item_id) == 3
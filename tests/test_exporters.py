@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""التصدير: أخطاء Excel تظهر قبل إرسال الاستجابة"""
+
+import io
+
+import pytest
+
+from app.utils.exporters import OPENPYXL_AVAILABLE, export_response
+
+pytestmark = pytest.mark.skipif(not OPENPYXL_AVAILABLE, reason='openpyxl غير مثبتة')
+
+
+def _failing_rows():
+    yield [1, 'أ']
+    raise RuntimeError('cursor failed')
+
+
+def test_xlsx_error_is_raised_before_response(app):
+    with app.test_request_context():
+        with pytest.raises(RuntimeError, match='cursor failed'):
+            export_response('items', ['id', 'name'], _failing_rows(), 'xlsx')
+
+
+def test_xlsx_response_contains_all_rows(app):
+    from openpyxl import load_workbook
+
+    rows = [[n, f'صنف {n}'] for n in range(2500)]
+    with app.test_request_context():
+        response = export_response('items', ['id', 'name'], iter(rows), 'xlsx', sheet_title='items')
+        data = b''.join(response.response)
+        response.close()
+    sheet = load_workbook(io.BytesIO(data), read_only=True)['items']
+    assert [list(row) for row in sheet.iter_rows(values_only=True)] == [['id', 'name']] + rows
+
+
+def test_export_view_reports_xlsx_errors(app, client, monkeypatch):
+    from app.views import data_management
+
+    monkeypatch.setattr(data_management, 'iter_rows', lambda cursor, columns: _failing_rows())
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='owner', role='owner')
+    response = client.get('/data-management/export?type=items&format=xlsx')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/data-management')
+    with client.session_transaction() as session:
+        assert 'cursor failed' in session['_flashes'][0][1]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""استيراد الأصناف: إعادة الاستيراد لا تمحو متوسط التكلفة"""
+
+import pytest
+
+from app.models.costing import receive_stock
+from app.utils.importers import import_items
+
+
+def _import(db, **row):
+    row = {'name': 'صنف', 'sku': 'A1', **{key: str(value) for key, value in row.items()}}
+    report = import_items(db, [(2, row)])
+    assert report['error_count'] == 0
+    return db.execute("SELECT quantity, cost_price FROM items WHERE sku = 'A1'").fetchone()
+
+
+@pytest.fixture
+def item(db):
+    _import(db, quantity=10, cost_price=4)
+    item_id = db.execute("SELECT id FROM items WHERE sku = 'A1'").fetchone()[0]
+    receive_stock(db, item_id, 10, 6)
+    db.commit()
+    return item_id
+
+
+def test_reimport_keeps_average_cost(db, item):
+    assert tuple(_import(db, quantity=20, cost_price=9)) == (20, 5)
+    assert tuple(_import(db, quantity=15, cost_price=9)) == (15, 5)
+
+
+def test_reimport_increase_enters_average_at_file_cost(db, item):
+    # 20 وحدة بمتوسط 5 + 5 وحدات بتكلفة 10
+    assert tuple(_import(db, quantity=25, cost_price=10)) == (25, 6)
+
+
+def test_reimport_without_stock_takes_file_cost(db, item):
+    db.execute('UPDATE items SET quantity = 0 WHERE id = ?', (item,))
+    assert tuple(_import(db, quantity=3, cost_price=7)) == (3, 7)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""قائمة الفواتير: البحث والترقيم بالمؤشر مع الإجماليات في كل صفحة"""
+
+import re
+
+import pytest
+
+from app.views.invoices import _invoice_filters
+
+
+@pytest.fixture
+def invoices(db):
+    rows = [
+        ('POS-000001', 'Ahmed Ali', '0912345678', 100, 'cash', '2025-01-01 10:00:00'),
+        ('POS-000002', 'Sara Hassan', '0923456789', 50, 'card', '2025-01-02 10:00:00'),
+        ('INV-000001', 'Omar ali', '0934567890', 25, 'cash', '2025-01-03 10:00:00'),
+        ('INV-000002', 'Mona', '0912000000', 10, 'cash', '2025-01-04 10:00:00'),
+        ('INV-000003', None, None, 5, 'card', '2025-01-05 10:00:00'),
+    ]
+    db.executemany('''
+        INSERT INTO invoices (invoice_number, customer_name, customer_phone, total_amount,
+                              final_amount, payment_method, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(number, name, phone, amount, amount, method, created_at)
+          for number, name, phone, amount, method, created_at in rows])
+    db.commit()
+
+
+def _numbers(db, customer='', invoice=''):
+    where, params = _invoice_filters('', customer, invoice)
+    return sorted(row[0] for row in db.execute(
+        f'SELECT invoice_number FROM invoices i WHERE {where}', params))
+
+
+def test_customer_search_matches_part_of_name_in_any_case(db, invoices):
+    assert _numbers(db, customer='ali') == ['INV-000001', 'POS-000001']
+    assert _numbers(db, customer='HASSAN') == ['POS-000002']
+
+
+def test_phone_and_invoice_search_match_prefix(db, invoices):
+    assert _numbers(db, customer='0912') == ['INV-000002', 'POS-000001']
+    assert _numbers(db, customer='2345') == []
+    assert _numbers(db, invoice='INV-') == ['INV-000001', 'INV-000002', 'INV-000003']
+    assert _numbers(db, invoice='2') == ['INV-000002', 'POS-000002']
+
+
+def test_summary_is_shown_on_every_page(app, client, invoices):
+    app.config['REPORTS_PER_PAGE'] = 2
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='owner', role='owner')
+
+    url = '/invoices/invoices'
+    pages = 0
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        pages += 1
+        assert 'إجمالي الفواتير' in html
+        assert re.search(r'<h4 class="mb-0">5</h4>', html)
+        assert '190 ج.س' in html
+        next_link = re.search(r'href="([^"]*cursor=[^"]*)"[^>]*>\s*الصفحة التالية', html)
+        url = next_link.group(1).replace('&amp;', '&') if next_link else None
+        # الإجماليات تنقل مع الرابط بدلاً من إعادة حسابها
+        assert url is None or 'count=5' in url
+    assert pages == 3
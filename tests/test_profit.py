@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""تقرير الأرباح: الأشهر الكاملة من monthly_item_sales وأيام الطرفين من التجميع اليومي"""
+
+import pytest
+
+from app.models.profit import _item_source, profit_report
+from app.models.rollups import _rebuild_monthly_item_sales, record_sales
+
+# أيام تغطي حدود الأشهر والسنة (الشهر 2024-02 كبيس)
+SALE_DAYS = ('2023-12-31', '2024-01-01', '2024-01-15', '2024-01-31', '2024-02-01',
+             '2024-02-29', '2024-03-01', '2024-03-02', '2024-04-30', '2024-05-01')
+
+RANGES = [
+    (None, None),
+    ('2024-01-01', None),
+    (None, '2024-03-01'),
+    ('2024-01-01', '2024-03-01'),    # أشهر كاملة فقط
+    ('2024-01-15', '2024-03-02'),    # طرفان جزئيان
+    ('2023-12-31', '2024-05-01'),
+    ('2024-01-31', '2024-02-01'),    # يوم واحد
+    ('2024-02-10', '2024-02-29'),    # داخل شهر واحد
+    ('2024-02-29', '2024-03-02'),    # يعبر حد الشهر بدون شهر كامل
+    ('2024-03-01', '2024-03-01'),    # نطاق فارغ
+]
+
+
+@pytest.fixture
+def sales(db, make_item):
+    items = [make_item(name=f'صنف {n}') for n in range(3)]
+    for n, day in enumerate(SALE_DAYS):
+        record_sales(db, f'{day} 10:00:00', [
+            {'item_id': item_id, 'quantity': n + i + 1, 'revenue': 10.5 * (n + 1) + i, 'cost': 4.25 * (n + i)}
+            for i, item_id in enumerate(items[:1 + n % 3])
+        ])
+    db.commit()
+    return items
+
+
+def _daily_report(db, start, end):
+    """نفس التقرير مباشرة من daily_item_sales"""
+    where = 'line_count > 0'
+    params = []
+    if start:
+        where += ' AND day >= ?'
+        params.append(start)
+    if end:
+        where += ' AND day < ?'
+        params.append(end)
+    return {
+        row[0]: tuple(row[1:])
+        for row in db.execute(f'''
+            SELECT item_id, SUM(quantity), SUM(revenue), SUM(cost), SUM(line_count), SUM(invoice_count)
+            FROM daily_item_sales WHERE {where} GROUP BY item_id
+        ''', params)
+    }
+
+
+def _report(db, start, end):
+    return {
+        row['key']: (row['quantity'], row['revenue'], row['cost'], row['line_count'], row['invoice_count'])
+        for row in profit_report(db, 'item', start, end)
+    }
+
+
+@pytest.mark.parametrize('start,end', RANGES)
+def test_item_report_matches_daily_rollup(db, sales, start, end):
+    # المبالغ مضاعفات 0.25 فالمجاميع دقيقة بأي ترتيب جمع
+    assert _report(db, start, end) == _daily_report(db, start, end)
+
+
+@pytest.mark.parametrize('start,end', RANGES)
+def test_item_report_after_monthly_rebuild(db, sales, start, end):
+    db.execute('DELETE FROM monthly_item_sales')
+    _rebuild_monthly_item_sales(db)
+    assert _report(db, start, end) == _daily_report(db, start, end)
+
+
+def test_item_source_uses_months_only_for_full_months():
+    source, _, params = _item_source('2024-01-15', '2024-03-02')
+    assert 'monthly_item_sales' in source
+    assert params == ['2024-02', '2024-03', '2024-01-15', '2024-02-01', '2024-03-01', '2024-03-02']
+
+    source, _, params = _item_source('2024-01-01', '2024-03-01')
+    assert 'daily_item_sales' not in source
+    assert params == ['2024-01', '2024-03']
+
+    source, _, params = _item_source('2024-02-10', '2024-02-29')
+    assert 'monthly_item_sales' not in source
+    assert params == ['2024-02-10', '2024-02-29']
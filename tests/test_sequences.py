@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""أرقام الفواتير: العداد المشترك وكتل الأرقام لكل جهاز"""
+
+from app.models.sequences import next_invoice_number, next_invoice_value
+
+
+def test_shared_counter_continues_from_existing_invoices(db):
+    db.execute('''
+        INSERT INTO invoices (invoice_number, total_amount, final_amount)
+        VALUES ('INV-000041', 0, 0), ('INV-20250910120000', 0, 0)
+    ''')
+    # الأرقام القديمة المبنية على التاريخ لا تدخل في الحساب
+    assert next_invoice_number(db, 'INV-') == 'INV-000042'
+    assert next_invoice_number(db, 'INV-') == 'INV-000043'
+    assert next_invoice_number(db, 'POS-') == 'POS-000001'
+
+
+def test_blocks_are_allocated_per_terminal(db):
+    values = {
+        terminal: [next_invoice_value(db, 'POS-', terminal, 3) for _ in range(2)]
+        for terminal in ('A', 'B')
+    }
+    assert values == {'A': [1, 2], 'B': [4, 5]}
+
+    # انتهاء الكتلة يحجز كتلة جديدة من العداد المشترك بعد آخر كتلة
+    assert next_invoice_value(db, 'POS-', 'A', 3) == 3
+    assert next_invoice_value(db, 'POS-', 'A', 3) == 7
+    # البيع بدون جهاز يأخذ من العداد المشترك مباشرة
+    assert next_invoice_value(db, 'POS-') == 10
+    assert next_invoice_value(db, 'POS-', 'B', 3) == 6
+    assert next_invoice_value(db, 'POS-', 'B', 3) == 11
+
+
+def test_rolled_back_block_is_not_lost(db):
+    db.execute('BEGIN IMMEDIATE')
+    assert next_invoice_value(db, 'POS-', 'A', 5) == 1
+    db.rollback()
+    assert next_invoice_value(db, 'POS-', 'B', 5) == 1
+    assert next_invoice_value(db, 'POS-', 'A', 5) == 6